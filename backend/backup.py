@@ -0,0 +1,67 @@
+#!/usr/bin/env python3
+"""
+Backup and restore of the whole PYME database from the command line.
+
+Usage:
+    python backup.py backup [--destino DIR] [--formato ndjson|bson] [--colecciones a,b]
+    python backup.py restore DIR [--colecciones a,b] [--reemplazar]
+
+The same routines run behind POST /api/admin/backup and /api/admin/restore.
+"""
+
+import argparse
+import asyncio
+from datetime import datetime
+from pathlib import Path
+
+from server import (
+    BACKUP_DIR, BACKUP_FORMATS, client, current_tenant, detectar_transacciones, respaldar_base, restaurar_base
+)
+
+
+def split_colecciones(valor):
+    return [c.strip() for c in valor.split(",") if c.strip()] if valor else None
+
+
+async def run_backup(args):
+    await detectar_transacciones()
+    destino = Path(args.destino) if args.destino else BACKUP_DIR / f"backup-{datetime.utcnow():%Y%m%dT%H%M%S}"
+    manifest = await respaldar_base(destino, args.formato, split_colecciones(args.colecciones))
+    print(f"Backup written to {destino} ({'consistent snapshot' if manifest['consistente'] else 'no snapshot'})")
+    for nombre, entrada in manifest["colecciones"].items():
+        print(f"  {nombre:<28}{entrada['documentos']:>10} docs {entrada['bytes'] / 1e6:>10.2f} MB")
+
+
+async def run_restore(args):
+    await detectar_transacciones()
+    resultado = await restaurar_base(Path(args.origen), split_colecciones(args.colecciones), args.reemplazar)
+    print(f"Restored {resultado['origen']} (backup of {resultado['fecha_backup']})")
+    for nombre, entrada in resultado["colecciones"].items():
+        print(f"  {nombre:<28}{entrada['insertados']:>10} inserted {entrada['duplicados']:>8} already present")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Backup and restore of the PYME database")
+    parser.add_argument("--tenant", help="limit the operation to one tenant in multi-tenant mode")
+    subparsers = parser.add_subparsers(dest="comando", required=True)
+
+    backup = subparsers.add_parser("backup")
+    backup.add_argument("--destino")
+    backup.add_argument("--formato", choices=list(BACKUP_FORMATS), default="ndjson")
+    backup.add_argument("--colecciones")
+
+    restore = subparsers.add_parser("restore")
+    restore.add_argument("origen")
+    restore.add_argument("--colecciones")
+    restore.add_argument("--reemplazar", action="store_true", help="empty each collection before loading it")
+
+    args = parser.parse_args()
+    current_tenant.set(args.tenant)
+    try:
+        asyncio.run(run_backup(args) if args.comando == "backup" else run_restore(args))
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
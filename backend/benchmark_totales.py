@@ -0,0 +1,55 @@
+#!/usr/bin/env python3
+"""
+Micro-benchmark for the server-side totals engine (calcular_totales)
+Usage: python benchmark_totales.py [lineas ...]
+"""
+
+import random
+import sys
+import time
+
+from server import ItemPedido, calcular_totales, calcular_totales_lote
+
+ALICUOTAS = [21.0, 10.5, 27.0, 0.0]
+
+
+def build_items(lineas):
+    items = []
+    for i in range(lineas):
+        cantidad = random.randint(1, 50)
+        precio = round(random.uniform(1, 5000), 2)
+        items.append(ItemPedido(
+            descripcion=f"Item {i}",
+            cantidad=cantidad,
+            precio_unitario=precio,
+            subtotal=round(cantidad * precio, 2),
+            alicuota_iva=random.choice(ALICUOTAS)
+        ))
+    return items
+
+
+def bench(label, fn, repeticiones=20):
+    fn()  # warm-up
+    tiempos = []
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        fn()
+        tiempos.append((time.perf_counter() - inicio) * 1000)
+    tiempos.sort()
+    print(f"{label:<40} p50={tiempos[len(tiempos) // 2]:8.2f} ms  max={tiempos[-1]:8.2f} ms")
+
+
+def main():
+    tamanios = [int(arg) for arg in sys.argv[1:]] or [100, 1000, 5000, 20000]
+    random.seed(42)
+    for lineas in tamanios:
+        items = build_items(lineas)
+        bench(f"factura de {lineas} lineas", lambda: calcular_totales(items, "A"))
+
+    # Mass billing run: 2,000 facturas of 25 lines each in one call
+    lote = [(build_items(25), "A", "Responsable Inscripto") for _ in range(2000)]
+    bench("lote de 2000 facturas x 25 lineas", lambda: calcular_totales_lote(lote), repeticiones=5)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,94 @@
+#!/usr/bin/env python3
+"""
+Measure document and index size of the v1 (verbose) vs v2 (compact) storage layout
+on a synthetic dataset of facturas.
+
+Usage:
+    python medir_almacenamiento.py [--facturas N] [--items N]           # BSON sizes only
+    python medir_almacenamiento.py --mongo [--facturas N] [--items N]   # collStats on a scratch DB
+"""
+
+import argparse
+import asyncio
+import random
+from datetime import datetime, timedelta
+
+import bson
+
+from server import SCHEMA_VERSION, Factura, ItemPedido, client, os, to_storage
+
+
+def synthetic_facturas(cantidad, items_por_factura):
+    random.seed(7)
+    clientes = [(f"cliente-{i}", f"Cliente {i} SRL") for i in range(200)]
+    articulos = [(f"articulo-{i}", f"Articulo de catalogo {i}", round(random.uniform(10, 900), 2)) for i in range(2000)]
+    for n in range(cantidad):
+        cliente_id, cliente_nombre = random.choice(clientes)
+        items = []
+        for _ in range(items_por_factura):
+            articulo_id, descripcion, precio = random.choice(articulos)
+            cantidad_item = random.randint(1, 20)
+            items.append(ItemPedido(
+                articulo_id=articulo_id,
+                descripcion=descripcion,
+                cantidad=cantidad_item,
+                precio_unitario=precio,
+                subtotal=round(cantidad_item * precio, 2)
+            ))
+        subtotal = round(sum(item.subtotal for item in items), 2)
+        yield Factura(
+            numero_factura=f"FAC-{n:08d}",
+            cliente_id=cliente_id,
+            cliente_nombre=cliente_nombre,
+            items=items,
+            subtotal=subtotal,
+            impuestos=round(subtotal * 0.21, 2),
+            total=round(subtotal * 1.21, 2),
+            fecha_vencimiento=datetime.utcnow() + timedelta(days=30)
+        )
+
+
+def bson_sizes(facturas):
+    v1 = [len(bson.encode(f.dict())) for f in facturas]
+    v2 = [len(bson.encode(to_storage(f))) for f in facturas]
+    return v1, v2
+
+
+async def coll_stats(facturas):
+    scratch = client[f"{os.environ['DB_NAME']}_layout_bench"]
+    stats = {}
+    for name, documents in [("v1", [f.dict() for f in facturas]), (f"v{SCHEMA_VERSION}", [to_storage(f) for f in facturas])]:
+        collection = scratch[f"facturas_{name}"]
+        await collection.drop()
+        for i in range(0, len(documents), 1000):
+            await collection.insert_many(documents[i:i + 1000])
+        await collection.create_index([("id", 1)])
+        await collection.create_index([("cliente_id", 1), ("fecha_emision", -1)])
+        await collection.create_index([("estado", 1), ("fecha_emision", -1)])
+        stats[name] = await scratch.command("collStats", collection.name)
+    await client.drop_database(scratch.name)
+    return stats
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--facturas", type=int, default=10000)
+    parser.add_argument("--items", type=int, default=12)
+    parser.add_argument("--mongo", action="store_true")
+    args = parser.parse_args()
+
+    facturas = list(synthetic_facturas(args.facturas, args.items))
+    v1, v2 = bson_sizes(facturas)
+    print(f"{args.facturas} facturas x {args.items} items")
+    print(f"BSON v1: total {sum(v1) / 1e6:8.2f} MB  avg {sum(v1) / len(v1):8.0f} B")
+    print(f"BSON v{SCHEMA_VERSION}: total {sum(v2) / 1e6:8.2f} MB  avg {sum(v2) / len(v2):8.0f} B  ({100 * (1 - sum(v2) / sum(v1)):.1f}% smaller)")
+
+    if args.mongo:
+        stats = asyncio.run(coll_stats(facturas))
+        for name, s in stats.items():
+            print(f"collStats {name}: size {s['size'] / 1e6:8.2f} MB  storageSize {s['storageSize'] / 1e6:8.2f} MB  "
+                  f"totalIndexSize {s['totalIndexSize'] / 1e6:8.2f} MB")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,1301 @@
+"""
+In-memory storage engine implementing the part of the Motor API that server.py uses.
+
+Selected with STORAGE_ENGINE=memory. Handlers keep talking to ``db`` exactly as
+they do with MongoDB, so the API suite and the benchmarks run in-process
+without a database server, and handler CPU cost can be measured on its own.
+
+Documents live in a dict keyed by _id (the primary index). Every field named
+in a create_index call gets a value -> ids map that narrows equality and $in
+filters before the full filter is checked, and unique indexes (including
+partial ones) are enforced. Writes behave like pymongo: datetimes are stored
+as naive UTC truncated to milliseconds, inserts add _id to the caller's
+document and errors are raised as DuplicateKeyError / BulkWriteError.
+
+There are no transactions: the hello command reports a standalone server, so
+detectar_transacciones falls back to sequential writes.
+"""
+
+import re
+import time
+from datetime import datetime, timedelta, timezone
+
+from bson import ObjectId
+from pymongo import DeleteMany, DeleteOne, InsertOne, ReplaceOne, ReturnDocument, UpdateMany, UpdateOne
+from pymongo.errors import BulkWriteError, DuplicateKeyError, InvalidOperation, OperationFailure
+from pymongo.results import BulkWriteResult, DeleteResult, InsertManyResult, InsertOneResult, UpdateResult
+
+_MISSING = object()
+
+
+# Values ----------------------------------------------------------------------
+
+def _to_storage(value):
+    """Copy a value the way it round-trips through BSON."""
+    if isinstance(value, dict):
+        return {k: _to_storage(v) for k, v in value.items()}
+    if isinstance(value, (list, tuple)):
+        return [_to_storage(v) for v in value]
+    if isinstance(value, datetime):
+        if value.tzinfo is not None:
+            value = value.astimezone(timezone.utc).replace(tzinfo=None)
+        return value.replace(microsecond=value.microsecond // 1000 * 1000)
+    return value
+
+def _copy(value):
+    if isinstance(value, dict):
+        return {k: _copy(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_copy(v) for v in value]
+    return value
+
+def _type_rank(value):
+    # BSON comparison order
+    if value is None or value is _MISSING:
+        return 1
+    if isinstance(value, bool):
+        return 8
+    if isinstance(value, (int, float)):
+        return 2
+    if isinstance(value, str):
+        return 3
+    if isinstance(value, dict):
+        return 4
+    if isinstance(value, list):
+        return 5
+    if isinstance(value, bytes):
+        return 6
+    if isinstance(value, ObjectId):
+        return 7
+    if isinstance(value, datetime):
+        return 9
+    return 10
+
+class _SortKey:
+    __slots__ = ("rank", "value")
+
+    def __init__(self, value):
+        self.rank = _type_rank(value)
+        self.value = value
+
+    def __lt__(self, other):
+        if self.rank != other.rank:
+            return self.rank < other.rank
+        if self.rank == 1:
+            return False
+        try:
+            return self.value < other.value
+        except TypeError:
+            return repr(self.value) < repr(other.value)
+
+    def __eq__(self, other):
+        return self.rank == other.rank and (self.rank == 1 or self.value == other.value)
+
+def _compare(a, b):
+    """-1/0/1 in BSON order."""
+    ka, kb = _SortKey(a), _SortKey(b)
+    return -1 if ka < kb else (1 if kb < ka else 0)
+
+def _equal(a, b):
+    if a is _MISSING:
+        a = None
+    if b is _MISSING:
+        b = None
+    return _type_rank(a) == _type_rank(b) and a == b
+
+def _freeze(value):
+    """Hashable stand-in for a value (group keys, unique index keys)."""
+    if isinstance(value, dict):
+        return ("__dict__",) + tuple((k, _freeze(v)) for k, v in value.items())
+    if isinstance(value, list):
+        return ("__list__",) + tuple(_freeze(v) for v in value)
+    if isinstance(value, bool):
+        return ("__bool__", value)
+    return value
+
+def _hashable(value):
+    try:
+        hash(value)
+    except TypeError:
+        return False
+    return True
+
+def _truthy(value):
+    if value is None or value is _MISSING or value is False:
+        return False
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value != 0
+    return True
+
+
+# Paths -----------------------------------------------------------------------
+
+def _resolve(document, path):
+    """Values reachable at a dotted path, traversing arrays like a query does."""
+    values = [document]
+    for part in path.split("."):
+        following = []
+        for value in values:
+            if isinstance(value, dict):
+                if part in value:
+                    following.append(value[part])
+            elif isinstance(value, list):
+                if part.isdigit() and int(part) < len(value):
+                    following.append(value[int(part)])
+                following.extend(e[part] for e in value if isinstance(e, dict) and part in e)
+        values = following
+    return values
+
+def _get_path(value, parts):
+    """Value of a field path in an expression; arrays map over their elements."""
+    for i, part in enumerate(parts):
+        if isinstance(value, list):
+            mapped = (_get_path(element, parts[i:]) for element in value)
+            return [v for v in mapped if v is not _MISSING]
+        if not isinstance(value, dict) or part not in value:
+            return _MISSING
+        value = value[part]
+    return value
+
+def _set_path(document, path, value):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        child = document.get(part)
+        if not isinstance(child, dict):
+            child = document[part] = {}
+        document = child
+    document[parts[-1]] = value
+
+def _unset_path(document, path):
+    parts = path.split(".")
+    for part in parts[:-1]:
+        document = document.get(part)
+        if not isinstance(document, dict):
+            return
+    document.pop(parts[-1], None)
+
+def _expand(values):
+    for value in values:
+        yield value
+        if isinstance(value, list):
+            yield from value
+
+
+# Query matching --------------------------------------------------------------
+
+TYPE_ALIASES = {
+    "string": (str,), "object": (dict,), "array": (list,), "objectId": (ObjectId,), "bool": (bool,),
+    "date": (datetime,), "null": (type(None),), "double": (float,), "int": (int,), "long": (int,),
+    "number": (int, float), "binData": (bytes,)
+}
+
+def _regex(pattern, options=""):
+    if isinstance(pattern, re.Pattern):
+        return pattern
+    flags = 0
+    for option, flag in (("i", re.IGNORECASE), ("m", re.MULTILINE), ("s", re.DOTALL), ("x", re.VERBOSE)):
+        if option in options:
+            flags |= flag
+    return re.compile(pattern, flags)
+
+def _matches_value(values, expected):
+    if isinstance(expected, re.Pattern):
+        return any(isinstance(v, str) and expected.search(v) for v in _expand(values))
+    if expected is None:
+        return not values or any(v is None for v in _expand(values))
+    return any(_equal(v, expected) for v in _expand(values))
+
+def _is_operator_dict(condition):
+    return isinstance(condition, dict) and condition and all(k.startswith("$") for k in condition)
+
+def _match_field(values, condition):
+    if not _is_operator_dict(condition):
+        return _matches_value(values, condition)
+    for operator, argument in condition.items():
+        if operator == "$eq":
+            ok = _matches_value(values, argument)
+        elif operator == "$ne":
+            ok = not _matches_value(values, argument)
+        elif operator in ("$gt", "$gte", "$lt", "$lte"):
+            ok = any(_range_ok(operator, v, argument) for v in _expand(values))
+        elif operator == "$in":
+            ok = any(_matches_value(values, option) for option in argument)
+        elif operator == "$nin":
+            ok = not any(_matches_value(values, option) for option in argument)
+        elif operator == "$exists":
+            ok = bool(values) == bool(argument)
+        elif operator == "$regex":
+            ok = _matches_value(values, _regex(argument, condition.get("$options", "")))
+        elif operator == "$options":
+            continue
+        elif operator == "$type":
+            types = argument if isinstance(argument, list) else [argument]
+            ok = any(_is_type(v, t) for v in _expand(values) for t in types)
+        elif operator == "$not":
+            ok = not _match_field(values, argument)
+        elif operator == "$elemMatch":
+            ok = any(
+                matches(e, argument) if isinstance(e, dict) and not _is_operator_dict(argument)
+                else _match_field([e], argument)
+                for v in values if isinstance(v, list) for e in v
+            )
+        elif operator == "$size":
+            ok = any(isinstance(v, list) and len(v) == argument for v in values)
+        elif operator == "$all":
+            ok = all(_matches_value(values, option) for option in argument)
+        else:
+            raise OperationFailure(f"unknown operator: {operator}")
+        if not ok:
+            return False
+    return True
+
+def _range_ok(operator, value, bound):
+    # Range operators only compare values of the same BSON type
+    if _type_rank(value) != _type_rank(bound) or value is None:
+        return False
+    try:
+        if operator == "$gt":
+            return value > bound
+        if operator == "$gte":
+            return value >= bound
+        if operator == "$lt":
+            return value < bound
+        return value <= bound
+    except TypeError:
+        return False
+
+def _is_type(value, alias):
+    types = TYPE_ALIASES.get(alias)
+    if types is None:
+        raise OperationFailure(f"unsupported $type: {alias}")
+    if isinstance(value, bool) and bool not in types:
+        return False
+    return isinstance(value, types)
+
+def matches(document, query):
+    for key, condition in (query or {}).items():
+        if key == "$or":
+            if not any(matches(document, q) for q in condition):
+                return False
+        elif key == "$and":
+            if not all(matches(document, q) for q in condition):
+                return False
+        elif key == "$nor":
+            if any(matches(document, q) for q in condition):
+                return False
+        elif key == "$expr":
+            if not _truthy(evaluate(condition, document)):
+                return False
+        elif not _match_field(_resolve(document, key), condition):
+            return False
+    return True
+
+
+# Projection and updates ------------------------------------------------------
+
+def _path_tree(paths):
+    tree = {}
+    for path in paths:
+        node = tree
+        parts = path.split(".")
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if node is True:
+                break
+        else:
+            node[parts[-1]] = True
+    return tree
+
+def _include(value, tree):
+    """Fields of value selected by a path tree, in the document's own order."""
+    if isinstance(value, list):
+        return [_include(e, tree) for e in value if isinstance(e, (dict, list))]
+    result = {}
+    for field, child in value.items():
+        selected = tree.get(field)
+        if selected is True:
+            result[field] = _copy(child)
+        elif selected and isinstance(child, (dict, list)):
+            result[field] = _include(child, selected)
+    return result
+
+def project(document, projection):
+    if not projection:
+        return _copy(document)
+    if isinstance(projection, (list, tuple)):
+        projection = {field: 1 for field in projection}
+    include_id = projection.get("_id", 1)
+    fields = {k: v for k, v in projection.items() if k != "_id"}
+    if any(_truthy(v) for v in fields.values()):
+        if _truthy(include_id):
+            fields["_id"] = 1
+        return _include(document, _path_tree(f for f, v in fields.items() if _truthy(v)))
+    result = _copy(document)
+    for path in fields:
+        _unset_path(result, path)
+    if not _truthy(include_id):
+        result.pop("_id", None)
+    return result
+
+def apply_update(document, update, inserting=False):
+    """Apply an update document or pipeline to document in place."""
+    if isinstance(update, list):
+        for stage in update:
+            (name, spec), = stage.items()
+            if name in ("$set", "$addFields"):
+                values = {field: evaluate(expression, document) for field, expression in spec.items()}
+                for field, value in values.items():
+                    if value is _MISSING:
+                        _unset_path(document, field)
+                    else:
+                        _set_path(document, field, _to_storage(value))
+            elif name == "$unset":
+                for field in ([spec] if isinstance(spec, str) else spec):
+                    _unset_path(document, field)
+            else:
+                raise OperationFailure(f"unsupported update pipeline stage: {name}")
+        return
+    for operator, fields in update.items():
+        if operator == "$setOnInsert" and not inserting:
+            continue
+        for path, value in fields.items():
+            current = _get_path(document, path.split("."))
+            if operator in ("$set", "$setOnInsert"):
+                _set_path(document, path, _copy(value))
+            elif operator == "$unset":
+                _unset_path(document, path)
+            elif operator == "$inc":
+                _set_path(document, path, (0 if current in (_MISSING, None) else current) + value)
+            elif operator == "$mul":
+                _set_path(document, path, (0 if current in (_MISSING, None) else current) * value)
+            elif operator in ("$min", "$max"):
+                if current is _MISSING or (_compare(value, current) < 0) == (operator == "$min") and value != current:
+                    _set_path(document, path, _copy(value))
+            elif operator in ("$push", "$addToSet"):
+                items = value["$each"] if isinstance(value, dict) and "$each" in value else [value]
+                array = [] if current is _MISSING else current
+                if not isinstance(array, list):
+                    raise OperationFailure(f"The field '{path}' must be an array")
+                for item in items:
+                    if operator == "$push" or not any(_equal(item, existing) for existing in array):
+                        array.append(_copy(item))
+                _set_path(document, path, array)
+            elif operator == "$pull":
+                if isinstance(current, list):
+                    _set_path(document, path, [
+                        e for e in current
+                        if not (matches(e, value) if isinstance(value, dict) and isinstance(e, dict)
+                                else _match_field([e], value))
+                    ])
+            else:
+                raise OperationFailure(f"unsupported update operator: {operator}")
+
+def _upsert_seed(query):
+    """Fields an upsert copies from the equality conditions of its filter."""
+    seed = {}
+    for key, condition in (query or {}).items():
+        if key == "$and":
+            for part in condition:
+                seed.update(_upsert_seed(part))
+        elif key.startswith("$") or isinstance(condition, re.Pattern):
+            continue
+        elif _is_operator_dict(condition):
+            if "$eq" in condition:
+                _set_path(seed, key, _copy(condition["$eq"]))
+        else:
+            _set_path(seed, key, _copy(condition))
+    return seed
+
+
+# Aggregation expressions -----------------------------------------------------
+
+def _value(value):
+    return None if value is _MISSING else value
+
+def _numbers(values):
+    return [v for v in values if isinstance(v, (int, float)) and not isinstance(v, bool)]
+
+def _date_to_string(spec, document):
+    date = _value(evaluate(spec["date"], document))
+    if date is None:
+        return _value(evaluate(spec.get("onNull"), document)) if "onNull" in spec else None
+    formato = spec.get("format", "%Y-%m-%dT%H:%M:%S.%LZ")
+    return date.strftime(formato.replace("%L", f"{date.microsecond // 1000:03d}"))
+
+def _trim(spec, document, left=True, right=True):
+    text = _value(evaluate(spec["input"], document))
+    if text is None:
+        return None
+    chars = _value(evaluate(spec["chars"], document)) if "chars" in spec else None
+    if left and right:
+        return text.strip(chars)
+    return text.lstrip(chars) if left else text.rstrip(chars)
+
+def _arithmetic(operator, values):
+    if any(v is None for v in values):
+        return None
+    if operator == "$add":
+        dates = [v for v in values if isinstance(v, datetime)]
+        total = sum(v for v in values if not isinstance(v, datetime))
+        return dates[0] + timedelta(milliseconds=total) if dates else total
+    if operator == "$subtract":
+        a, b = values
+        if isinstance(a, datetime) and isinstance(b, datetime):
+            return int((a - b) / timedelta(milliseconds=1))
+        if isinstance(a, datetime):
+            return a - timedelta(milliseconds=b)
+        return a - b
+    if operator == "$multiply":
+        product = 1
+        for v in values:
+            product *= v
+        return product
+    if operator == "$divide":
+        return values[0] / values[1]
+    if operator == "$mod":
+        return values[0] % values[1]
+    raise OperationFailure(f"unsupported expression: {operator}")
+
+def _operator(operator, args, document):
+    if operator == "$literal":
+        return args
+    if operator == "$cond":
+        if isinstance(args, dict):
+            args = [args["if"], args["then"], args["else"]]
+        return evaluate(args[1] if _truthy(evaluate(args[0], document)) else args[2], document)
+    if operator == "$ifNull":
+        for expression in args[:-1]:
+            value = _value(evaluate(expression, document))
+            if value is not None:
+                return value
+        return evaluate(args[-1], document)
+    if operator == "$and":
+        return all(_truthy(evaluate(a, document)) for a in args)
+    if operator == "$or":
+        return any(_truthy(evaluate(a, document)) for a in args)
+    if operator == "$dateToString":
+        return _date_to_string(args, document)
+    if operator == "$trim":
+        return _trim(args, document)
+    if operator == "$ltrim":
+        return _trim(args, document, right=False)
+    if operator == "$rtrim":
+        return _trim(args, document, left=False)
+
+    values = [_value(evaluate(a, document)) for a in (args if isinstance(args, list) else [args])]
+    if operator in ("$add", "$subtract", "$multiply", "$divide", "$mod"):
+        return _arithmetic(operator, values)
+    if operator in ("$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$cmp"):
+        result = _compare(values[0], values[1])
+        return {
+            "$eq": result == 0, "$ne": result != 0, "$gt": result > 0, "$gte": result >= 0,
+            "$lt": result < 0, "$lte": result <= 0, "$cmp": result
+        }[operator]
+    if operator == "$not":
+        return not _truthy(values[0])
+    if operator == "$in":
+        return any(_equal(values[0], option) for option in values[1])
+    if operator in ("$sum", "$avg", "$max", "$min"):
+        flat = [v for value in values for v in (value if isinstance(value, list) else [value])]
+        if operator == "$sum":
+            return sum(_numbers(flat))
+        if operator == "$avg":
+            numbers = _numbers(flat)
+            return sum(numbers) / len(numbers) if numbers else None
+        present = [v for v in flat if v is not None]
+        if not present:
+            return None
+        keys = [_SortKey(v) for v in present]
+        return present[keys.index(max(keys) if operator == "$max" else min(keys))]
+    if operator == "$round":
+        value, places = values[0], (values[1] if len(values) > 1 else 0)
+        return None if value is None else round(value, places)
+    if operator == "$abs":
+        return None if values[0] is None else abs(values[0])
+    if operator == "$concat":
+        return None if any(v is None for v in values) else "".join(values)
+    if operator == "$toLower":
+        return "" if values[0] is None else str(values[0]).lower()
+    if operator == "$toUpper":
+        return "" if values[0] is None else str(values[0]).upper()
+    if operator == "$toString":
+        return None if values[0] is None else str(values[0])
+    if operator == "$size":
+        return len(values[0])
+    if operator == "$arrayElemAt":
+        array, index = values
+        return array[index] if -len(array) <= index < len(array) else _MISSING
+    if operator == "$mergeObjects":
+        merged = {}
+        for value in values:
+            merged.update(value or {})
+        return merged
+    raise OperationFailure(f"unsupported expression: {operator}")
+
+def evaluate(expression, document):
+    if isinstance(expression, str):
+        if expression == "$$ROOT":
+            return document
+        if expression == "$$REMOVE":
+            return _MISSING
+        if expression.startswith("$"):
+            return _get_path(document, expression[1:].split("."))
+        return expression
+    if isinstance(expression, list):
+        return [_value(evaluate(e, document)) for e in expression]
+    if isinstance(expression, dict):
+        if len(expression) == 1:
+            (operator, args), = expression.items()
+            if operator.startswith("$"):
+                return _operator(operator, args, document)
+        evaluated = ((k, evaluate(v, document)) for k, v in expression.items())
+        return {k: v for k, v in evaluated if v is not _MISSING}
+    return expression
+
+
+# Aggregation stages ----------------------------------------------------------
+
+def _is_flag(value):
+    return isinstance(value, (bool, int, float))
+
+def _project_stage(document, spec):
+    include_id = spec.get("_id", 1)
+    fields = {k: v for k, v in spec.items() if k != "_id"}
+    if not _is_flag(include_id):
+        fields = {"_id": include_id, **fields}
+        include_id = 0
+    if fields and all(_is_flag(v) and not _truthy(v) for v in fields.values()):
+        return project(document, spec)
+    included = [path for path, value in fields.items() if _is_flag(value) and _truthy(value)]
+    if _truthy(include_id):
+        included.append("_id")
+    result = {}
+    if "_id" in fields:
+        result["_id"] = None
+    result.update(_include(document, _path_tree(included)))
+    for path, value in fields.items():
+        if not _is_flag(value):
+            computed = evaluate(value, document)
+            if computed is not _MISSING:
+                _set_path(result, path, _copy(computed))
+    return result
+
+def _group(documents, spec):
+    id_expression = spec["_id"]
+    accumulators = {field: next(iter(op.items())) for field, op in spec.items() if field != "_id"}
+    groups = {}
+    for document in documents:
+        key = _value(evaluate(id_expression, document))
+        state = groups.get(_freeze(key))
+        if state is None:
+            state = groups[_freeze(key)] = {"_id": key, "__counts__": {}}
+        for field, (operator, expression) in accumulators.items():
+            value = evaluate(expression, document) if operator != "$count" else 1
+            if operator in ("$sum", "$count"):
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    state[field] = state.get(field, 0) + value
+                else:
+                    state.setdefault(field, 0)
+            elif operator == "$avg":
+                total, count = state["__counts__"].get(field, (0, 0))
+                if isinstance(value, (int, float)) and not isinstance(value, bool):
+                    total, count = total + value, count + 1
+                state["__counts__"][field] = (total, count)
+                state[field] = total / count if count else None
+            elif operator == "$first":
+                if field not in state:
+                    state[field] = _value(value)
+            elif operator == "$last":
+                state[field] = _value(value)
+            elif operator in ("$min", "$max"):
+                value = _value(value)
+                current = state.get(field)
+                if value is not None and (current is None or (_compare(value, current) < 0) == (operator == "$min")):
+                    state[field] = value
+                state.setdefault(field, None)
+            elif operator == "$push":
+                state.setdefault(field, [])
+                if value is not _MISSING:
+                    state[field].append(value)
+            elif operator == "$addToSet":
+                state.setdefault(field, [])
+                if value is not _MISSING and not any(_equal(value, e) for e in state[field]):
+                    state[field].append(value)
+            else:
+                raise OperationFailure(f"unsupported accumulator: {operator}")
+    resultados = []
+    for state in groups.values():
+        del state["__counts__"]
+        resultados.append(_copy(state))
+    return resultados
+
+def _sort(documents, spec):
+    documents = list(documents)
+    for field, direction in reversed(list(spec.items())):
+        parts = field.split(".")
+        documents.sort(key=lambda d: _SortKey(_value(_get_path(d, parts))), reverse=direction < 0)
+    return documents
+
+def _unwind(documents, spec):
+    if isinstance(spec, str):
+        spec = {"path": spec}
+    path = spec["path"][1:]
+    preserve = spec.get("preserveNullAndEmptyArrays", False)
+    index_field = spec.get("includeArrayIndex")
+    resultados = []
+    for document in documents:
+        value = _get_path(document, path.split("."))
+        if isinstance(value, list) and value:
+            for i, element in enumerate(value):
+                unwound = _copy(document)
+                _set_path(unwound, path, _copy(element))
+                if index_field:
+                    unwound[index_field] = i
+                resultados.append(unwound)
+        elif isinstance(value, list) or value in (_MISSING, None):
+            if preserve:
+                unwound = _copy(document)
+                if isinstance(value, list):
+                    _unset_path(unwound, path)
+                if index_field:
+                    unwound[index_field] = None
+                resultados.append(unwound)
+        else:
+            unwound = _copy(document)
+            if index_field:
+                unwound[index_field] = None
+            resultados.append(unwound)
+    return resultados
+
+def _merge(database, documents, spec):
+    into = spec["into"] if isinstance(spec["into"], str) else spec["into"]["coll"]
+    target = database[into]
+    on = spec.get("on", "_id")
+    on = [on] if isinstance(on, str) else list(on)
+    when_matched = spec.get("whenMatched", "merge")
+    when_not_matched = spec.get("whenNotMatched", "insert")
+    for document in documents:
+        query = {field: _value(_get_path(document, field.split("."))) for field in on}
+        existing = target._select(query)
+        if existing:
+            if when_matched == "keepExisting":
+                continue
+            if when_matched == "fail":
+                raise DuplicateKeyError(f"$merge found an existing document for {query}", 11000)
+            current = existing[0]
+            replacement = {**current, **document} if when_matched == "merge" else {**document}
+            replacement["_id"] = current["_id"]
+            target._replace(current, _to_storage(replacement))
+        elif when_not_matched == "insert":
+            target._insert(document)
+        elif when_not_matched == "fail":
+            raise OperationFailure(f"$merge found no document for {query}")
+
+def run_pipeline(database, documents, pipeline):
+    for stage in pipeline:
+        (name, spec), = stage.items()
+        if name == "$match":
+            documents = [d for d in documents if matches(d, spec)]
+        elif name == "$project":
+            documents = [_project_stage(d, spec) for d in documents]
+        elif name in ("$addFields", "$set"):
+            staged = []
+            for document in documents:
+                values = {field: evaluate(expression, document) for field, expression in spec.items()}
+                document = _copy(document)
+                for field, value in values.items():
+                    if value is _MISSING:
+                        _unset_path(document, field)
+                    else:
+                        _set_path(document, field, _copy(value))
+                staged.append(document)
+            documents = staged
+        elif name == "$unset":
+            fields = [spec] if isinstance(spec, str) else spec
+            documents = [project(d, {field: 0 for field in fields}) for d in documents]
+        elif name == "$group":
+            documents = _group(documents, spec)
+        elif name == "$sort":
+            documents = _sort(documents, spec)
+        elif name == "$limit":
+            documents = documents[:spec]
+        elif name == "$skip":
+            documents = documents[spec:]
+        elif name == "$unwind":
+            documents = _unwind(documents, spec)
+        elif name == "$count":
+            documents = [{spec: len(documents)}] if documents else []
+        elif name == "$facet":
+            documents = [{field: run_pipeline(database, documents, sub) for field, sub in spec.items()}]
+        elif name == "$replaceRoot":
+            documents = [_copy(evaluate(spec["newRoot"], d)) for d in documents]
+        elif name == "$merge":
+            _merge(database, documents, {"into": spec} if isinstance(spec, str) else spec)
+            documents = []
+        elif name == "$out":
+            target = database[spec if isinstance(spec, str) else spec["coll"]]
+            target._clear()
+            for document in documents:
+                target._insert(document)
+            documents = []
+        else:
+            raise OperationFailure(f"unsupported aggregation stage: {name}")
+    return documents
+
+
+# Cursors ---------------------------------------------------------------------
+
+class MemoryCursor:
+    def __init__(self, loader, projection=None, sort=None, skip=0, limit=0):
+        self._loader = loader
+        self._projection = projection
+        self._sort = None
+        self._skip = skip or 0
+        self._limit = limit or 0
+        self._iterator = None
+        if sort:
+            self.sort(sort)
+
+    def sort(self, key_or_list, direction=None):
+        if isinstance(key_or_list, str):
+            key_or_list = [(key_or_list, direction or 1)]
+        self._sort = dict(key_or_list)
+        return self
+
+    def skip(self, skip):
+        self._skip = skip
+        return self
+
+    def limit(self, limit):
+        self._limit = limit
+        return self
+
+    def batch_size(self, batch_size):
+        return self
+
+    def max_time_ms(self, max_time_ms):
+        return self
+
+    def _results(self):
+        documents = self._loader()
+        if self._sort:
+            documents = _sort(documents, self._sort)
+        documents = documents[self._skip:]
+        if self._limit:
+            documents = documents[:abs(self._limit)]
+        return [project(d, self._projection) for d in documents]
+
+    async def to_list(self, length=None):
+        if self._iterator is None:
+            self._iterator = iter(self._results())
+        if length is None:
+            return list(self._iterator)
+        return [d for _, d in zip(range(length), self._iterator)]
+
+    def __aiter__(self):
+        return self
+
+    async def __anext__(self):
+        if self._iterator is None:
+            self._iterator = iter(self._results())
+        try:
+            return next(self._iterator)
+        except StopIteration:
+            raise StopAsyncIteration
+
+class MemoryCommandCursor(MemoryCursor):
+    def __init__(self, loader):
+        super().__init__(loader)
+
+    def _results(self):
+        return self._loader()
+
+
+# Collections -----------------------------------------------------------------
+
+class MemoryCollection:
+    def __init__(self, database, name):
+        self.database = database
+        self.name = name
+        self.exists = False
+        self._clear()
+
+    @property
+    def full_name(self):
+        return f"{self.database.name}.{self.name}"
+
+    def _clear(self):
+        self._documents = {}          # primary index: _id -> document, in insertion order
+        self._sequence = {}           # _id -> insertion number, to keep natural order
+        self._counter = 0
+        self._indexes = {"_id_": {"v": 2, "key": [("_id", 1)]}}
+        self._field_values = {}       # secondary indexes: field -> value -> set of _ids
+        self._unhashable = {}         # field -> _ids whose value cannot be a dict key
+        self._unique = {}             # index name -> (fields, partial filter, key -> _id)
+        self._ttl = []                # (field, seconds)
+        self._next_expiry = 0.0
+
+    def with_options(self, **kwargs):
+        return self
+
+    # Index maintenance
+
+    def _index_keys(self, document, field):
+        values = _resolve(document, field)
+        if not values:
+            return [None]
+        keys = []
+        for value in values:
+            keys.extend(value) if isinstance(value, list) else keys.append(value)
+        return keys
+
+    def _index_add(self, document):
+        for field, buckets in self._field_values.items():
+            for key in self._index_keys(document, field):
+                if _hashable(key):
+                    buckets.setdefault(key, set()).add(document["_id"])
+                else:
+                    self._unhashable[field].add(document["_id"])
+        for fields, partial, entries in self._unique.values():
+            if partial is None or matches(document, partial):
+                entries[self._unique_key(document, fields)] = document["_id"]
+
+    def _index_remove(self, document):
+        for field, buckets in self._field_values.items():
+            for key in self._index_keys(document, field):
+                if _hashable(key):
+                    bucket = buckets.get(key)
+                    if bucket is not None:
+                        bucket.discard(document["_id"])
+                        if not bucket:
+                            del buckets[key]
+            self._unhashable[field].discard(document["_id"])
+        for fields, partial, entries in self._unique.values():
+            key = self._unique_key(document, fields)
+            if entries.get(key) == document["_id"]:
+                del entries[key]
+
+    @staticmethod
+    def _unique_key(document, fields):
+        key = []
+        for field in fields:
+            values = _resolve(document, field)
+            key.append(_freeze(values[0]) if values else None)
+        return tuple(key)
+
+    def _check_unique(self, document):
+        for name, (fields, partial, entries) in self._unique.items():
+            if partial is not None and not matches(document, partial):
+                continue
+            key = self._unique_key(document, fields)
+            owner = entries.get(key)
+            if owner is not None and owner != document["_id"]:
+                raise DuplicateKeyError(
+                    f"E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {key}",
+                    11000, {"keyPattern": dict(self._indexes[name]["key"]), "keyValue": dict(zip(fields, key))}
+                )
+
+    def _expire(self):
+        if not self._ttl or time.monotonic() < self._next_expiry:
+            return
+        self._next_expiry = time.monotonic() + 1
+        now = datetime.utcnow()
+        for field, seconds in self._ttl:
+            limit = now - timedelta(seconds=seconds)
+            for document in [d for d in self._documents.values()
+                             if isinstance(d.get(field), datetime) and d[field] < limit]:
+                self._delete(document)
+
+    # Primitive operations, shared by the public API and $merge / $out
+
+    def _candidate_ids(self, query):
+        best = None
+        for field, condition in query.items():
+            if field.startswith("$"):
+                continue
+            values = _equality_values(condition)
+            if values is None:
+                continue
+            if field == "_id":
+                return {v for v in values if v in self._documents}
+            buckets = self._field_values.get(field)
+            if buckets is None:
+                continue
+            ids = set(self._unhashable[field])
+            for value in values:
+                ids.update(buckets.get(value, ()))
+            if best is None or len(ids) < len(best):
+                best = ids
+        return best
+
+    def _select(self, query, sort=None):
+        self._expire()
+        query = query or {}
+        ids = self._candidate_ids(query)
+        if ids is None:
+            documents = self._documents.values()
+        else:
+            documents = [self._documents[i] for i in sorted(ids, key=self._sequence.__getitem__)]
+        selected = [d for d in documents if matches(d, query)] if query else list(documents)
+        return _sort(selected, dict(sort)) if sort else selected
+
+    def _insert(self, document):
+        stored = _to_storage(document)
+        stored.setdefault("_id", ObjectId())
+        if stored["_id"] in self._documents:
+            raise DuplicateKeyError(
+                f"E11000 duplicate key error collection: {self.full_name} index: _id_ dup key: {stored['_id']}", 11000
+            )
+        self._check_unique(stored)
+        self.exists = True
+        self._documents[stored["_id"]] = stored
+        self._counter += 1
+        self._sequence[stored["_id"]] = self._counter
+        self._index_add(stored)
+        return stored["_id"]
+
+    def _replace(self, current, replacement):
+        if replacement.get("_id", current["_id"]) != current["_id"]:
+            raise OperationFailure("Performing an update on the path '_id' would modify the immutable field '_id'")
+        replacement["_id"] = current["_id"]
+        self._check_unique(replacement)
+        self._index_remove(current)
+        self._documents[current["_id"]] = replacement
+        self._index_add(replacement)
+
+    def _delete(self, document):
+        self._index_remove(document)
+        del self._documents[document["_id"]]
+        del self._sequence[document["_id"]]
+
+    def _update(self, query, update, upsert=False, multi=False, sort=None):
+        """Returns (matched, modified, upserted_id, before, after) of the last document touched."""
+        update = _to_storage(update)
+        targets = self._select(query, sort)
+        if not multi:
+            targets = targets[:1]
+        if not targets:
+            if not upsert:
+                return 0, 0, None, None, None
+            document = _upsert_seed(query)
+            apply_update(document, update, inserting=True)
+            upserted_id = self._insert(document)
+            return 0, 0, upserted_id, None, self._documents[upserted_id]
+        modified = 0
+        before = after = None
+        for current in targets:
+            changed = _copy(current)
+            apply_update(changed, update)
+            changed = _to_storage(changed)
+            if changed != current:
+                self._replace(current, changed)
+                modified += 1
+            before, after = current, self._documents[current["_id"]]
+        return len(targets), modified, None, before, after
+
+    # Public API
+
+    def find(self, filter=None, projection=None, *args, sort=None, skip=0, limit=0, **kwargs):
+        query = _to_storage(filter or {})
+        return MemoryCursor(lambda: self._select(query), projection, sort=sort, skip=skip, limit=limit)
+
+    async def find_one(self, filter=None, projection=None, *args, sort=None, **kwargs):
+        if filter is not None and not isinstance(filter, dict):
+            filter = {"_id": filter}
+        documents = self._select(_to_storage(filter or {}), sort)
+        return project(documents[0], projection) if documents else None
+
+    async def count_documents(self, filter, skip=0, limit=0, **kwargs):
+        count = max(0, len(self._select(_to_storage(filter))) - (skip or 0))
+        return min(count, limit) if limit else count
+
+    async def estimated_document_count(self, **kwargs):
+        self._expire()
+        return len(self._documents)
+
+    async def distinct(self, key, filter=None, **kwargs):
+        values = []
+        for document in self._select(_to_storage(filter or {})):
+            for value in _expand(_resolve(document, key)):
+                if isinstance(value, list):
+                    continue
+                if not any(_equal(value, seen) for seen in values):
+                    values.append(value)
+        return [_copy(v) for v in values]
+
+    async def insert_one(self, document, **kwargs):
+        document.setdefault("_id", ObjectId())
+        return InsertOneResult(self._insert(document), True)
+
+    async def insert_many(self, documents, ordered=True, **kwargs):
+        documents = list(documents)
+        if not documents:
+            raise TypeError("documents must be a non-empty list")
+        ids, errors = [], []
+        for index, document in enumerate(documents):
+            document.setdefault("_id", ObjectId())
+            try:
+                ids.append(self._insert(document))
+            except DuplicateKeyError as e:
+                errors.append({"index": index, "code": 11000, "errmsg": str(e), "op": document})
+                if ordered:
+                    break
+        if errors:
+            raise BulkWriteError({
+                "writeErrors": errors, "writeConcernErrors": [], "nInserted": len(ids),
+                "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0, "upserted": []
+            })
+        return InsertManyResult(ids, True)
+
+    async def update_one(self, filter, update, upsert=False, **kwargs):
+        matched, modified, upserted_id, _, _ = self._update(_to_storage(filter), update, upsert)
+        return UpdateResult(_update_raw(matched, modified, upserted_id), True)
+
+    async def update_many(self, filter, update, upsert=False, **kwargs):
+        matched, modified, upserted_id, _, _ = self._update(_to_storage(filter), update, upsert, multi=True)
+        return UpdateResult(_update_raw(matched, modified, upserted_id), True)
+
+    async def replace_one(self, filter, replacement, upsert=False, **kwargs):
+        query = _to_storage(filter)
+        targets = self._select(query)[:1]
+        if targets:
+            replacement = _to_storage(replacement)
+            modified = int({**replacement, "_id": targets[0]["_id"]} != targets[0])
+            self._replace(targets[0], replacement)
+            return UpdateResult(_update_raw(1, modified, None), True)
+        if upsert:
+            seed = _upsert_seed(query)
+            seed.update(replacement)
+            return UpdateResult(_update_raw(0, 0, self._insert(seed)), True)
+        return UpdateResult(_update_raw(0, 0, None), True)
+
+    async def delete_one(self, filter, **kwargs):
+        targets = self._select(_to_storage(filter))[:1]
+        for document in targets:
+            self._delete(document)
+        return DeleteResult({"n": len(targets), "ok": 1.0}, True)
+
+    async def delete_many(self, filter, **kwargs):
+        targets = self._select(_to_storage(filter))
+        for document in targets:
+            self._delete(document)
+        return DeleteResult({"n": len(targets), "ok": 1.0}, True)
+
+    async def find_one_and_update(self, filter, update, projection=None, sort=None, upsert=False,
+                                  return_document=ReturnDocument.BEFORE, **kwargs):
+        _, _, upserted_id, before, after = self._update(_to_storage(filter), update, upsert, sort=sort)
+        document = after if return_document == ReturnDocument.AFTER else before
+        return None if document is None else project(document, projection)
+
+    async def find_one_and_replace(self, filter, replacement, projection=None, sort=None, upsert=False,
+                                   return_document=ReturnDocument.BEFORE, **kwargs):
+        targets = self._select(_to_storage(filter), sort)[:1]
+        before = _copy(targets[0]) if targets else None
+        await self.replace_one(filter, replacement, upsert=upsert)
+        if return_document == ReturnDocument.AFTER:
+            return await self.find_one(filter, projection, sort=sort)
+        return None if before is None else project(before, projection)
+
+    async def find_one_and_delete(self, filter, projection=None, sort=None, **kwargs):
+        targets = self._select(_to_storage(filter), sort)[:1]
+        if not targets:
+            return None
+        self._delete(targets[0])
+        return project(targets[0], projection)
+
+    def aggregate(self, pipeline, **kwargs):
+        pipeline = _to_storage(pipeline)
+
+        def run():
+            stages = list(pipeline)
+            # A leading $match is answered from the indexes
+            query = stages.pop(0)["$match"] if stages and "$match" in stages[0] else {}
+            return run_pipeline(self.database, [_copy(d) for d in self._select(query)], stages)
+
+        return MemoryCommandCursor(run)
+
+    async def bulk_write(self, requests, ordered=True, **kwargs):
+        requests = list(requests)
+        if not requests:
+            raise InvalidOperation("No operations to execute")
+        result = {"nInserted": 0, "nUpserted": 0, "nMatched": 0, "nModified": 0, "nRemoved": 0,
+                  "upserted": [], "writeErrors": [], "writeConcernErrors": []}
+        for index, request in enumerate(requests):
+            try:
+                if isinstance(request, InsertOne):
+                    request._doc.setdefault("_id", ObjectId())
+                    self._insert(request._doc)
+                    result["nInserted"] += 1
+                elif isinstance(request, (UpdateOne, UpdateMany, ReplaceOne)):
+                    query = _to_storage(request._filter)
+                    if isinstance(request, ReplaceOne):
+                        raw = (await self.replace_one(query, request._doc, upsert=request._upsert)).raw_result
+                        matched, modified, upserted_id = raw["n"] - bool(raw.get("upserted")), raw["nModified"], raw.get("upserted")
+                    else:
+                        matched, modified, upserted_id, _, _ = self._update(
+                            query, request._doc, request._upsert, multi=isinstance(request, UpdateMany)
+                        )
+                    result["nMatched"] += matched
+                    result["nModified"] += modified
+                    if upserted_id is not None:
+                        result["nUpserted"] += 1
+                        result["upserted"].append({"index": index, "_id": upserted_id})
+                elif isinstance(request, (DeleteOne, DeleteMany)):
+                    targets = self._select(_to_storage(request._filter))
+                    if isinstance(request, DeleteOne):
+                        targets = targets[:1]
+                    for document in targets:
+                        self._delete(document)
+                    result["nRemoved"] += len(targets)
+                else:
+                    raise TypeError(f"{request!r} is not a valid request")
+            except DuplicateKeyError as e:
+                result["writeErrors"].append({"index": index, "code": 11000, "errmsg": str(e), "op": request})
+                if ordered:
+                    break
+        if result["writeErrors"]:
+            raise BulkWriteError(result)
+        return BulkWriteResult(result, True)
+
+    async def create_index(self, keys, unique=False, name=None, partialFilterExpression=None,
+                           expireAfterSeconds=None, **kwargs):
+        if isinstance(keys, str):
+            keys = [(keys, 1)]
+        keys = [tuple(k) for k in keys]
+        name = name or "_".join(f"{field}_{direction}" for field, direction in keys)
+        if name in self._indexes:
+            return name
+        fields = [field for field, _ in keys]
+        if unique:
+            entries = {}
+            for document in self._documents.values():
+                if partialFilterExpression is None or matches(document, partialFilterExpression):
+                    key = self._unique_key(document, fields)
+                    if key in entries:
+                        raise DuplicateKeyError(
+                            f"E11000 duplicate key error collection: {self.full_name} index: {name} dup key: {key}", 11000
+                        )
+                    entries[key] = document["_id"]
+            self._unique[name] = (fields, partialFilterExpression, entries)
+        for field in fields:
+            if field not in self._field_values and field != "_id":
+                self._field_values[field] = {}
+                self._unhashable[field] = set()
+                for document in self._documents.values():
+                    for key in self._index_keys(document, field):
+                        if _hashable(key):
+                            self._field_values[field].setdefault(key, set()).add(document["_id"])
+                        else:
+                            self._unhashable[field].add(document["_id"])
+        if expireAfterSeconds is not None:
+            self._ttl.append((fields[0], expireAfterSeconds))
+        spec = {"v": 2, "key": keys}
+        if unique:
+            spec["unique"] = True
+        if partialFilterExpression is not None:
+            spec["partialFilterExpression"] = partialFilterExpression
+        if expireAfterSeconds is not None:
+            spec["expireAfterSeconds"] = expireAfterSeconds
+        self._indexes[name] = spec
+        self.exists = True
+        return name
+
+    async def index_information(self):
+        return _copy(self._indexes)
+
+    async def drop(self, **kwargs):
+        self._clear()
+        self.exists = False
+
+def _equality_values(condition):
+    """Values an indexed equality or $in condition can look up, or None."""
+    if isinstance(condition, dict):
+        if set(condition) == {"$eq"}:
+            condition = condition["$eq"]
+        elif set(condition) == {"$in"}:
+            options = list(condition["$in"])
+            if all(not isinstance(o, (re.Pattern, dict, list)) and _hashable(o) for o in options):
+                return options
+            return None
+        else:
+            return None
+    if isinstance(condition, (re.Pattern, dict, list)) or not _hashable(condition):
+        return None
+    return [condition]
+
+def _update_raw(matched, modified, upserted_id):
+    raw = {"n": matched, "nModified": modified, "ok": 1.0}
+    if upserted_id is not None:
+        raw["n"] = 1
+        raw["upserted"] = upserted_id
+    return raw
+
+
+# Databases and client --------------------------------------------------------
+
+class MemoryDatabase:
+    def __init__(self, client, name):
+        self.client = client
+        self.name = name
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = MemoryCollection(self, name)
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_collection(self, name, **kwargs):
+        return self[name]
+
+    def with_options(self, **kwargs):
+        return self
+
+    async def list_collection_names(self, **kwargs):
+        return [name for name, collection in self._collections.items() if collection.exists]
+
+    async def drop_collection(self, name, **kwargs):
+        if name in self._collections:
+            await self._collections[name].drop()
+
+    async def command(self, command, *args, **kwargs):
+        name = command if isinstance(command, str) else next(iter(command))
+        if name in ("hello", "isMaster", "ismaster"):
+            # A standalone server: no replica set, hence no transactions
+            return {"isWritablePrimary": True, "ismaster": True, "maxWireVersion": 17, "ok": 1.0}
+        if name == "ping":
+            return {"ok": 1.0}
+        raise OperationFailure(f"command {name} is not supported by the memory engine")
+
+class MemoryClient:
+    def __init__(self, *args, **kwargs):
+        self._databases = {}
+
+    def __getitem__(self, name):
+        if name not in self._databases:
+            self._databases[name] = MemoryDatabase(self, name)
+        return self._databases[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    def get_database(self, name, **kwargs):
+        return self[name]
+
+    async def drop_database(self, name):
+        self._databases.pop(name if isinstance(name, str) else name.name, None)
+
+    async def start_session(self, **kwargs):
+        raise OperationFailure("Transactions are not supported by the memory engine", 20)
+
+    async def server_info(self):
+        return {"version": "memory", "ok": 1.0}
+
+    def close(self):
+        pass
@@ -1,23 +1,248 @@
-from fastapi import FastAPI, APIRouter, HTTPException
+from fastapi import FastAPI, APIRouter, HTTPException, Request, Response, Depends, Header, UploadFile, File, Form
+from fastapi.responses import JSONResponse, FileResponse
+from fastapi.encoders import jsonable_encoder
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
+from starlette.middleware.gzip import GZipMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo import InsertOne, UpdateOne, UpdateMany, DeleteOne, DeleteMany, ReplaceOne, ReturnDocument, ReadPreference
+import bson
+from bson import json_util
+from pymongo.errors import BulkWriteError, DuplicateKeyError, PyMongoError
 import os
 import logging
 from pathlib import Path
-from pydantic import BaseModel, Field
-from typing import List, Optional
+from pydantic import BaseModel, Field, AliasChoices, TypeAdapter
+from typing import List, Optional, get_args
+from contextvars import ContextVar
+from contextlib import asynccontextmanager, nullcontext
+from collections import OrderedDict, defaultdict
+import copy
+import sys
+import jwt
 import uuid
-from datetime import datetime
+import re
+import csv
+import calendar
+import io
+import gzip
+import socket
+import traceback
+import numpy as np
+import hashlib
+import time
+import asyncio
+from datetime import datetime, timedelta, timezone
 
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
 
-# MongoDB connection
-mongo_url = os.environ['MONGO_URL']
-client = AsyncIOMotorClient(mongo_url)
-db = client[os.environ['DB_NAME']]
+# Multi-tenant mode: many PYMEs share one database and one connection pool.
+# Every query issued while a tenant is active gets a leading tenant_id.
+MULTI_TENANT = os.environ.get("MULTI_TENANT", "false").lower() in ("1", "true", "yes")
+current_tenant: ContextVar[Optional[str]] = ContextVar("current_tenant", default=None)
+
+class TenantCollection:
+    """Motor collection wrapper that scopes every operation to the current tenant.
+
+    Without an active tenant (startup, cross-tenant background maintenance)
+    operations pass through unchanged.
+    """
+
+    def __init__(self, collection):
+        self._collection = collection
+
+    def __getattr__(self, name):
+        return getattr(self._collection, name)
+
+    def _scope(self, filter_query):
+        tenant = current_tenant.get()
+        if tenant is None:
+            return filter_query
+        return {**(filter_query or {}), "tenant_id": tenant}
+
+    def _stamp(self, document):
+        tenant = current_tenant.get()
+        if tenant is not None:
+            document["tenant_id"] = tenant
+        return document
+
+    def with_options(self, **kwargs):
+        return TenantCollection(self._collection.with_options(**kwargs))
+
+    def find(self, filter=None, *args, **kwargs):
+        return self._collection.find(self._scope(filter), *args, **kwargs)
+
+    async def find_one(self, filter=None, *args, **kwargs):
+        return await self._collection.find_one(self._scope(filter), *args, **kwargs)
+
+    async def count_documents(self, filter, **kwargs):
+        return await self._collection.count_documents(self._scope(filter), **kwargs)
+
+    async def estimated_document_count(self, **kwargs):
+        if current_tenant.get() is None:
+            return await self._collection.estimated_document_count(**kwargs)
+        return await self._collection.count_documents(self._scope({}))
+
+    async def distinct(self, key, filter=None, **kwargs):
+        return await self._collection.distinct(key, self._scope(filter), **kwargs)
+
+    async def insert_one(self, document, **kwargs):
+        return await self._collection.insert_one(self._stamp(document), **kwargs)
+
+    async def insert_many(self, documents, **kwargs):
+        return await self._collection.insert_many([self._stamp(d) for d in documents], **kwargs)
+
+    async def update_one(self, filter, update, **kwargs):
+        return await self._collection.update_one(self._scope(filter), update, **kwargs)
+
+    async def update_many(self, filter, update, **kwargs):
+        return await self._collection.update_many(self._scope(filter), update, **kwargs)
+
+    async def replace_one(self, filter, replacement, **kwargs):
+        return await self._collection.replace_one(self._scope(filter), self._stamp(replacement), **kwargs)
+
+    async def delete_one(self, filter, **kwargs):
+        return await self._collection.delete_one(self._scope(filter), **kwargs)
+
+    async def delete_many(self, filter, **kwargs):
+        return await self._collection.delete_many(self._scope(filter), **kwargs)
+
+    async def find_one_and_update(self, filter, update, **kwargs):
+        return await self._collection.find_one_and_update(self._scope(filter), update, **kwargs)
+
+    async def find_one_and_delete(self, filter, **kwargs):
+        return await self._collection.find_one_and_delete(self._scope(filter), **kwargs)
+
+    def aggregate(self, pipeline, **kwargs):
+        tenant = current_tenant.get()
+        if tenant is None:
+            return self._collection.aggregate(pipeline, **kwargs)
+        scoped = [{"$match": {"tenant_id": tenant}}]
+        for stage in pipeline:
+            if "$merge" in stage or "$out" in stage:
+                # Documents written by the pipeline must stay inside the tenant
+                scoped.append({"$set": {"tenant_id": tenant}})
+                if "$merge" in stage and "on" in stage["$merge"]:
+                    on = stage["$merge"]["on"]
+                    on = [on] if isinstance(on, str) else list(on)
+                    stage = {"$merge": {**stage["$merge"], "on": ["tenant_id"] + on}}
+            scoped.append(stage)
+        return self._collection.aggregate(scoped, **kwargs)
+
+    def _scope_request(self, request):
+        """A new write operation scoped to the tenant; the caller's one is left untouched."""
+        tenant = current_tenant.get()
+        if tenant is None:
+            return request
+        # pymongo has no public accessors for an operation's arguments
+        if isinstance(request, InsertOne):
+            return InsertOne(self._stamp(dict(request._doc)))
+        if isinstance(request, (DeleteOne, DeleteMany)):
+            return type(request)(self._scope(request._filter), collation=request._collation, hint=request._hint)
+        if isinstance(request, ReplaceOne):
+            return ReplaceOne(
+                self._scope(request._filter), self._stamp(dict(request._doc)), upsert=request._upsert,
+                collation=request._collation, hint=request._hint
+            )
+        if isinstance(request, (UpdateOne, UpdateMany)):
+            update = request._doc
+            if request._upsert:
+                # An upsert inserts a new document, which must belong to the tenant
+                if isinstance(update, list):
+                    update = update + [{"$set": {"tenant_id": tenant}}]
+                else:
+                    update = {**update, "$setOnInsert": {**update.get("$setOnInsert", {}), "tenant_id": tenant}}
+            return type(request)(
+                self._scope(request._filter), update, upsert=request._upsert, collation=request._collation,
+                array_filters=request._array_filters, hint=request._hint
+            )
+        raise TypeError(f"Unsupported bulk write operation: {request!r}")
+
+    async def bulk_write(self, requests, **kwargs):
+        return await self._collection.bulk_write([self._scope_request(r) for r in requests], **kwargs)
+
+    async def create_index(self, keys, **kwargs):
+        # TTL indexes must stay single-field
+        if "expireAfterSeconds" not in kwargs:
+            keys = [("tenant_id", 1)] + [k for k in keys if k[0] != "tenant_id"]
+        return await self._collection.create_index(keys, **kwargs)
+
+class TenantDatabase:
+    def __init__(self, database):
+        self._database = database
+        self._collections = {}
+
+    def __getitem__(self, name):
+        if name not in self._collections:
+            self._collections[name] = TenantCollection(self._database[name])
+        return self._collections[name]
+
+    def __getattr__(self, name):
+        if name.startswith("_"):
+            raise AttributeError(name)
+        return self[name]
+
+    async def list_collection_names(self, **kwargs):
+        return await self._database.list_collection_names(**kwargs)
+
+tenant_caches = []
+
+class TenantTTLCache:
+    """Small in-memory TTL cache partitioned by the current tenant."""
+
+    def __init__(self, ttl_seconds: float, max_entries_per_tenant: int = 256):
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries_per_tenant
+        self._partitions = {}
+        tenant_caches.append(self)
+
+    def _partition(self):
+        return self._partitions.setdefault(current_tenant.get(), OrderedDict())
+
+    def get(self, key):
+        partition = self._partition()
+        entry = partition.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            partition.pop(key, None)
+            return None
+        return entry[1]
+
+    def set(self, key, value):
+        partition = self._partition()
+        partition[key] = (time.monotonic() + self.ttl_seconds, value)
+        partition.move_to_end(key)
+        while len(partition) > self.max_entries:
+            partition.popitem(last=False)
+
+    def delete(self, key):
+        self._partition().pop(key, None)
+
+    def entries(self, tenant):
+        return len(self._partitions.get(tenant, ()))
+
+    def footprint(self, tenant):
+        partition = self._partitions.get(tenant)
+        if partition is None:
+            return 0
+        return sys.getsizeof(partition) + sum(
+            sys.getsizeof(key) + sys.getsizeof(entry[1]) for key, entry in partition.items()
+        )
+
+# Storage engine: MongoDB, or the in-memory engine for tests and benchmarks
+STORAGE_ENGINE = os.environ.get("STORAGE_ENGINE", "mongo").lower()
+if STORAGE_ENGINE == "memory":
+    from memory_storage import MemoryClient
+    client = MemoryClient()
+    DB_NAME = os.environ.get("DB_NAME", "pyme")
+else:
+    mongo_url = os.environ['MONGO_URL']
+    client = AsyncIOMotorClient(mongo_url)
+    DB_NAME = os.environ['DB_NAME']
+db = client[DB_NAME]
+if MULTI_TENANT:
+    db = TenantDatabase(db)
 
 # Create the main app without a prefix
 app = FastAPI()
@@ -31,6 +256,7 @@ api_router = APIRouter(prefix="/api")
 # Articulo Model
 class Articulo(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     codigo: str = ""
     nombre: str
     descripcion: str = ""
@@ -39,6 +265,7 @@ class Articulo(BaseModel):
     unidad_medida: str = "unidad"  # unidad, kg, m, litro, etc.
     activo: bool = True
     fecha_creacion: datetime = Field(default_factory=datetime.utcnow)
+    fecha_actualizacion_precio: Optional[datetime] = None
 
 class ArticuloCreate(BaseModel):
     codigo: str = ""
@@ -58,14 +285,43 @@ class ArticuloUpdate(BaseModel):
     unidad_medida: str = None
     activo: bool = None
 
+class AjustePrecios(BaseModel):
+    tipo_ajuste: str = "porcentaje"  # porcentaje, fijo
+    valor: float
+    categoria: Optional[str] = None
+    codigo_desde: Optional[str] = None
+    codigo_hasta: Optional[str] = None
+    solo_activos: bool = True
+    dry_run: bool = False
+
+class VersionPrecio(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    articulo_id: str
+    precio: float
+    vigencia_desde: datetime
+    vigencia_hasta: Optional[datetime] = None  # None: open range
+    origen: str = "manual"  # inicial, manual, porcentaje, fijo, csv
+    aplicado: bool = True  # already reflected in Articulo.precio
+    fecha_creacion: datetime = Field(default_factory=datetime.utcnow)
+
+class VersionPrecioCreate(BaseModel):
+    precio: float
+    vigencia_desde: Optional[datetime] = None
+
+class ConsultaPrecios(BaseModel):
+    articulo_ids: List[str]
+    fecha: Optional[datetime] = None
+
 # Cliente Model
 class Cliente(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     nombre: str
     email: str
     telefono: str = ""
     direccion: str = ""
     cuit_dni: str = ""
+    nombre_busqueda: str = ""  # nombre en minúsculas para la búsqueda global
     fecha_creacion: datetime = Field(default_factory=datetime.utcnow)
 
 class ClienteCreate(BaseModel):
@@ -84,13 +340,22 @@ class ClienteUpdate(BaseModel):
 
 # Pedido Model
 class ItemPedido(BaseModel):
-    descripcion: str
-    cantidad: int
-    precio_unitario: float
-    subtotal: float
+    # Stored items use the short keys in ITEM_SHORT_KEYS; both forms are accepted on read
+    articulo_id: Optional[str] = Field(None, validation_alias=AliasChoices("articulo_id", "a"))
+    descripcion: str = Field("", validation_alias=AliasChoices("descripcion", "d"))
+    cantidad: int = Field(validation_alias=AliasChoices("cantidad", "q"))
+    precio_unitario: float = Field(validation_alias=AliasChoices("precio_unitario", "p"))
+    subtotal: float = Field(validation_alias=AliasChoices("subtotal", "s"))
+    alicuota_iva: Optional[float] = Field(None, validation_alias=AliasChoices("alicuota_iva", "i"))  # 0, 10.5, 21, 27; None usa porcentaje_iva del documento
+
+class DetalleIVA(BaseModel):
+    alicuota: float
+    base_imponible: float
+    importe: float
 
 class Pedido(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     numero_pedido: str
     cliente_id: str
     cliente_nombre: str = ""
@@ -111,13 +376,16 @@ class PedidoCreate(BaseModel):
 # Presupuesto Model
 class Presupuesto(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     numero_presupuesto: str
     cliente_id: str
     cliente_nombre: str = ""
     items: List[ItemPedido]
     subtotal: float
     impuestos: float
+    impuestos_detalle: List[DetalleIVA] = []
     total: float
+    condicion_iva: str = "Responsable Inscripto"
     estado: str = "borrador"  # borrador, enviado, aceptado, rechazado, convertido
     fecha_emision: datetime = Field(default_factory=datetime.utcnow)
     fecha_vencimiento: datetime
@@ -128,7 +396,9 @@ class PresupuestoCreate(BaseModel):
     numero_presupuesto: str
     cliente_id: str
     items: List[ItemPedido]
-    impuestos: float = 0.0
+    impuestos: float = 0.0  # ignorado: el IVA se calcula en el servidor
+    porcentaje_iva: float = 21.0
+    condicion_iva: str = "Responsable Inscripto"
     fecha_vencimiento: datetime
     validez_dias: int = 30
     notas: str = ""
@@ -136,6 +406,7 @@ class PresupuestoCreate(BaseModel):
 # Nota de Crédito Model
 class NotaCredito(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     numero_nota: str
     factura_id: str
     cliente_id: str
@@ -144,6 +415,7 @@ class NotaCredito(BaseModel):
     items: List[ItemPedido]
     subtotal: float
     impuestos: float
+    impuestos_detalle: List[DetalleIVA] = []
     total: float
     fecha_emision: datetime = Field(default_factory=datetime.utcnow)
     estado: str = "pendiente"  # pendiente, aplicada
@@ -155,12 +427,14 @@ class NotaCreditoCreate(BaseModel):
     cliente_id: str
     motivo: str
     items: List[ItemPedido]
-    impuestos: float = 0.0
+    impuestos: float = 0.0  # ignorado: el IVA se calcula en el servidor
+    porcentaje_iva: float = 21.0
     notas: str = ""
 
 # Nota de Débito Model
 class NotaDebito(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     numero_nota: str
     factura_id: str = None
     cliente_id: str
@@ -169,6 +443,7 @@ class NotaDebito(BaseModel):
     items: List[ItemPedido]
     subtotal: float
     impuestos: float
+    impuestos_detalle: List[DetalleIVA] = []
     total: float
     fecha_emision: datetime = Field(default_factory=datetime.utcnow)
     estado: str = "pendiente"  # pendiente, aplicada
@@ -180,7 +455,8 @@ class NotaDebitoCreate(BaseModel):
     cliente_id: str
     motivo: str
     items: List[ItemPedido]
-    impuestos: float = 0.0
+    impuestos: float = 0.0  # ignorado: el IVA se calcula en el servidor
+    porcentaje_iva: float = 21.0
     notas: str = ""
 
 # Cuenta Corriente Model
@@ -188,7 +464,7 @@ class MovimientoCuentaCorriente(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     cliente_id: str
     cliente_nombre: str = ""
-    tipo_movimiento: str  # factura, pago, nota_credito, nota_debito
+    tipo_movimiento: str  # factura, pago, nota_credito, nota_debito, anulacion_factura, anulacion_pago, ajuste
     documento_id: str  # ID del documento relacionado
     numero_documento: str
     debe: float = 0.0
@@ -206,6 +482,7 @@ class CuentaCorrienteResumen(BaseModel):
 # Recibo Model
 class Recibo(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     numero_recibo: str
     cliente_id: str
     cliente_nombre: str = ""
@@ -227,6 +504,7 @@ class ReciboCreate(BaseModel):
 # Factura Model
 class Factura(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     numero_factura: str
     tipo_factura: str = "A"  # A, B, C
     pedido_id: Optional[str] = None
@@ -242,6 +520,7 @@ class Factura(BaseModel):
     items: List[ItemPedido]
     subtotal: float
     impuestos: float
+    impuestos_detalle: List[DetalleIVA] = []
     total: float
     estado: str = "pendiente"  # pendiente, pagada, cobro_parcial, vencida
     monto_pagado: float = 0.0  # Para cobros parciales
@@ -250,18 +529,67 @@ class Factura(BaseModel):
     fecha_pago: Optional[datetime] = None
     notas: str = ""
     condiciones: str = ""
+    recurrencia_id: Optional[str] = None  # FacturaRecurrente que la emitió
+    periodo: Optional[datetime] = None
 
 class FacturaCreate(BaseModel):
     numero_factura: str
     tipo_factura: str = "A"
     pedido_id: Optional[str] = None
     cliente_id: str
+    condicion_iva: str = "Responsable Inscripto"
     items: List[ItemPedido]
-    impuestos: float = 0.0
+    impuestos: float = 0.0  # ignorado: el IVA se calcula en el servidor
+    porcentaje_iva: float = 21.0
     fecha_vencimiento: datetime
     notas: str = ""
     condiciones: str = ""
 
+# Factura Recurrente Model
+class FacturaRecurrente(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
+    cliente_id: str
+    cliente_nombre: str = ""
+    tipo_factura: str = "A"
+    condicion_iva: str = "Responsable Inscripto"
+    items: List[ItemPedido]
+    porcentaje_iva: float = 21.0
+    periodicidad: str = "mensual"  # mensual, bimestral, trimestral, semestral, anual
+    dia_emision: int
+    proxima_emision: datetime
+    dias_vencimiento: int = 10
+    numero_prefijo: str = ""
+    notas: str = ""
+    condiciones: str = ""
+    activa: bool = True
+    emitidas: int = 0
+    ultima_emision: Optional[datetime] = None
+    ultimo_error: str = ""
+    fecha_creacion: datetime = Field(default_factory=datetime.utcnow)
+
+class FacturaRecurrenteCreate(BaseModel):
+    cliente_id: str
+    tipo_factura: str = "A"
+    condicion_iva: str = "Responsable Inscripto"
+    items: List[ItemPedido]
+    porcentaje_iva: float = 21.0
+    periodicidad: str = "mensual"
+    proxima_emision: Optional[datetime] = None
+    dias_vencimiento: int = 10
+    numero_prefijo: str = ""
+    notas: str = ""
+    condiciones: str = ""
+
+class FacturaRecurrenteUpdate(BaseModel):
+    items: List[ItemPedido] = None
+    porcentaje_iva: float = None
+    proxima_emision: datetime = None
+    dias_vencimiento: int = None
+    notas: str = None
+    condiciones: str = None
+    activa: bool = None
+
 # Compra Model
 class ItemCompra(BaseModel):
     descripcion: str
@@ -273,6 +601,7 @@ class Compra(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
     numero_compra: str
     proveedor: str
+    proveedor_key: str = ""  # proveedor normalizado para agrupar e indexar
     categoria: str = "general"  # general, materiales, servicios, gastos
     items: List[ItemCompra]
     subtotal: float
@@ -296,6 +625,7 @@ class CompraCreate(BaseModel):
 # Remito Model
 class Remito(BaseModel):
     id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    version: int = 1
     numero_remito: str
     pedido_id: str
     factura_id: Optional[str] = None
@@ -336,6 +666,1164 @@ class StatusCheck(BaseModel):
 class StatusCheckCreate(BaseModel):
     client_name: str
 
+# Compact storage layout (schema version 2)
+# Items are stored with short keys and an articulo_id reference, and empty
+# free-text fields are omitted (the models restore their defaults on read).
+# Top-level queried/indexed fields keep their names.
+SCHEMA_VERSION = 2
+ITEM_SHORT_KEYS = {
+    "articulo_id": "a",
+    "descripcion": "d",
+    "cantidad": "q",
+    "precio_unitario": "p",
+    "subtotal": "s",
+    "alicuota_iva": "i"
+}
+OMITTED_WHEN_EMPTY = [
+    "notas", "condiciones", "contacto_nombre", "contacto_telefono", "transportista", "impuestos_detalle"
+]
+COMPACT_COLLECTIONS = ["facturas", "pedidos", "presupuestos", "remitos", "notas_credito", "notas_debito"]
+
+def compactar_item(item: dict) -> dict:
+    if "q" in item:
+        return item
+    return {
+        short: item[name] for name, short in ITEM_SHORT_KEYS.items()
+        if item.get(name) not in (None, "")
+    }
+
+def to_storage(obj: BaseModel) -> dict:
+    document = obj.dict()
+    document["items"] = [compactar_item(item) for item in document["items"]]
+    for field in OMITTED_WHEN_EMPTY:
+        if field in document and document[field] in ("", []):
+            del document[field]
+    document["_v"] = SCHEMA_VERSION
+    return document
+
+def migracion_compacta(document: dict) -> dict:
+    """Update that rewrites a stored v1 document in the compact layout."""
+    update = {"$set": {"_v": SCHEMA_VERSION, "items": [compactar_item(item) for item in document.get("items", [])]}}
+    unset = {field: "" for field in OMITTED_WHEN_EMPTY if document.get(field) in ("", [])}
+    if unset:
+        update["$unset"] = unset
+    return update
+
+_lazy_migrations = set()
+
+def migrar_en_lectura(collection: str, document: dict):
+    if collection.replace("_archive", "") not in COMPACT_COLLECTIONS or document.get("_v") == SCHEMA_VERSION:
+        return
+    task = asyncio.create_task(db[collection].update_one(
+        {"_id": document["_id"], "_v": {"$ne": SCHEMA_VERSION}}, migracion_compacta(document)
+    ))
+    _lazy_migrations.add(task)
+    task.add_done_callback(_lazy_migrations.discard)
+
+# Totals engine: validates item subtotals and computes IVA per rate
+ALICUOTAS_IVA = np.array([0.0, 10.5, 21.0, 27.0])
+CONDICIONES_SIN_IVA = {"Exento"}
+TOLERANCIA_SUBTOTAL = 0.01
+
+class TotalesCalculados(BaseModel):
+    subtotal: float
+    impuestos: float
+    total: float
+    impuestos_detalle: List[DetalleIVA]
+
+def _items_to_arrays(items: List[ItemPedido], porcentaje_iva: float):
+    n = len(items)
+    cantidades = np.fromiter((item.cantidad for item in items), dtype=np.float64, count=n)
+    precios = np.fromiter((item.precio_unitario for item in items), dtype=np.float64, count=n)
+    subtotales = np.fromiter((item.subtotal for item in items), dtype=np.float64, count=n)
+    alicuotas = np.fromiter(
+        (porcentaje_iva if item.alicuota_iva is None else item.alicuota_iva for item in items),
+        dtype=np.float64, count=n
+    )
+    return cantidades, precios, subtotales, alicuotas
+
+def calcular_totales_lote(documentos, porcentaje_iva: float = 21.0) -> List[TotalesCalculados]:
+    """Compute totals for many documents at once.
+
+    ``documentos`` is a sequence of ``(items, tipo_factura, condicion_iva)``
+    tuples. All items are flattened into one set of arrays and reduced per
+    (document, rate) with a single ``bincount``, so a mass billing run costs
+    about the same as one large invoice.
+    """
+    if not documentos:
+        return []
+    counts = np.array([len(items) for items, _, _ in documentos])
+    all_items = [item for items, _, _ in documentos for item in items]
+    cantidades, precios, subtotales, alicuotas = _items_to_arrays(all_items, porcentaje_iva)
+    grupos = np.repeat(np.arange(len(documentos)), counts)
+
+    calculados = np.round(cantidades * precios, 2)
+    diferencias = np.flatnonzero(np.abs(calculados - subtotales) > TOLERANCIA_SUBTOTAL)
+    if diferencias.size:
+        i = int(diferencias[0])
+        raise HTTPException(
+            status_code=400,
+            detail=f"Item subtotal mismatch: {all_items[i].descripcion!r} expected {calculados[i]:.2f}, got {subtotales[i]:.2f}"
+        )
+
+    indices_alicuota = np.searchsorted(ALICUOTAS_IVA, alicuotas)
+    indices_alicuota = np.minimum(indices_alicuota, len(ALICUOTAS_IVA) - 1)
+    invalidas = np.flatnonzero(ALICUOTAS_IVA[indices_alicuota] != alicuotas)
+    if invalidas.size:
+        raise HTTPException(status_code=400, detail=f"Invalid IVA rate: {alicuotas[invalidas[0]]}")
+
+    # Documents without discriminated IVA (factura C, exempt clients) pay 0%
+    sin_iva = np.array([
+        tipo == "C" or condicion in CONDICIONES_SIN_IVA for _, tipo, condicion in documentos
+    ], dtype=bool)
+    indices_alicuota = np.where(sin_iva[grupos], 0, indices_alicuota)
+
+    n_alicuotas = len(ALICUOTAS_IVA)
+    celdas = grupos * n_alicuotas + indices_alicuota
+    bases = np.bincount(celdas, weights=calculados, minlength=len(documentos) * n_alicuotas)
+    bases = bases.reshape(len(documentos), n_alicuotas)
+    importes = np.round(bases * ALICUOTAS_IVA / 100, 2)
+    usadas = np.bincount(celdas, minlength=len(documentos) * n_alicuotas).reshape(len(documentos), n_alicuotas) > 0
+
+    subtotal_docs = np.round(bases.sum(axis=1), 2)
+    impuestos_docs = np.round(importes.sum(axis=1), 2)
+    resultados = []
+    for d in range(len(documentos)):
+        resultados.append(TotalesCalculados(
+            subtotal=float(subtotal_docs[d]),
+            impuestos=float(impuestos_docs[d]),
+            total=float(np.round(subtotal_docs[d] + impuestos_docs[d], 2)),
+            impuestos_detalle=[
+                DetalleIVA(alicuota=float(ALICUOTAS_IVA[r]), base_imponible=float(np.round(bases[d, r], 2)), importe=float(importes[d, r]))
+                for r in np.flatnonzero(usadas[d])
+            ]
+        ))
+    return resultados
+
+def calcular_totales(items: List[ItemPedido], tipo_factura: str = "A",
+                     condicion_iva: str = "Responsable Inscripto", porcentaje_iva: float = 21.0) -> TotalesCalculados:
+    if not items:
+        return TotalesCalculados(subtotal=0.0, impuestos=0.0, total=0.0, impuestos_detalle=[])
+    return calcular_totales_lote([(items, tipo_factura, condicion_iva)], porcentaje_iva)[0]
+
+# Shared query parameters for list endpoints
+class ListQuery:
+    def __init__(
+        self,
+        fields: Optional[str] = None,
+        estado: Optional[str] = None,
+        cliente_id: Optional[str] = None,
+        fecha_desde: Optional[datetime] = None,
+        fecha_hasta: Optional[datetime] = None,
+        sort: Optional[str] = None,
+        limit: int = 1000,
+        ids: Optional[str] = None
+    ):
+        self.fields = fields
+        self.estado = estado
+        self.cliente_id = cliente_id
+        self.fecha_desde = fecha_desde
+        self.fecha_hasta = fecha_hasta
+        self.sort = sort
+        self.limit = limit
+        self.ids = ids
+
+async def list_documents(collection, model, params: ListQuery, fecha_field: str,
+                         estado_field: Optional[str] = "estado", cliente_field: Optional[str] = "cliente_id",
+                         base_filter: Optional[dict] = None):
+    """Run a list query with index-backed filters, sort and an optional sparse projection.
+
+    With ``fields`` the raw projected documents are returned, bypassing the
+    endpoint response_model, so pickers only download the columns they show.
+    With ``ids`` the other filters are ignored and the documents are returned
+    in the requested order (see get_many).
+    """
+    if params.ids is not None:
+        ids = [i.strip() for i in params.ids.split(",") if i.strip()]
+        return await get_many(collection, model, ids, params.fields)
+
+    model_fields = set(model.model_fields)
+    filter_query = dict(base_filter or {})
+    if params.estado is not None:
+        if not estado_field:
+            raise HTTPException(status_code=400, detail="Filter 'estado' not supported")
+        filter_query[estado_field] = params.estado
+    if params.cliente_id is not None:
+        if not cliente_field:
+            raise HTTPException(status_code=400, detail="Filter 'cliente_id' not supported")
+        filter_query[cliente_field] = params.cliente_id
+    if params.fecha_desde or params.fecha_hasta:
+        filter_query[fecha_field] = {}
+        if params.fecha_desde:
+            filter_query[fecha_field]["$gte"] = params.fecha_desde
+        if params.fecha_hasta:
+            filter_query[fecha_field]["$lte"] = params.fecha_hasta
+
+    sort_spec = []
+    for key in (params.sort or "").split(","):
+        key = key.strip()
+        if not key:
+            continue
+        direction = -1 if key.startswith("-") else 1
+        key = key.lstrip("+-")
+        if key not in model_fields:
+            raise HTTPException(status_code=400, detail=f"Invalid sort field: {key}")
+        sort_spec.append((key, direction))
+
+    projection = field_projection(model, params.fields)
+    limit = max(1, min(params.limit, 1000))
+    cursor = collection.find(filter_query, projection)
+    if sort_spec:
+        cursor = cursor.sort(sort_spec)
+    documents = await cursor.limit(limit).to_list(limit)
+
+    if projection:
+        return JSONResponse(content=jsonable_encoder(expandir_proyeccion(model, documents, projection)))
+    return [model(**document) for document in documents]
+
+_field_adapters = {}
+
+def expandir_proyeccion(model, documents: List[dict], projection: dict) -> List[dict]:
+    """Give projected documents the shape the model would: long item keys and omitted defaults restored."""
+    campos = []
+    for name in projection:
+        if name == "_id":
+            continue
+        field = model.model_fields[name]
+        if (model, name) not in _field_adapters:
+            _field_adapters[(model, name)] = TypeAdapter(field.annotation)
+        campos.append((name, field, _field_adapters[(model, name)]))
+    for document in documents:
+        for name, field, adapter in campos:
+            if name in document:
+                document[name] = adapter.dump_python(adapter.validate_python(document[name]))
+            elif not field.is_required() and field.default_factory is None:
+                document[name] = copy.deepcopy(field.default)
+    return documents
+
+def field_projection(model, fields: Optional[str]) -> Optional[dict]:
+    if not fields:
+        return None
+    requested = {f.strip() for f in fields.split(",") if f.strip()}
+    invalid = requested - set(model.model_fields)
+    if invalid:
+        raise HTTPException(status_code=400, detail=f"Invalid fields: {', '.join(sorted(invalid))}")
+    projection = {"_id": 0, "id": 1}
+    projection.update({f: 1 for f in requested})
+    return projection
+
+MULTI_GET_MAX_IDS = int(os.environ.get("MULTI_GET_MAX_IDS", "500"))
+
+async def get_many(collection, model, ids: List[str], fields: Optional[str] = None):
+    """Fetch documents by id with one $in query, keeping the request order.
+
+    Unknown ids are skipped; archived documents are looked up only for the
+    ids missing from the hot collection.
+    """
+    ids = list(dict.fromkeys(ids))
+    if len(ids) > MULTI_GET_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {MULTI_GET_MAX_IDS} ids per request")
+    projection = field_projection(model, fields)
+    documents = await collection.find({"id": {"$in": ids}}, projection).to_list(len(ids))
+    if collection.name in ARCHIVE_RULES and len(documents) < len(ids):
+        found = {document["id"] for document in documents}
+        missing = [i for i in ids if i not in found]
+        documents += await db[f"{collection.name}_archive"].find({"id": {"$in": missing}}, projection).to_list(len(missing))
+    by_id = {document["id"]: document for document in documents}
+    ordered = [by_id[i] for i in ids if i in by_id]
+
+    if projection:
+        return JSONResponse(content=jsonable_encoder(expandir_proyeccion(model, ordered, projection)))
+    return [model(**document) for document in ordered]
+
+# Optimistic concurrency: mutable documents carry a version that every update
+# increments; an If-Match header makes the update conditional on it.
+VERSIONED_COLLECTIONS = [
+    "articulos", "clientes", "pedidos", "presupuestos", "facturas", "remitos",
+    "recibos", "notas_credito", "notas_debito", "facturas_recurrentes"
+]
+
+def if_match_version(if_match: Optional[str] = Header(None)) -> Optional[int]:
+    if if_match is None or if_match.strip() == "*":
+        return None
+    etag = if_match.strip()
+    if etag.startswith("W/"):
+        etag = etag[2:]
+    try:
+        return int(etag.strip('"'))
+    except ValueError:
+        raise HTTPException(status_code=400, detail="Invalid If-Match header")
+
+async def update_versioned(collection, documento_id: str, update, not_found: str,
+                           if_match: Optional[int] = None, response: Optional[Response] = None,
+                           projection: Optional[dict] = None, session=None):
+    """Apply an update and return the resulting document in one round trip."""
+    filter_query = {"id": documento_id}
+    if if_match is not None:
+        filter_query["version"] = if_match
+    if isinstance(update, list):
+        update = update + [{"$set": {"version": {"$add": [{"$ifNull": ["$version", 1]}, 1]}}}]
+    else:
+        update = {**update, "$inc": {**update.get("$inc", {}), "version": 1}}
+    documento = await collection.find_one_and_update(
+        filter_query, update, projection=projection or {"_id": 0},
+        return_document=ReturnDocument.AFTER, session=session
+    )
+    if documento is None:
+        # Only the failure path pays a second round trip to tell 412 from 404
+        if if_match is not None and await collection.count_documents({"id": documento_id}, limit=1, session=session):
+            raise HTTPException(status_code=412, detail="Document was modified by another request")
+        raise HTTPException(status_code=404, detail=not_found)
+    if response is not None:
+        response.headers["ETag"] = f'"{documento["version"]}"'
+    if isinstance(update, list):
+        cambios = {k: documento.get(k) for stage in update[:-1] for k in stage.get("$set", {})}
+    else:
+        cambios = update.get("$set", {})
+    await auditar(collection.name, documento_id, "actualizar", cambios, documento["version"])
+    return documento
+
+# Ledger posting engine: every document event that moves a cuenta corriente
+# posts its movement together with the event. Movements carry a clave
+# (tipo_movimiento:documento_id) with a unique index, so posting is idempotent.
+LEDGER_TRANSACTIONS = os.environ.get("LEDGER_TRANSACTIONS", "auto").lower()  # auto, true, false
+LEDGER_BATCH_SIZE = int(os.environ.get("LEDGER_BATCH_SIZE", "1000"))
+ledger_state = {"transacciones": False}
+
+async def detectar_transacciones():
+    if LEDGER_TRANSACTIONS != "auto":
+        ledger_state["transacciones"] = LEDGER_TRANSACTIONS in ("1", "true", "yes")
+        return
+    try:
+        hello = await client.admin.command("hello")
+        # Transactions need a replica set or a sharded cluster
+        ledger_state["transacciones"] = "setName" in hello or hello.get("msg") == "isdbgrid"
+    except Exception as e:
+        logger.warning(f"Could not detect transaction support: {e}")
+        ledger_state["transacciones"] = False
+
+@asynccontextmanager
+async def transaccion():
+    """Yield a session inside a transaction, or None on a standalone server.
+
+    Without transactions the document is written first and its posting right
+    after; the reconciliation job catches a posting lost in between.
+    """
+    if not ledger_state["transacciones"]:
+        yield None
+        return
+    diferidos = []
+    token = auditoria_diferida.set(diferidos)
+    try:
+        async with await client.start_session() as session:
+            async with session.start_transaction():
+                yield session
+    finally:
+        auditoria_diferida.reset(token)
+    # Only reached once the transaction committed: an aborted one leaves no audit trail
+    for evento in diferidos:
+        await encolar_auditoria(evento)
+
+TRANSACCION_INTENTOS = int(os.environ.get("TRANSACCION_INTENTOS", "3"))
+
+def _transaccion_reintentable(error: PyMongoError) -> bool:
+    if error.has_error_label("TransientTransactionError"):
+        return True
+    # A concurrent writer of the same unique key aborted the transaction; a retry sees its write
+    if isinstance(error, BulkWriteError):
+        return any(e["code"] == 11000 for e in error.details.get("writeErrors", []))
+    return getattr(error, "code", None) == 11000
+
+async def en_transaccion(operacion):
+    """Run operacion(session) inside transaccion(), retrying it when a concurrent writer aborted it."""
+    for intento in range(1, TRANSACCION_INTENTOS + 1):
+        session = None
+        try:
+            async with transaccion() as session:
+                return await operacion(session)
+        except PyMongoError as e:
+            if session is None or intento == TRANSACCION_INTENTOS or not _transaccion_reintentable(e):
+                raise
+            logger.info(f"Transaction aborted by a concurrent write, retrying ({intento}): {e}")
+
+def clave_movimiento(tipo_movimiento: str, documento_id: str) -> str:
+    return f"{tipo_movimiento}:{documento_id}"
+
+async def contabilizar(movimientos: List[MovimientoCuentaCorriente], session=None) -> int:
+    """Post movements in batches; a movement already posted for its clave is skipped."""
+    registrados = 0
+    for i in range(0, len(movimientos), LEDGER_BATCH_SIZE):
+        operaciones = []
+        for movimiento in movimientos[i:i + LEDGER_BATCH_SIZE]:
+            clave = clave_movimiento(movimiento.tipo_movimiento, movimiento.documento_id)
+            operaciones.append(UpdateOne(
+                {"clave": clave}, {"$setOnInsert": {**movimiento.dict(), "clave": clave}}, upsert=True
+            ))
+        try:
+            result = await db.movimientos_cc.bulk_write(operaciones, ordered=False, session=session)
+            registrados += result.upserted_count
+        except BulkWriteError as e:
+            # A concurrent posting of the same clave won the upsert race. Inside a
+            # transaction that error has already aborted it: en_transaccion retries
+            if session is not None or any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                raise
+            registrados += e.details.get("nUpserted", 0)
+    return registrados
+
+async def revertir_movimiento(documento_id: str, tipo_original: str, tipo_reversion: str,
+                              descripcion: str, session=None) -> int:
+    """Post the mirror image of a movement, if the original was ever posted."""
+    original = await db.movimientos_cc.find_one(
+        {"documento_id": documento_id, "tipo_movimiento": tipo_original}, session=session
+    )
+    if original is None:
+        return 0
+    return await contabilizar([MovimientoCuentaCorriente(
+        cliente_id=original["cliente_id"],
+        cliente_nombre=original.get("cliente_nombre", ""),
+        tipo_movimiento=tipo_reversion,
+        documento_id=documento_id,
+        numero_documento=original.get("numero_documento", ""),
+        debe=original.get("haber", 0.0),
+        haber=original.get("debe", 0.0),
+        descripcion=descripcion
+    )], session)
+
+# Asynchronous audit trail: handlers enqueue events into a bounded buffer and a
+# background flusher writes them with insert_many in size/time based batches.
+AUDIT_BUFFER_SIZE = int(os.environ.get("AUDIT_BUFFER_SIZE", "10000"))
+AUDIT_BATCH_SIZE = int(os.environ.get("AUDIT_BATCH_SIZE", "500"))
+AUDIT_FLUSH_INTERVAL_SECONDS = float(os.environ.get("AUDIT_FLUSH_INTERVAL_SECONDS", "1"))
+AUDIT_ENQUEUE_TIMEOUT_SECONDS = 2.0
+AUDIT_USER_HEADER = "X-Usuario"
+current_actor: ContextVar[Optional[str]] = ContextVar("current_actor", default=None)
+# Events raised inside an open transaction wait here until it commits
+auditoria_diferida: ContextVar[Optional[list]] = ContextVar("auditoria_diferida", default=None)
+audit_queue: asyncio.Queue = asyncio.Queue(maxsize=AUDIT_BUFFER_SIZE)
+audit_stats = {"encolados": 0, "escritos": 0, "escrituras_directas": 0, "perdidos": 0}
+
+async def auditar(coleccion: str, documento_id: str, accion: str,
+                  cambios: Optional[dict] = None, version: Optional[int] = None):
+    evento = {
+        "id": str(uuid.uuid4()),
+        "coleccion": coleccion,
+        "documento_id": documento_id,
+        "accion": accion,  # crear, actualizar, eliminar
+        "cambios": jsonable_encoder(cambios) if cambios else None,
+        "version": version,
+        "usuario": current_actor.get(),
+        "fecha": datetime.utcnow()
+    }
+    if current_tenant.get() is not None:
+        evento["tenant_id"] = current_tenant.get()
+    diferidos = auditoria_diferida.get()
+    if diferidos is not None:
+        diferidos.append(evento)
+        return
+    await encolar_auditoria(evento)
+
+async def encolar_auditoria(evento: dict):
+    audit_stats["encolados"] += 1
+    try:
+        audit_queue.put_nowait(evento)
+        return
+    except asyncio.QueueFull:
+        pass
+    # Back-pressure: a full buffer slows the producer down instead of growing
+    try:
+        await asyncio.wait_for(audit_queue.put(evento), AUDIT_ENQUEUE_TIMEOUT_SECONDS)
+    except asyncio.TimeoutError:
+        audit_stats["escrituras_directas"] += 1
+        await _escribir_auditoria([evento])
+
+async def _escribir_auditoria(lote: List[dict]):
+    for intento in range(3):
+        try:
+            # Events carry their own tenant_id; written outside any tenant scope
+            token = current_tenant.set(None)
+            try:
+                await db.audit_log.insert_many(lote, ordered=False)
+            finally:
+                current_tenant.reset(token)
+            audit_stats["escritos"] += len(lote)
+            return
+        except Exception as e:
+            logger.error(f"Audit flush of {len(lote)} events failed (attempt {intento + 1}): {e}")
+            await asyncio.sleep(0.5 * (intento + 1))
+    audit_stats["perdidos"] += len(lote)
+
+def _lote_auditoria(lote: List[dict]):
+    while len(lote) < AUDIT_BATCH_SIZE and not audit_queue.empty():
+        lote.append(audit_queue.get_nowait())
+
+async def audit_flusher():
+    while True:
+        lote = [await audit_queue.get()]
+        try:
+            limite = time.monotonic() + AUDIT_FLUSH_INTERVAL_SECONDS
+            _lote_auditoria(lote)
+            while len(lote) < AUDIT_BATCH_SIZE and time.monotonic() < limite:
+                try:
+                    lote.append(await asyncio.wait_for(audit_queue.get(), limite - time.monotonic()))
+                except asyncio.TimeoutError:
+                    break
+                _lote_auditoria(lote)
+        finally:
+            # Also runs on shutdown cancellation so the batch in hand is not lost
+            await _escribir_auditoria(lote)
+
+async def vaciar_auditoria():
+    while not audit_queue.empty():
+        lote = []
+        _lote_auditoria(lote)
+        await _escribir_auditoria(lote)
+
+@api_router.get("/auditoria")
+async def get_auditoria(coleccion: Optional[str] = None, documento_id: Optional[str] = None,
+                        usuario: Optional[str] = None, limit: int = 100):
+    filter_query = {}
+    if coleccion:
+        filter_query["coleccion"] = coleccion
+    if documento_id:
+        filter_query["documento_id"] = documento_id
+    if usuario:
+        filter_query["usuario"] = usuario
+    limit = max(1, min(limit, 1000))
+    return await db.audit_log.find(filter_query, {"_id": 0}).sort("fecha", -1).limit(limit).to_list(limit)
+
+@api_router.get("/auditoria/estado")
+async def get_estado_auditoria():
+    return {"pendientes": audit_queue.qsize(), "capacidad": AUDIT_BUFFER_SIZE, **audit_stats}
+
+@api_router.get("/auditoria/{coleccion}/{documento_id}")
+async def get_auditoria_documento(coleccion: str, documento_id: str, limit: int = 100):
+    return await get_auditoria(coleccion=coleccion, documento_id=documento_id, limit=limit)
+
+# Background job queue for heavy operations
+JOB_WORKERS = int(os.environ.get("JOB_WORKERS", "2"))
+JOB_HEARTBEAT_SECONDS = 15
+JOB_STALE_SECONDS = 90
+JOB_RETRY_BACKOFF_SECONDS = 30
+EXPORT_DIR = Path(os.environ.get("EXPORT_DIR", ROOT_DIR / "exports"))
+WORKER_ID = f"{socket.gethostname()}:{os.getpid()}"
+JOB_HANDLERS = {}
+JOBS_PUBLICOS = set()  # tipos clients may enqueue through POST /jobs; the rest have their own endpoints
+JOB_VALIDATORS = {}  # tipo -> check of client-supplied parametros, run at enqueue time
+_jobs_wakeup = asyncio.Event()
+
+class JobCreate(BaseModel):
+    tipo: str
+    parametros: dict = {}
+    max_intentos: int = 3
+
+class JobCancelled(Exception):
+    pass
+
+def job_handler(tipo: str, publico: bool = False, validar=None):
+    def register(fn):
+        JOB_HANDLERS[tipo] = fn
+        if publico:
+            JOBS_PUBLICOS.add(tipo)
+        if validar:
+            JOB_VALIDATORS[tipo] = validar
+        return fn
+    return register
+
+class JobContext:
+    def __init__(self, job: dict):
+        self.job_id = job["id"]
+        self.parametros = job.get("parametros", {})
+
+    async def progreso(self, porcentaje: float, mensaje: str = ""):
+        job = await db.jobs.find_one_and_update(
+            {"id": self.job_id},
+            {"$set": {"progreso": round(porcentaje, 1), "mensaje": mensaje, "heartbeat": datetime.utcnow()}},
+            projection={"cancelacion_solicitada": 1}
+        )
+        if job and job.get("cancelacion_solicitada"):
+            raise JobCancelled()
+
+async def encolar_job(tipo: str, parametros: dict = None, max_intentos: int = 3) -> dict:
+    if tipo not in JOB_HANDLERS:
+        raise HTTPException(status_code=400, detail=f"Unknown job tipo: {tipo}")
+    job = {
+        "id": str(uuid.uuid4()),
+        "tipo": tipo,
+        "parametros": parametros or {},
+        "estado": "pendiente",  # pendiente, en_proceso, completado, fallido, cancelado
+        "progreso": 0.0,
+        "mensaje": "",
+        "intentos": 0,
+        "max_intentos": max_intentos,
+        "cancelacion_solicitada": False,
+        "resultado": None,
+        "error": None,
+        "fecha_creacion": datetime.utcnow(),
+        "ejecutar_desde": datetime.utcnow(),
+        "fecha_inicio": None,
+        "fecha_fin": None
+    }
+    await db.jobs.insert_one(dict(job))
+    _jobs_wakeup.set()
+    return job
+
+def job_accepted(job: dict):
+    return JSONResponse(
+        status_code=202,
+        content={"job_id": job["id"], "tipo": job["tipo"], "estado": job["estado"]},
+        headers={"Location": f"/api/jobs/{job['id']}"}
+    )
+
+async def _claim_job():
+    now = datetime.utcnow()
+    return await db.jobs.find_one_and_update(
+        {"$or": [
+            {"estado": "pendiente", "ejecutar_desde": {"$lte": now}},
+            # Jobs whose worker died without finishing them
+            {"estado": "en_proceso", "heartbeat": {"$lt": now - timedelta(seconds=JOB_STALE_SECONDS)}}
+        ]},
+        {"$set": {"estado": "en_proceso", "worker": WORKER_ID, "fecha_inicio": now, "heartbeat": now},
+         "$inc": {"intentos": 1}},
+        sort=[("ejecutar_desde", 1)],
+        return_document=ReturnDocument.AFTER
+    )
+
+async def _run_job(job: dict):
+    handler_task = asyncio.create_task(JOB_HANDLERS[job["tipo"]](JobContext(job)))
+    while True:
+        done, _ = await asyncio.wait([handler_task], timeout=JOB_HEARTBEAT_SECONDS)
+        if done:
+            return handler_task.result()
+        current = await db.jobs.find_one_and_update(
+            {"id": job["id"]}, {"$set": {"heartbeat": datetime.utcnow()}},
+            projection={"cancelacion_solicitada": 1}
+        )
+        if current and current.get("cancelacion_solicitada"):
+            handler_task.cancel()
+            await asyncio.gather(handler_task, return_exceptions=True)
+            raise JobCancelled()
+
+async def job_worker():
+    while True:
+        try:
+            job = await _claim_job()
+            if job is None:
+                _jobs_wakeup.clear()
+                try:
+                    await asyncio.wait_for(_jobs_wakeup.wait(), timeout=2)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            tenant_token = current_tenant.set(job.get("tenant_id"))
+            try:
+                resultado = await _run_job(job)
+                update = {"estado": "completado", "progreso": 100.0, "resultado": resultado}
+            except JobCancelled:
+                update = {"estado": "cancelado"}
+            except asyncio.CancelledError:
+                # Worker shutdown: hand the job back to the queue
+                await db.jobs.update_one({"id": job["id"]}, {"$set": {"estado": "pendiente"}, "$inc": {"intentos": -1}})
+                raise
+            except Exception as e:
+                logger.error(f"Job {job['id']} ({job['tipo']}) failed: {e}")
+                update = {"error": "".join(traceback.format_exception_only(type(e), e)).strip()}
+                if job["intentos"] < job["max_intentos"]:
+                    update["estado"] = "pendiente"
+                    update["ejecutar_desde"] = datetime.utcnow() + timedelta(seconds=JOB_RETRY_BACKOFF_SECONDS * job["intentos"])
+                else:
+                    update["estado"] = "fallido"
+            finally:
+                current_tenant.reset(tenant_token)
+            if update["estado"] != "pendiente":
+                update["fecha_fin"] = datetime.utcnow()
+            # If this write fails the job goes stale and is reclaimed after JOB_STALE_SECONDS
+            await db.jobs.update_one({"id": job["id"]}, {"$set": update})
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Job worker error: {e}")
+            await asyncio.sleep(1)
+
+@api_router.post("/jobs", status_code=202)
+async def create_job(job: JobCreate):
+    if job.tipo not in JOBS_PUBLICOS:
+        raise HTTPException(status_code=400, detail=f"Job tipo cannot be enqueued directly: {job.tipo}")
+    if job.tipo in JOB_VALIDATORS:
+        JOB_VALIDATORS[job.tipo](job.parametros)
+    return job_accepted(await encolar_job(job.tipo, job.parametros, job.max_intentos))
+
+@api_router.get("/jobs")
+async def get_jobs(estado: Optional[str] = None, tipo: Optional[str] = None, limit: int = 100):
+    filter_query = {}
+    if estado:
+        filter_query["estado"] = estado
+    if tipo:
+        filter_query["tipo"] = tipo
+    return await db.jobs.find(filter_query, {"_id": 0}).sort("fecha_creacion", -1).to_list(max(1, min(limit, 1000)))
+
+@api_router.get("/jobs/{job_id}")
+async def get_job(job_id: str):
+    job = await db.jobs.find_one({"id": job_id}, {"_id": 0})
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return job
+
+@api_router.post("/jobs/{job_id}/cancelar")
+async def cancelar_job(job_id: str):
+    job = await db.jobs.find_one_and_update(
+        {"id": job_id, "estado": "pendiente"},
+        {"$set": {"estado": "cancelado", "fecha_fin": datetime.utcnow()}},
+        return_document=ReturnDocument.AFTER
+    )
+    if job is None:
+        # Running jobs are cancelled by their worker on the next heartbeat
+        job = await db.jobs.find_one_and_update(
+            {"id": job_id, "estado": "en_proceso"},
+            {"$set": {"cancelacion_solicitada": True}},
+            return_document=ReturnDocument.AFTER
+        )
+    if job is None:
+        if not await db.jobs.find_one({"id": job_id}):
+            raise HTTPException(status_code=404, detail="Job not found")
+        raise HTTPException(status_code=409, detail="Job already finished")
+    return {"job_id": job_id, "estado": job["estado"], "cancelacion_solicitada": job.get("cancelacion_solicitada", False)}
+
+@api_router.get("/jobs/{job_id}/descarga")
+async def descargar_resultado_job(job_id: str):
+    job = await db.jobs.find_one({"id": job_id, "estado": "completado"})
+    if not job or not (job.get("resultado") or {}).get("archivo"):
+        raise HTTPException(status_code=404, detail="Job result file not found")
+    archivo = EXPORT_DIR / job["resultado"]["archivo"]
+    if not archivo.exists():
+        raise HTTPException(status_code=404, detail="Job result file not found")
+    return FileResponse(archivo, filename=archivo.name, media_type="application/gzip")
+
+EXPORTABLE_COLLECTIONS = {
+    "clientes": Cliente, "articulos": Articulo, "pedidos": Pedido, "presupuestos": Presupuesto,
+    "facturas": Factura, "compras": Compra, "remitos": Remito, "recibos": Recibo,
+    "notas_credito": NotaCredito, "notas_debito": NotaDebito, "movimientos_cc": MovimientoCuentaCorriente
+}
+EXPORT_FILTER_OPERATORS = {"$eq", "$ne", "$gt", "$gte", "$lt", "$lte", "$in", "$nin"}
+
+def _valor_filtro(campo: str, valor, es_fecha: bool):
+    if es_fecha and isinstance(valor, str):
+        try:
+            return datetime.fromisoformat(valor)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid date for {campo}: {valor}")
+    if valor is not None and not isinstance(valor, (str, int, float, bool)):
+        raise HTTPException(status_code=400, detail=f"Filter values must be scalars: {campo}")
+    return valor
+
+def validar_exportacion(parametros: dict) -> dict:
+    """Check an export request; the filter only allows model fields with equality and range operators."""
+    coleccion = parametros.get("coleccion")
+    if coleccion not in EXPORTABLE_COLLECTIONS:
+        raise HTTPException(status_code=400, detail=f"Collection not exportable: {coleccion}")
+    filtro = parametros.get("filtro") or {}
+    if not isinstance(filtro, dict):
+        raise HTTPException(status_code=400, detail="filtro must be an object")
+    campos = EXPORTABLE_COLLECTIONS[coleccion].model_fields
+    validado = {}
+    for campo, condicion in filtro.items():
+        if campo.startswith("$") or campo not in campos:
+            raise HTTPException(status_code=400, detail=f"Filter field not allowed: {campo}")
+        anotacion = campos[campo].annotation
+        es_fecha = anotacion is datetime or datetime in get_args(anotacion)
+        if not isinstance(condicion, dict):
+            validado[campo] = _valor_filtro(campo, condicion, es_fecha)
+            continue
+        validado[campo] = {}
+        for operador, valor in condicion.items():
+            if operador not in EXPORT_FILTER_OPERATORS:
+                raise HTTPException(status_code=400, detail=f"Filter operator not allowed: {operador}")
+            if operador in ("$in", "$nin"):
+                if not isinstance(valor, list):
+                    raise HTTPException(status_code=400, detail=f"{operador} needs a list: {campo}")
+                validado[campo][operador] = [_valor_filtro(campo, v, es_fecha) for v in valor]
+            else:
+                validado[campo][operador] = _valor_filtro(campo, valor, es_fecha)
+    return validado
+
+@job_handler("exportar_coleccion", publico=True, validar=validar_exportacion)
+async def job_exportar_coleccion(ctx: JobContext):
+    filtro = validar_exportacion(ctx.parametros)
+    coleccion = ctx.parametros["coleccion"]
+    total = await db[coleccion].count_documents(filtro)
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    nombre = f"{coleccion}-{ctx.job_id}.ndjson.gz"
+    exportados = 0
+    with gzip.open(EXPORT_DIR / nombre, "wt", encoding="utf-8") as salida:
+        async for document in db[coleccion].find(filtro, {"_id": 0}).batch_size(1000):
+            salida.write(json_util.dumps(document) + "\n")
+            exportados += 1
+            if exportados % 5000 == 0:
+                await ctx.progreso(100 * exportados / max(total, 1), f"{exportados}/{total}")
+    return {"archivo": nombre, "documentos": exportados}
+
+@job_handler("reconstruir_indices", publico=True)
+async def job_reconstruir_indices(ctx: JobContext):
+    await create_indexes()
+    return {"indices": "ok"}
+
+@job_handler("reporte_compras_proveedores", publico=True)
+async def job_reporte_compras_proveedores(ctx: JobContext):
+    parametros = dict(ctx.parametros)
+    for key in ("fecha_desde", "fecha_hasta"):
+        if isinstance(parametros.get(key), str):
+            parametros[key] = datetime.fromisoformat(parametros[key])
+    return await get_reporte_compras_proveedores(**parametros)
+
+@job_handler("migrar_esquema", publico=True)
+async def job_migrar_esquema(ctx: JobContext):
+    colecciones = COMPACT_COLLECTIONS + [f"{c}_archive" for c in ARCHIVE_RULES if c in COMPACT_COLLECTIONS]
+    migrados = {}
+    for i, coleccion in enumerate(colecciones):
+        migrados[coleccion] = 0
+        pendientes = {"_v": {"$ne": SCHEMA_VERSION}}
+        while True:
+            batch = await db[coleccion].find(pendientes).limit(1000).to_list(1000)
+            if not batch:
+                break
+            await db[coleccion].bulk_write([
+                UpdateOne({"_id": document["_id"], "_v": {"$ne": SCHEMA_VERSION}}, migracion_compacta(document))
+                for document in batch
+            ], ordered=False)
+            migrados[coleccion] += len(batch)
+            await ctx.progreso(100 * i / len(colecciones), f"{coleccion}: {migrados[coleccion]}")
+    return {"migrados": migrados, "version": SCHEMA_VERSION}
+
+# Hot/cold archival of closed documents
+ARCHIVE_AFTER_DAYS = int(os.environ.get("ARCHIVE_AFTER_DAYS", "365"))
+ARCHIVE_BATCH_SIZE = int(os.environ.get("ARCHIVE_BATCH_SIZE", "1000"))
+ARCHIVE_INTERVAL_HOURS = float(os.environ.get("ARCHIVE_INTERVAL_HOURS", "24"))
+ARCHIVE_RULES = {
+    "facturas": ({"estado": "pagada"}, "fecha_emision"),
+    "remitos": ({"estado": "entregado"}, "fecha_emision"),
+    "pedidos": ({"estado": {"$in": ["completado", "cancelado"]}}, "fecha_pedido"),
+}
+
+async def find_with_archive(collection: str, filter_query: dict):
+    document = await db[collection].find_one(filter_query)
+    if document is None and collection in ARCHIVE_RULES:
+        collection = f"{collection}_archive"
+        document = await db[collection].find_one(filter_query)
+    if document is not None:
+        migrar_en_lectura(collection, document)
+    return document
+
+def collections_for_report(collection: str, incluir_archivo: bool):
+    if incluir_archivo and collection in ARCHIVE_RULES:
+        return [db[collection], db[f"{collection}_archive"]]
+    return [db[collection]]
+
+async def archivar_coleccion(collection: str, antiguedad_dias: int) -> int:
+    closed_filter, fecha_field = ARCHIVE_RULES[collection]
+    filter_query = dict(closed_filter)
+    filter_query[fecha_field] = {"$lt": datetime.utcnow() - timedelta(days=antiguedad_dias)}
+    archivados = 0
+    while True:
+        batch = await db[collection].find(filter_query).limit(ARCHIVE_BATCH_SIZE).to_list(ARCHIVE_BATCH_SIZE)
+        if not batch:
+            break
+        # Replacing also refreshes copies left behind by an interrupted earlier run
+        await db[f"{collection}_archive"].bulk_write(
+            [ReplaceOne({"_id": doc["_id"]}, doc, upsert=True) for doc in batch], ordered=False
+        )
+        # Only the state that was copied is removed: a document updated in between stays live
+        resultado = await db[collection].bulk_write([
+            DeleteOne({**filter_query, "_id": doc["_id"], "version": doc.get("version")}) for doc in batch
+        ], ordered=False)
+        archivados += resultado.deleted_count
+        if resultado.deleted_count < len(batch):
+            ids = [doc["_id"] for doc in batch]
+            vivos = await db[collection].distinct("_id", {"_id": {"$in": ids}})
+            await db[f"{collection}_archive"].delete_many({"_id": {"$in": vivos}})
+        if len(batch) < ARCHIVE_BATCH_SIZE:
+            break
+    return archivados
+
+async def archivar_documentos(antiguedad_dias: Optional[int] = None, ctx: Optional[JobContext] = None):
+    antiguedad_dias = ARCHIVE_AFTER_DAYS if antiguedad_dias is None else antiguedad_dias
+    resultado = {}
+    for i, collection in enumerate(ARCHIVE_RULES):
+        if ctx:
+            await ctx.progreso(100 * i / len(ARCHIVE_RULES), f"Archivando {collection}")
+        resultado[collection] = await archivar_coleccion(collection, antiguedad_dias)
+    logger.info(f"Archived closed documents older than {antiguedad_dias} days: {resultado}")
+    return resultado
+
+async def archive_worker():
+    while True:
+        await asyncio.sleep(ARCHIVE_INTERVAL_HOURS * 3600)
+        try:
+            await archivar_documentos()
+        except Exception as e:
+            logger.error(f"Archival run failed: {e}")
+
+@job_handler("archivar")
+async def job_archivar(ctx: JobContext):
+    return {"archivados": await archivar_documentos(ctx.parametros.get("antiguedad_dias"), ctx)}
+
+@api_router.post("/archivo/ejecutar", status_code=202)
+async def ejecutar_archivo(antiguedad_dias: Optional[int] = None):
+    if antiguedad_dias is not None and antiguedad_dias < 0:
+        raise HTTPException(status_code=400, detail="antiguedad_dias must not be negative")
+    return job_accepted(await encolar_job("archivar", {"antiguedad_dias": antiguedad_dias}, max_intentos=1))
+
+@api_router.get("/archivo")
+async def get_estado_archivo():
+    collections = list(ARCHIVE_RULES)
+    counts = await asyncio.gather(*[
+        db[name].estimated_document_count() for collection in collections
+        for name in (collection, f"{collection}_archive")
+    ])
+    return {
+        "antiguedad_dias": ARCHIVE_AFTER_DAYS,
+        "colecciones": {
+            collection: {"activos": counts[2 * i], "archivados": counts[2 * i + 1]}
+            for i, collection in enumerate(collections)
+        }
+    }
+
+# Backup and restore of every collection the app uses, as compressed
+# per-collection NDJSON or BSON files plus a manifest with checksums
+BACKUP_DIR = Path(os.environ.get("BACKUP_DIR", ROOT_DIR / "backups"))
+BACKUP_CONCURRENCY = int(os.environ.get("BACKUP_CONCURRENCY", "4"))
+BACKUP_BATCH_SIZE = 1000
+BACKUP_FORMATS = {"ndjson": ".ndjson.gz", "bson": ".bson.gz"}
+# Short-lived state: idempotency keys expire by TTL, jobs are the queue itself
+BACKUP_EXCLUDED = {"idempotency_keys", "jobs"}
+BACKUP_NAME_PATTERN = re.compile(r"^[A-Za-z0-9_.-]+$")
+
+def _codificar_lote(documentos: List[dict], formato: str) -> bytes:
+    if formato == "bson":
+        return b"".join(bson.encode(document) for document in documentos)
+    return "".join(
+        json_util.dumps(document, json_options=json_util.CANONICAL_JSON_OPTIONS) + "\n" for document in documentos
+    ).encode("utf-8")
+
+def _leer_documentos(archivo, formato: str):
+    if formato == "bson":
+        yield from bson.decode_file_iter(archivo)
+        return
+    for linea in archivo:
+        if linea.strip():
+            yield json_util.loads(linea)
+
+def _siguiente_lote(documentos, cantidad: int) -> List[dict]:
+    lote = []
+    for document in documentos:
+        lote.append(document)
+        if len(lote) >= cantidad:
+            break
+    return lote
+
+def _sha256(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as archivo:
+        for bloque in iter(lambda: archivo.read(1 << 20), b""):
+            digest.update(bloque)
+    return digest.hexdigest()
+
+def _indices_respaldables(index_information: dict) -> List[dict]:
+    indices = []
+    for nombre, opciones in index_information.items():
+        if nombre == "_id_":
+            continue
+        indice = {k: v for k, v in opciones.items() if k not in ("v", "ns", "key")}
+        indice["nombre"] = nombre
+        indice["key"] = [[field, direction] for field, direction in opciones["key"]]
+        indices.append(indice)
+    return indices
+
+async def colecciones_respaldables() -> List[str]:
+    nombres = await db.list_collection_names()
+    return sorted(n for n in nombres if not n.startswith("system.") and n not in BACKUP_EXCLUDED)
+
+async def respaldar_base(destino: Path, formato: str = "ndjson", colecciones: Optional[List[str]] = None,
+                         ctx: Optional[JobContext] = None) -> dict:
+    """Stream collections concurrently into destino and write manifest.json last.
+
+    When the deployment supports it all collections are read from one snapshot
+    session, so the backup is a consistent point in time. A session serves one
+    operation at a time, so batch fetches take turns while encoding,
+    compression and file writes of different collections overlap.
+    """
+    if formato not in BACKUP_FORMATS:
+        raise ValueError(f"Unknown backup format: {formato}")
+    respaldables = await colecciones_respaldables()
+    nombres = colecciones or respaldables
+    desconocidas = set(nombres) - set(respaldables)
+    if desconocidas:
+        raise ValueError(f"Collections cannot be backed up: {', '.join(sorted(desconocidas))}")
+    destino.mkdir(parents=True, exist_ok=True)
+    consistente = ledger_state["transacciones"]
+    semaforo = asyncio.Semaphore(BACKUP_CONCURRENCY)
+    turno_lectura = asyncio.Lock() if consistente else nullcontext()
+    resultado = {}
+    terminadas = 0
+
+    session_context = await client.start_session(snapshot=True) if consistente else nullcontext()
+    async with session_context as session:
+        async def respaldar(nombre: str):
+            nonlocal terminadas
+            async with semaforo:
+                archivo = (destino / f"{nombre}{BACKUP_FORMATS[formato]}").resolve()
+                if archivo.parent != destino.resolve():
+                    raise ValueError(f"Invalid collection name: {nombre}")
+                cursor = db[nombre].find({}, session=session).batch_size(BACKUP_BATCH_SIZE)
+                documentos = 0
+                with gzip.open(archivo, "wb") as salida:
+                    while True:
+                        async with turno_lectura:
+                            lote = await cursor.to_list(BACKUP_BATCH_SIZE)
+                        if not lote:
+                            break
+                        await asyncio.to_thread(lambda: salida.write(_codificar_lote(lote, formato)))
+                        documentos += len(lote)
+                resultado[nombre] = {
+                    "archivo": archivo.name,
+                    "documentos": documentos,
+                    "bytes": archivo.stat().st_size,
+                    "sha256": await asyncio.to_thread(_sha256, archivo),
+                    "indices": _indices_respaldables(await db[nombre].index_information())
+                }
+                terminadas += 1
+                if ctx:
+                    await ctx.progreso(100 * terminadas / len(nombres), nombre)
+
+        await asyncio.gather(*[respaldar(nombre) for nombre in nombres])
+        operation_time = getattr(session, "operation_time", None)
+
+    manifest = {
+        "version": 1,
+        "fecha": datetime.utcnow(),
+        "base": DB_NAME,
+        "tenant_id": current_tenant.get(),
+        "formato": formato,
+        "consistente": consistente,
+        "operation_time": str(operation_time) if operation_time else None,
+        "colecciones": {nombre: resultado[nombre] for nombre in nombres}
+    }
+    (destino / "manifest.json").write_text(json_util.dumps(manifest, indent=2))
+    return manifest
+
+async def restaurar_base(origen: Path, colecciones: Optional[List[str]] = None, reemplazar: bool = False,
+                         ctx: Optional[JobContext] = None) -> dict:
+    """Verify checksums, bulk-load collections in parallel, then rebuild indexes."""
+    manifest = json_util.loads((origen / "manifest.json").read_text())
+    entradas = manifest["colecciones"]
+    if colecciones:
+        desconocidas = set(colecciones) - set(entradas)
+        if desconocidas:
+            raise ValueError(f"Collections not in backup: {', '.join(sorted(desconocidas))}")
+        entradas = {nombre: entradas[nombre] for nombre in colecciones}
+    # Nothing is touched unless every file is intact
+    for entrada in entradas.values():
+        if await asyncio.to_thread(_sha256, origen / entrada["archivo"]) != entrada["sha256"]:
+            raise ValueError(f"Checksum mismatch for {entrada['archivo']}")
+
+    formato = manifest["formato"]
+    semaforo = asyncio.Semaphore(BACKUP_CONCURRENCY)
+    resultado = {}
+
+    async def restaurar(nombre: str, entrada: dict):
+        async with semaforo:
+            if reemplazar:
+                if current_tenant.get() is None:
+                    await db[nombre].drop()
+                else:
+                    await db[nombre].delete_many({})
+            insertados = duplicados = 0
+            with gzip.open(origen / entrada["archivo"], "rb") as archivo:
+                documentos = _leer_documentos(archivo, formato)
+                while True:
+                    lote = await asyncio.to_thread(_siguiente_lote, documentos, BACKUP_BATCH_SIZE)
+                    if not lote:
+                        break
+                    try:
+                        await db[nombre].insert_many(lote, ordered=False)
+                        insertados += len(lote)
+                    except BulkWriteError as e:
+                        # Documents already present are kept, so a restore can be resumed
+                        if any(error["code"] != 11000 for error in e.details.get("writeErrors", [])):
+                            raise
+                        insertados += e.details.get("nInserted", 0)
+                        duplicados += len(e.details.get("writeErrors", []))
+            # Indexes are built once the data is in, not maintained per insert
+            for indice in entrada["indices"]:
+                opciones = {k: v for k, v in indice.items() if k not in ("nombre", "key")}
+                await db[nombre].create_index(
+                    [(field, direction) for field, direction in indice["key"]], name=indice["nombre"], **opciones
+                )
+            resultado[nombre] = {"insertados": insertados, "duplicados": duplicados, "esperados": entrada["documentos"]}
+            if ctx:
+                await ctx.progreso(100 * len(resultado) / len(entradas), nombre)
+
+    await asyncio.gather(*[restaurar(nombre, entrada) for nombre, entrada in entradas.items()])
+    await create_indexes()
+    return {"origen": origen.name, "fecha_backup": manifest["fecha"], "colecciones": resultado}
+
+def _directorio_backup(nombre: str) -> Path:
+    if not BACKUP_NAME_PATTERN.match(nombre) or not (BACKUP_DIR / nombre / "manifest.json").exists():
+        raise HTTPException(status_code=404, detail="Backup not found")
+    return BACKUP_DIR / nombre
+
+@job_handler("backup")
+async def job_backup(ctx: JobContext):
+    destino = BACKUP_DIR / f"backup-{datetime.utcnow():%Y%m%dT%H%M%S}-{ctx.job_id[:8]}"
+    manifest = await respaldar_base(destino, ctx.parametros.get("formato", "ndjson"), ctx.parametros.get("colecciones"), ctx)
+    return {
+        "backup": destino.name,
+        "consistente": manifest["consistente"],
+        "colecciones": {nombre: entrada["documentos"] for nombre, entrada in manifest["colecciones"].items()}
+    }
+
+@job_handler("restore")
+async def job_restore(ctx: JobContext):
+    # Checked again here: the job may not have been enqueued through /admin/restore
+    origen = _directorio_backup(str(ctx.parametros.get("backup", "")))
+    return await restaurar_base(origen, ctx.parametros.get("colecciones"), bool(ctx.parametros.get("reemplazar")), ctx)
+
+class RestoreRequest(BaseModel):
+    backup: str
+    colecciones: Optional[List[str]] = None
+    reemplazar: bool = False
+
+@api_router.post("/admin/backup", status_code=202)
+async def crear_backup(formato: str = "ndjson", colecciones: Optional[str] = None):
+    if formato not in BACKUP_FORMATS:
+        raise HTTPException(status_code=400, detail="formato must be ndjson or bson")
+    parametros = {"formato": formato}
+    if colecciones:
+        parametros["colecciones"] = [c.strip() for c in colecciones.split(",") if c.strip()]
+        invalidas = sorted(set(parametros["colecciones"]) - set(await colecciones_respaldables()))
+        if invalidas:
+            raise HTTPException(status_code=400, detail=f"Invalid colecciones: {', '.join(invalidas)}")
+    return job_accepted(await encolar_job("backup", parametros, max_intentos=1))
+
+@api_router.get("/admin/backups")
+async def listar_backups():
+    backups = []
+    for manifest_path in sorted(BACKUP_DIR.glob("*/manifest.json"), reverse=True):
+        manifest = json_util.loads(manifest_path.read_text())
+        backups.append({
+            "backup": manifest_path.parent.name,
+            "fecha": manifest["fecha"],
+            "formato": manifest["formato"],
+            "consistente": manifest["consistente"],
+            "colecciones": len(manifest["colecciones"]),
+            "documentos": sum(entrada["documentos"] for entrada in manifest["colecciones"].values()),
+            "bytes": sum(entrada["bytes"] for entrada in manifest["colecciones"].values())
+        })
+    return backups
+
+@api_router.post("/admin/restore", status_code=202)
+async def restaurar_backup(restore: RestoreRequest):
+    _directorio_backup(restore.backup)
+    return job_accepted(await encolar_job("restore", restore.dict(), max_intentos=1))
+
 # CRUD Endpoints for Presupuestos
 @api_router.post("/presupuestos", response_model=Presupuesto)
 async def create_presupuesto(presupuesto: PresupuestoCreate):
@@ -344,39 +1832,41 @@ async def create_presupuesto(presupuesto: PresupuestoCreate):
     cliente_nombre = cliente["nombre"] if cliente else ""
     
     # Calculate totals
-    subtotal = sum(item.subtotal for item in presupuesto.items)
-    total = subtotal + presupuesto.impuestos
+    totales = calcular_totales(
+        presupuesto.items, condicion_iva=presupuesto.condicion_iva, porcentaje_iva=presupuesto.porcentaje_iva
+    )
     
     presupuesto_dict = presupuesto.dict()
     presupuesto_dict["cliente_nombre"] = cliente_nombre
-    presupuesto_dict["subtotal"] = subtotal
-    presupuesto_dict["total"] = total
+    presupuesto_dict.update(totales.dict())
     presupuesto_obj = Presupuesto(**presupuesto_dict)
-    await db.presupuestos.insert_one(presupuesto_obj.dict())
+    await db.presupuestos.insert_one(to_storage(presupuesto_obj))
+    await auditar("presupuestos", presupuesto_obj.id, "crear")
     return presupuesto_obj
 
 @api_router.get("/presupuestos", response_model=List[Presupuesto])
-async def get_presupuestos():
-    presupuestos = await db.presupuestos.find().to_list(1000)
-    return [Presupuesto(**presupuesto) for presupuesto in presupuestos]
+async def get_presupuestos(params: ListQuery = Depends()):
+    return await list_documents(db.presupuestos, Presupuesto, params, "fecha_emision")
 
 @api_router.get("/presupuestos/{presupuesto_id}", response_model=Presupuesto)
 async def get_presupuesto(presupuesto_id: str):
-    presupuesto = await db.presupuestos.find_one({"id": presupuesto_id})
+    presupuesto = await find_with_archive("presupuestos", {"id": presupuesto_id})
     if not presupuesto:
         raise HTTPException(status_code=404, detail="Presupuesto not found")
     return Presupuesto(**presupuesto)
 
 @api_router.put("/presupuestos/{presupuesto_id}/estado")
-async def update_presupuesto_estado(presupuesto_id: str, estado: str):
+async def update_presupuesto_estado(presupuesto_id: str, estado: str, response: Response,
+                                    if_match: Optional[int] = Depends(if_match_version)):
     valid_estados = ["borrador", "enviado", "aceptado", "rechazado", "convertido"]
     if estado not in valid_estados:
         raise HTTPException(status_code=400, detail="Invalid estado")
     
-    result = await db.presupuestos.update_one({"id": presupuesto_id}, {"$set": {"estado": estado}})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Presupuesto not found")
-    return {"message": f"Presupuesto estado updated to {estado}"}
+    presupuesto = await update_versioned(
+        db.presupuestos, presupuesto_id, {"$set": {"estado": estado}}, "Presupuesto not found",
+        if_match, response, projection={"_id": 0, "version": 1}
+    )
+    return {"message": f"Presupuesto estado updated to {estado}", "version": presupuesto["version"]}
 
 # CRUD Endpoints for Notas de Crédito
 @api_router.post("/notas-credito", response_model=NotaCredito)
@@ -385,29 +1875,47 @@ async def create_nota_credito(nota: NotaCreditoCreate):
     cliente = await db.clientes.find_one({"id": nota.cliente_id})
     cliente_nombre = cliente["nombre"] if cliente else ""
     
-    # Calculate totals
-    subtotal = sum(item.subtotal for item in nota.items)
-    total = subtotal + nota.impuestos
+    # Calculate totals with the IVA regime of the original factura
+    factura = await find_with_archive("facturas", {"id": nota.factura_id}) if nota.factura_id else None
+    totales = calcular_totales(
+        nota.items,
+        factura.get("tipo_factura", "A") if factura else "A",
+        factura.get("condicion_iva", "Responsable Inscripto") if factura else "Responsable Inscripto",
+        nota.porcentaje_iva
+    )
     
     nota_dict = nota.dict()
     nota_dict["cliente_nombre"] = cliente_nombre
-    nota_dict["subtotal"] = subtotal
-    nota_dict["total"] = total
+    nota_dict.update(totales.dict())
     nota_obj = NotaCredito(**nota_dict)
-    await db.notas_credito.insert_one(nota_obj.dict())
+    await db.notas_credito.insert_one(to_storage(nota_obj))
+    await auditar("notas_credito", nota_obj.id, "crear")
     return nota_obj
 
 @api_router.get("/notas-credito", response_model=List[NotaCredito])
-async def get_notas_credito():
-    notas = await db.notas_credito.find().to_list(1000)
-    return [NotaCredito(**nota) for nota in notas]
+async def get_notas_credito(params: ListQuery = Depends()):
+    return await list_documents(db.notas_credito, NotaCredito, params, "fecha_emision")
 
 @api_router.put("/notas-credito/{nota_id}/aplicar")
-async def aplicar_nota_credito(nota_id: str):
-    result = await db.notas_credito.update_one({"id": nota_id}, {"$set": {"estado": "aplicada"}})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Nota de crédito not found")
-    return {"message": "Nota de crédito aplicada"}
+async def aplicar_nota_credito(nota_id: str, response: Response, if_match: Optional[int] = Depends(if_match_version)):
+    async def aplicar(session):
+        nota = await update_versioned(
+            db.notas_credito, nota_id, {"$set": {"estado": "aplicada"}}, "Nota de crédito not found", if_match, response,
+            projection={"_id": 0, "version": 1, "cliente_id": 1, "cliente_nombre": 1, "numero_nota": 1, "motivo": 1, "total": 1},
+            session=session
+        )
+        await contabilizar([MovimientoCuentaCorriente(
+            cliente_id=nota["cliente_id"],
+            cliente_nombre=nota.get("cliente_nombre", ""),
+            tipo_movimiento="nota_credito",
+            documento_id=nota_id,
+            numero_documento=nota["numero_nota"],
+            haber=nota["total"],
+            descripcion=f"Nota de crédito - {nota.get('motivo', '')}"
+        )], session)
+        return nota
+    nota = await en_transaccion(aplicar)
+    return {"message": "Nota de crédito aplicada", "version": nota["version"]}
 
 # CRUD Endpoints for Notas de Débito
 @api_router.post("/notas-debito", response_model=NotaDebito)
@@ -416,29 +1924,47 @@ async def create_nota_debito(nota: NotaDebitoCreate):
     cliente = await db.clientes.find_one({"id": nota.cliente_id})
     cliente_nombre = cliente["nombre"] if cliente else ""
     
-    # Calculate totals
-    subtotal = sum(item.subtotal for item in nota.items)
-    total = subtotal + nota.impuestos
+    # Calculate totals with the IVA regime of the original factura
+    factura = await find_with_archive("facturas", {"id": nota.factura_id}) if nota.factura_id else None
+    totales = calcular_totales(
+        nota.items,
+        factura.get("tipo_factura", "A") if factura else "A",
+        factura.get("condicion_iva", "Responsable Inscripto") if factura else "Responsable Inscripto",
+        nota.porcentaje_iva
+    )
     
     nota_dict = nota.dict()
     nota_dict["cliente_nombre"] = cliente_nombre
-    nota_dict["subtotal"] = subtotal
-    nota_dict["total"] = total
+    nota_dict.update(totales.dict())
     nota_obj = NotaDebito(**nota_dict)
-    await db.notas_debito.insert_one(nota_obj.dict())
+    await db.notas_debito.insert_one(to_storage(nota_obj))
+    await auditar("notas_debito", nota_obj.id, "crear")
     return nota_obj
 
 @api_router.get("/notas-debito", response_model=List[NotaDebito])
-async def get_notas_debito():
-    notas = await db.notas_debito.find().to_list(1000)
-    return [NotaDebito(**nota) for nota in notas]
+async def get_notas_debito(params: ListQuery = Depends()):
+    return await list_documents(db.notas_debito, NotaDebito, params, "fecha_emision")
 
 @api_router.put("/notas-debito/{nota_id}/aplicar")
-async def aplicar_nota_debito(nota_id: str):
-    result = await db.notas_debito.update_one({"id": nota_id}, {"$set": {"estado": "aplicada"}})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Nota de débito not found")
-    return {"message": "Nota de débito aplicada"}
+async def aplicar_nota_debito(nota_id: str, response: Response, if_match: Optional[int] = Depends(if_match_version)):
+    async def aplicar(session):
+        nota = await update_versioned(
+            db.notas_debito, nota_id, {"$set": {"estado": "aplicada"}}, "Nota de débito not found", if_match, response,
+            projection={"_id": 0, "version": 1, "cliente_id": 1, "cliente_nombre": 1, "numero_nota": 1, "motivo": 1, "total": 1},
+            session=session
+        )
+        await contabilizar([MovimientoCuentaCorriente(
+            cliente_id=nota["cliente_id"],
+            cliente_nombre=nota.get("cliente_nombre", ""),
+            tipo_movimiento="nota_debito",
+            documento_id=nota_id,
+            numero_documento=nota["numero_nota"],
+            debe=nota["total"],
+            descripcion=f"Nota de débito - {nota.get('motivo', '')}"
+        )], session)
+        return nota
+    nota = await en_transaccion(aplicar)
+    return {"message": "Nota de débito aplicada", "version": nota["version"]}
 
 # CRUD Endpoints for Cuentas Corrientes
 @api_router.get("/cuentas-corrientes/{cliente_id}", response_model=CuentaCorrienteResumen)
@@ -479,6 +2005,182 @@ async def get_all_cuentas_corrientes():
     
     return result
 
+# Reconciliation of cuentas corrientes against their source documents
+RECONCILIACION_CHUNK_SIZE = int(os.environ.get("RECONCILIACION_CHUNK_SIZE", "500"))
+RECONCILIACION_CONCURRENCIA = int(os.environ.get("RECONCILIACION_CONCURRENCIA", "4"))
+RECONCILIACION_TOLERANCIA = 0.01
+RECONCILIACION_MUESTRA = 100
+
+# Source collection -> (tipo_movimiento, numero field, importe field, side, filter)
+FUENTES_CUENTA_CORRIENTE = {
+    "facturas": ("factura", "numero_factura", "total", "debe", {}),
+    "facturas_archive": ("factura", "numero_factura", "total", "debe", {}),
+    "notas_debito": ("nota_debito", "numero_nota", "total", "debe", {"estado": "aplicada"}),
+    "notas_credito": ("nota_credito", "numero_nota", "total", "haber", {"estado": "aplicada"}),
+    "recibos": ("pago", "numero_recibo", "monto_total", "haber", {"estado": {"$ne": "anulado"}}),
+}
+
+def _coleccion_secundaria(coleccion: str):
+    # Screening reads go to a secondary when the deployment has one
+    return db[coleccion].with_options(read_preference=ReadPreference.SECONDARY_PREFERRED)
+
+def _saldo_fuente(importe_field: str, lado: str):
+    # Balances follow get_cuenta_corriente: haber - debe
+    return f"${importe_field}" if lado == "haber" else {"$multiply": [f"${importe_field}", -1]}
+
+async def _saldos_por_cliente(cliente_ids: List[str]) -> tuple:
+    """Expected and registered balance per client, one $group per collection."""
+    consultas = [
+        _coleccion_secundaria(coleccion).aggregate([
+            {"$match": {**filtro, "cliente_id": {"$in": cliente_ids}}},
+            {"$group": {"_id": "$cliente_id", "saldo": {"$sum": _saldo_fuente(importe_field, lado)}}}
+        ]).to_list(None)
+        for coleccion, (_, _, importe_field, lado, filtro) in FUENTES_CUENTA_CORRIENTE.items()
+    ]
+    consultas.append(_coleccion_secundaria("movimientos_cc").aggregate([
+        {"$match": {"cliente_id": {"$in": cliente_ids}}},
+        {"$group": {"_id": "$cliente_id", "saldo": {"$sum": {"$subtract": ["$haber", "$debe"]}}}}
+    ]).to_list(None))
+    *fuentes, registrados = await asyncio.gather(*consultas)
+    esperado = defaultdict(float)
+    for filas in fuentes:
+        for fila in filas:
+            esperado[fila["_id"]] += fila["saldo"]
+    return esperado, {fila["_id"]: fila["saldo"] for fila in registrados}
+
+async def _diferencias_por_documento(cliente_ids: List[str]) -> List[dict]:
+    """Per-document comparison for the clients flagged by the screening pass."""
+    consultas = [
+        db[coleccion].aggregate([
+            {"$match": {**filtro, "cliente_id": {"$in": cliente_ids}}},
+            {"$project": {
+                "_id": 0, "cliente_id": 1, "documento_id": "$id", "numero_documento": f"${numero_field}",
+                "saldo": _saldo_fuente(importe_field, lado)
+            }}
+        ]).to_list(None)
+        for coleccion, (_, numero_field, importe_field, lado, filtro) in FUENTES_CUENTA_CORRIENTE.items()
+    ]
+    consultas.append(db.movimientos_cc.aggregate([
+        {"$match": {"cliente_id": {"$in": cliente_ids}}},
+        {"$group": {
+            "_id": {"cliente_id": "$cliente_id", "documento_id": "$documento_id"},
+            "numero_documento": {"$first": "$numero_documento"},
+            "tipo_movimiento": {"$first": "$tipo_movimiento"},
+            "saldo": {"$sum": {"$subtract": ["$haber", "$debe"]}}
+        }}
+    ]).to_list(None))
+    *fuentes, registrados = await asyncio.gather(*consultas)
+
+    documentos = {}
+    for (tipo, *_), filas in zip(FUENTES_CUENTA_CORRIENTE.values(), fuentes):
+        for fila in filas:
+            documentos[(fila["cliente_id"], fila["documento_id"])] = {
+                "cliente_id": fila["cliente_id"], "documento_id": fila["documento_id"],
+                "tipo_movimiento": tipo, "numero_documento": fila["numero_documento"],
+                "esperado": fila["saldo"], "registrado": 0.0
+            }
+    for fila in registrados:
+        clave = (fila["_id"]["cliente_id"], fila["_id"]["documento_id"])
+        documento = documentos.setdefault(clave, {
+            "cliente_id": clave[0], "documento_id": clave[1],
+            "tipo_movimiento": fila["tipo_movimiento"], "numero_documento": fila["numero_documento"],
+            "esperado": 0.0, "registrado": 0.0
+        })
+        documento["registrado"] += fila["saldo"]
+
+    diferencias = []
+    for documento in documentos.values():
+        diferencia = round(documento["esperado"] - documento["registrado"], 2)
+        if abs(diferencia) > RECONCILIACION_TOLERANCIA:
+            documento["esperado"] = round(documento["esperado"], 2)
+            documento["registrado"] = round(documento["registrado"], 2)
+            documento["diferencia"] = diferencia
+            diferencias.append(documento)
+    return diferencias
+
+def _movimiento_correccion(diferencia: dict, cliente_nombre: str) -> dict:
+    importe = diferencia["diferencia"]
+    return MovimientoCuentaCorriente(
+        cliente_id=diferencia["cliente_id"],
+        cliente_nombre=cliente_nombre,
+        tipo_movimiento="ajuste",
+        documento_id=diferencia["documento_id"],
+        numero_documento=diferencia["numero_documento"] or "",
+        debe=-importe if importe < 0 else 0.0,
+        haber=importe if importe > 0 else 0.0,
+        descripcion=f"Ajuste de conciliación ({diferencia['tipo_movimiento']})"
+    ).dict()
+
+async def conciliar_cuentas_corrientes(corregir: bool = False, ctx: Optional[JobContext] = None) -> dict:
+    total_clientes = await db.clientes.count_documents({})
+    EXPORT_DIR.mkdir(parents=True, exist_ok=True)
+    nombre = f"conciliacion-{ctx.job_id if ctx else uuid.uuid4()}.ndjson.gz"
+    resumen = {
+        "clientes": 0, "clientes_con_diferencias": 0, "documentos_con_diferencias": 0,
+        "diferencia_neta": 0.0, "correcciones": 0
+    }
+    muestra = []
+    semaforo = asyncio.Semaphore(RECONCILIACION_CONCURRENCIA)
+
+    async def procesar(clientes: dict, salida):
+        esperado, registrado = await _saldos_por_cliente(list(clientes))
+        marcados = [
+            cliente_id for cliente_id in clientes
+            if abs(esperado.get(cliente_id, 0.0) - registrado.get(cliente_id, 0.0)) > RECONCILIACION_TOLERANCIA
+        ]
+        diferencias = await _diferencias_por_documento(marcados) if marcados else []
+        if corregir and diferencias:
+            await db.movimientos_cc.insert_many([
+                _movimiento_correccion(diferencia, clientes[diferencia["cliente_id"]]) for diferencia in diferencias
+            ])
+            resumen["correcciones"] += len(diferencias)
+        for diferencia in diferencias:
+            salida.write(json_util.dumps(diferencia) + "\n")
+            if len(muestra) < RECONCILIACION_MUESTRA:
+                muestra.append(diferencia)
+        resumen["clientes"] += len(clientes)
+        resumen["clientes_con_diferencias"] += len({d["cliente_id"] for d in diferencias})
+        resumen["documentos_con_diferencias"] += len(diferencias)
+        resumen["diferencia_neta"] = round(resumen["diferencia_neta"] + sum(d["diferencia"] for d in diferencias), 2)
+        if ctx:
+            await ctx.progreso(100 * resumen["clientes"] / max(total_clientes, 1), f"{resumen['clientes']}/{total_clientes}")
+
+    async def lanzar(clientes: dict, tareas: list, salida):
+        # Bounded fan-out: at most RECONCILIACION_CONCURRENCIA chunks in flight
+        await semaforo.acquire()
+        tarea = asyncio.create_task(procesar(clientes, salida))
+        tarea.add_done_callback(lambda _: semaforo.release())
+        tareas.append(tarea)
+
+    tareas = []
+    with gzip.open(EXPORT_DIR / nombre, "wt", encoding="utf-8") as salida:
+        try:
+            chunk = {}
+            cursor = _coleccion_secundaria("clientes").find({}, {"_id": 0, "id": 1, "nombre": 1})
+            async for cliente in cursor.batch_size(RECONCILIACION_CHUNK_SIZE):
+                chunk[cliente["id"]] = cliente.get("nombre", "")
+                if len(chunk) >= RECONCILIACION_CHUNK_SIZE:
+                    await lanzar(chunk, tareas, salida)
+                    chunk = {}
+            if chunk:
+                await lanzar(chunk, tareas, salida)
+            await asyncio.gather(*tareas)
+        except BaseException:
+            for tarea in tareas:
+                tarea.cancel()
+            await asyncio.gather(*tareas, return_exceptions=True)
+            raise
+    logger.info(f"Cuentas corrientes reconciled: {resumen}")
+    return {**resumen, "corregir": corregir, "archivo": nombre, "muestra": muestra}
+
+@job_handler("conciliar_cuentas_corrientes")
+async def job_conciliar_cuentas_corrientes(ctx: JobContext):
+    return await conciliar_cuentas_corrientes(bool(ctx.parametros.get("corregir")), ctx)
+
+@api_router.post("/cuentas-corrientes/conciliar", status_code=202)
+async def conciliar_cuentas(corregir: bool = False):
+    return job_accepted(await encolar_job("conciliar_cuentas_corrientes", {"corregir": corregir}, max_intentos=1))
+
 # CRUD Endpoints for Recibos
 @api_router.post("/recibos", response_model=Recibo)
 async def create_recibo(recibo: ReciboCreate):
@@ -489,8 +2191,6 @@ async def create_recibo(recibo: ReciboCreate):
     recibo_dict = recibo.dict()
     recibo_dict["cliente_nombre"] = cliente_nombre
     recibo_obj = Recibo(**recibo_dict)
-    await db.recibos.insert_one(recibo_obj.dict())
-    
     # Create movement in cuenta corriente
     movimiento = MovimientoCuentaCorriente(
         cliente_id=recibo.cliente_id,
@@ -501,14 +2201,17 @@ async def create_recibo(recibo: ReciboCreate):
         haber=recibo.monto_total,
         descripcion=f"Pago recibido - {recibo.observaciones}"
     )
-    await db.movimientos_cc.insert_one(movimiento.dict())
-    
+    async def registrar(session):
+        await db.recibos.insert_one(recibo_obj.dict(), session=session)
+        await contabilizar([movimiento], session)
+        await acumular_cobro_ranking(recibo_obj.dict(), 1, session)
+    await en_transaccion(registrar)
+    await auditar("recibos", recibo_obj.id, "crear")
     return recibo_obj
 
 @api_router.get("/recibos", response_model=List[Recibo])
-async def get_recibos():
-    recibos = await db.recibos.find().to_list(1000)
-    return [Recibo(**recibo) for recibo in recibos]
+async def get_recibos(params: ListQuery = Depends()):
+    return await list_documents(db.recibos, Recibo, params, "fecha_pago")
 
 @api_router.get("/recibos/{recibo_id}", response_model=Recibo)
 async def get_recibo(recibo_id: str):
@@ -518,25 +2221,36 @@ async def get_recibo(recibo_id: str):
     return Recibo(**recibo)
 
 @api_router.put("/recibos/{recibo_id}/anular")
-async def anular_recibo(recibo_id: str):
-    result = await db.recibos.update_one({"id": recibo_id}, {"$set": {"estado": "anulado"}})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Recibo not found")
-    return {"message": "Recibo anulado"}
+async def anular_recibo(recibo_id: str, response: Response, if_match: Optional[int] = Depends(if_match_version)):
+    async def anular(session):
+        recibo = await update_versioned(
+            db.recibos, recibo_id, {"$set": {"estado": "anulado"}}, "Recibo not found", if_match, response,
+            projection={"_id": 0, "version": 1, "cliente_id": 1, "monto_total": 1, "fecha_pago": 1}, session=session
+        )
+        # Only the first anulacion posts a reversal, and only it undoes the cobro
+        if await revertir_movimiento(recibo_id, "pago", "anulacion_pago", "Recibo anulado", session):
+            await acumular_cobro_ranking(recibo, -1, session)
+        return recibo
+    recibo = await en_transaccion(anular)
+    return {"message": "Recibo anulado", "version": recibo["version"]}
 
 # CRUD Endpoints for Articulos
 @api_router.post("/articulos", response_model=Articulo)
 async def create_articulo(articulo: ArticuloCreate):
     articulo_dict = articulo.dict()
     articulo_obj = Articulo(**articulo_dict)
-    await db.articulos.insert_one(articulo_obj.dict())
+    await db.articulos.insert_one({**articulo_obj.dict(), "precio_versionado": True})
+    await registrar_precios({articulo_obj.id: articulo_obj.precio}, articulo_obj.fecha_creacion, "inicial")
+    await auditar("articulos", articulo_obj.id, "crear")
     return articulo_obj
 
 @api_router.get("/articulos", response_model=List[Articulo])
-async def get_articulos(activos_only: bool = True):
+async def get_articulos(activos_only: bool = True, params: ListQuery = Depends()):
     filter_query = {"activo": True} if activos_only else {}
-    articulos = await db.articulos.find(filter_query).to_list(1000)
-    return [Articulo(**articulo) for articulo in articulos]
+    return await list_documents(
+        db.articulos, Articulo, params, "fecha_creacion",
+        estado_field=None, cliente_field=None, base_filter=filter_query
+    )
 
 @api_router.get("/articulos/{articulo_id}", response_model=Articulo)
 async def get_articulo(articulo_id: str):
@@ -546,16 +2260,19 @@ async def get_articulo(articulo_id: str):
     return Articulo(**articulo)
 
 @api_router.put("/articulos/{articulo_id}", response_model=Articulo)
-async def update_articulo(articulo_id: str, articulo_update: ArticuloUpdate):
+async def update_articulo(articulo_id: str, articulo_update: ArticuloUpdate, response: Response,
+                          if_match: Optional[int] = Depends(if_match_version)):
     update_data = {k: v for k, v in articulo_update.dict().items() if v is not None}
     if not update_data:
         raise HTTPException(status_code=400, detail="No data to update")
     
-    result = await db.articulos.update_one({"id": articulo_id}, {"$set": update_data})
-    if result.matched_count == 0:
-        raise HTTPException(status_code=404, detail="Articulo not found")
-    
-    updated_articulo = await db.articulos.find_one({"id": articulo_id})
+    if "precio" in update_data:
+        update_data["fecha_actualizacion_precio"] = datetime.utcnow()
+    updated_articulo = await update_versioned(
+        db.articulos, articulo_id, {"$set": update_data}, "Articulo not found", if_match, response
+    )
+    if "precio" in update_data:
+        await registrar_precios({articulo_id: update_data["precio"]}, update_data["fecha_actualizacion_precio"], "manual")
     return Articulo(**updated_articulo)
 
 @api_router.delete("/articulos/{articulo_id}")
@@ -563,30 +2280,447 @@ async def delete_articulo(articulo_id: str):
     result = await db.articulos.delete_one({"id": articulo_id})
     if result.deleted_count == 0:
         raise HTTPException(status_code=404, detail="Articulo not found")
+    await auditar("articulos", articulo_id, "eliminar")
     return {"message": "Articulo deleted successfully"}
 
 @api_router.put("/articulos/{articulo_id}/toggle")
-async def toggle_articulo_activo(articulo_id: str):
-    articulo = await db.articulos.find_one({"id": articulo_id})
-    if not articulo:
+async def toggle_articulo_activo(articulo_id: str, response: Response,
+                                 if_match: Optional[int] = Depends(if_match_version)):
+    # The flip happens server-side so concurrent toggles cannot lose updates
+    articulo = await update_versioned(
+        db.articulos, articulo_id, [{"$set": {"activo": {"$not": [{"$ifNull": ["$activo", True]}]}}}],
+        "Articulo not found", if_match, response, projection={"_id": 0, "activo": 1, "version": 1}
+    )
+    new_status = articulo["activo"]
+    return {"message": f"Articulo {'activated' if new_status else 'deactivated'}", "activo": new_status,
+            "version": articulo["version"]}
+
+# Bulk price updates for Articulos
+PRICE_UPDATE_CHUNK_SIZE = int(os.environ.get("PRICE_UPDATE_CHUNK_SIZE", "1000"))
+
+def _precio_nuevo_expr(ajuste: AjustePrecios):
+    if ajuste.tipo_ajuste == "porcentaje":
+        nuevo = {"$multiply": ["$precio", 1 + ajuste.valor / 100]}
+    else:
+        nuevo = {"$add": ["$precio", ajuste.valor]}
+    return {"$max": [0, {"$round": [nuevo, 2]}]}
+
+@api_router.post("/articulos/precios")
+async def ajustar_precios(ajuste: AjustePrecios):
+    if ajuste.tipo_ajuste not in ["porcentaje", "fijo"]:
+        raise HTTPException(status_code=400, detail="Invalid tipo_ajuste")
+
+    filter_query = {"activo": True} if ajuste.solo_activos else {}
+    if ajuste.categoria:
+        filter_query["categoria"] = ajuste.categoria
+    if ajuste.codigo_desde or ajuste.codigo_hasta:
+        filter_query["codigo"] = {}
+        if ajuste.codigo_desde:
+            filter_query["codigo"]["$gte"] = ajuste.codigo_desde
+        if ajuste.codigo_hasta:
+            filter_query["codigo"]["$lte"] = ajuste.codigo_hasta
+
+    ajuste_id = str(uuid.uuid4())
+    fecha = datetime.utcnow()
+    precio_nuevo = _precio_nuevo_expr(ajuste)
+
+    if ajuste.dry_run:
+        preview = await db.articulos.aggregate([
+            {"$match": filter_query},
+            {"$facet": {
+                "resumen": [{"$group": {
+                    "_id": None,
+                    "articulos": {"$sum": 1},
+                    "total_anterior": {"$sum": "$precio"},
+                    "total_nuevo": {"$sum": precio_nuevo}
+                }}],
+                "muestra": [
+                    {"$sort": {"codigo": 1}},
+                    {"$limit": 50},
+                    {"$project": {"_id": 0, "id": 1, "codigo": 1, "nombre": 1,
+                                  "precio_anterior": "$precio", "precio_nuevo": precio_nuevo}}
+                ]
+            }}
+        ]).to_list(1)
+        resumen = preview[0]["resumen"][0] if preview[0]["resumen"] else {"articulos": 0, "total_anterior": 0, "total_nuevo": 0}
+        return {
+            "dry_run": True,
+            "articulos_afectados": resumen["articulos"],
+            "total_anterior": resumen["total_anterior"],
+            "total_nuevo": resumen["total_nuevo"],
+            "muestra": preview[0]["muestra"]
+        }
+
+    # History is written server-side first, from the same expression the update uses
+    await db.articulos.aggregate([
+        {"$match": filter_query},
+        {"$project": {
+            "_id": 0,
+            "id": {"$concat": [ajuste_id, ":", "$id"]},
+            "ajuste_id": ajuste_id,
+            "articulo_id": "$id",
+            "codigo": "$codigo",
+            "precio_anterior": "$precio",
+            "precio_nuevo": precio_nuevo,
+            "origen": ajuste.tipo_ajuste,
+            "fecha": fecha
+        }},
+        {"$merge": {"into": "historial_precios", "on": "id", "whenMatched": "keepExisting"}}
+    ]).to_list(None)
+    result = await db.articulos.update_many(
+        filter_query,
+        [{"$set": {
+            "precio": precio_nuevo, "fecha_actualizacion_precio": fecha,
+            "version": {"$add": [{"$ifNull": ["$version", 1]}, 1]}
+        }}]
+    )
+    cursor = db.historial_precios.find({"ajuste_id": ajuste_id}, {"_id": 0, "articulo_id": 1, "precio_nuevo": 1})
+    lote = {}
+    async for entrada in cursor.batch_size(PRICE_UPDATE_CHUNK_SIZE):
+        lote[entrada["articulo_id"]] = entrada["precio_nuevo"]
+        if len(lote) >= PRICE_UPDATE_CHUNK_SIZE:
+            await registrar_precios(lote, fecha, ajuste.tipo_ajuste)
+            lote = {}
+    await registrar_precios(lote, fecha, ajuste.tipo_ajuste)
+    return {"dry_run": False, "ajuste_id": ajuste_id, "articulos_afectados": result.modified_count}
+
+def _parse_lista_precios(contenido: str):
+    try:
+        dialect = csv.Sniffer().sniff(contenido[:4096], delimiters=",;\t")
+    except csv.Error:
+        dialect = csv.excel
+    precios = {}
+    for numero_linea, row in enumerate(csv.DictReader(io.StringIO(contenido), dialect=dialect), start=2):
+        codigo = (row.get("codigo") or "").strip()
+        valor = (row.get("precio") or "").strip()
+        if not codigo:
+            continue
+        if "," in valor and "." not in valor:
+            valor = valor.replace(",", ".")
+        try:
+            precios[codigo] = round(float(valor), 2)
+        except ValueError:
+            raise HTTPException(status_code=400, detail=f"Invalid precio on line {numero_linea}: {valor!r}")
+    return precios
+
+@api_router.post("/articulos/precios/csv")
+async def importar_lista_precios(archivo: UploadFile = File(...), dry_run: bool = Form(False)):
+    precios = _parse_lista_precios((await archivo.read()).decode("utf-8-sig"))
+    if not precios:
+        raise HTTPException(status_code=400, detail="Price list has no codigo/precio rows")
+
+    ajuste_id = str(uuid.uuid4())
+    fecha = datetime.utcnow()
+    codigos = list(precios)
+    encontrados = 0
+    actualizados = 0
+    muestra = []
+    for i in range(0, len(codigos), PRICE_UPDATE_CHUNK_SIZE):
+        chunk = codigos[i:i + PRICE_UPDATE_CHUNK_SIZE]
+        actuales = await db.articulos.find(
+            {"codigo": {"$in": chunk}}, {"_id": 0, "id": 1, "codigo": 1, "nombre": 1, "precio": 1}
+        ).to_list(None)
+        encontrados += len(actuales)
+        cambios = [a for a in actuales if a["precio"] != precios[a["codigo"]]]
+        if dry_run:
+            muestra.extend({
+                "id": a["id"],
+                "codigo": a["codigo"],
+                "nombre": a["nombre"],
+                "precio_anterior": a["precio"],
+                "precio_nuevo": precios[a["codigo"]]
+            } for a in cambios[:50 - len(muestra)])
+            actualizados += len(cambios)
+            continue
+        if not cambios:
+            continue
+        await db.historial_precios.insert_many([{
+            "id": f"{ajuste_id}:{a['id']}",
+            "ajuste_id": ajuste_id,
+            "articulo_id": a["id"],
+            "codigo": a["codigo"],
+            "precio_anterior": a["precio"],
+            "precio_nuevo": precios[a["codigo"]],
+            "origen": "csv",
+            "fecha": fecha
+        } for a in cambios])
+        result = await db.articulos.bulk_write([
+            UpdateOne({"id": a["id"]}, {
+                "$set": {"precio": precios[a["codigo"]], "fecha_actualizacion_precio": fecha},
+                "$inc": {"version": 1}
+            })
+            for a in cambios
+        ], ordered=False)
+        actualizados += result.modified_count
+        await registrar_precios({a["id"]: precios[a["codigo"]] for a in cambios}, fecha, "csv")
+
+    respuesta = {
+        "dry_run": dry_run,
+        "filas": len(precios),
+        "articulos_encontrados": encontrados,
+        "articulos_afectados": actualizados,
+        "codigos_no_encontrados": len(precios) - encontrados
+    }
+    if dry_run:
+        respuesta["muestra"] = muestra
+    else:
+        respuesta["ajuste_id"] = ajuste_id
+    return respuesta
+
+@api_router.get("/articulos/{articulo_id}/historial-precios")
+async def get_historial_precios(articulo_id: str):
+    historial = await db.historial_precios.find(
+        {"articulo_id": articulo_id}, {"_id": 0}
+    ).sort("fecha", -1).to_list(1000)
+    return historial
+
+# Versioned price lists: one document per articulo and effective range
+# [vigencia_desde, vigencia_hasta), vigencia_hasta None for the open range.
+# Articulo.precio mirrors the version currently in force.
+PRECIOS_SYNC_SECONDS = float(os.environ.get("PRECIOS_SYNC_SECONDS", "60"))
+PRECIOS_CONSULTA_MAX_IDS = 5000
+
+async def registrar_precios(precios: dict, vigencia_desde: datetime, origen: str,
+                            aplicado: bool = True) -> List[VersionPrecio]:
+    """Open a price version at vigencia_desde for every articulo_id -> precio."""
+    if not precios:
+        return []
+    ids = list(precios)
+    # MongoDB stores milliseconds; truncate so equality lookups match
+    vigencia_desde = vigencia_desde.replace(microsecond=vigencia_desde.microsecond // 1000 * 1000)
+    async with transaccion() as session:
+        siguientes = await db.precios_articulos.aggregate([
+            {"$match": {"articulo_id": {"$in": ids}, "vigencia_desde": {"$gt": vigencia_desde}}},
+            {"$group": {"_id": "$articulo_id", "siguiente": {"$min": "$vigencia_desde"}}}
+        ], session=session).to_list(None)
+        siguientes = {fila["_id"]: fila["siguiente"] for fila in siguientes}
+        # A version starting at the same instant is replaced
+        await db.precios_articulos.delete_many(
+            {"articulo_id": {"$in": ids}, "vigencia_desde": vigencia_desde}, session=session
+        )
+        # The range that contained vigencia_desde now ends there
+        await db.precios_articulos.update_many(
+            {"articulo_id": {"$in": ids}, "vigencia_desde": {"$lt": vigencia_desde},
+             "$or": [{"vigencia_hasta": None}, {"vigencia_hasta": {"$gt": vigencia_desde}}]},
+            {"$set": {"vigencia_hasta": vigencia_desde}}, session=session
+        )
+        versiones = [
+            VersionPrecio(
+                articulo_id=articulo_id, precio=precio, vigencia_desde=vigencia_desde,
+                vigencia_hasta=siguientes.get(articulo_id), origen=origen, aplicado=aplicado
+            )
+            for articulo_id, precio in precios.items()
+        ]
+        await db.precios_articulos.insert_many([version.dict() for version in versiones], session=session)
+    return versiones
+
+async def precios_en_fecha(articulo_ids: List[str], fecha: Optional[datetime] = None) -> dict:
+    """Price in force per articulo at fecha (default now), with one query for all ids.
+
+    Not cached in process: a version written through another worker must be
+    visible immediately, and the lookup is a single indexed query anyway.
+    """
+    fecha = fecha or datetime.utcnow()
+    versiones = await db.precios_articulos.find(
+        {"articulo_id": {"$in": list(dict.fromkeys(articulo_ids))}, "vigencia_desde": {"$lte": fecha},
+         "$or": [{"vigencia_hasta": None}, {"vigencia_hasta": {"$gt": fecha}}]},
+        {"_id": 0, "articulo_id": 1, "precio": 1}
+    ).to_list(None)
+    return {version["articulo_id"]: version["precio"] for version in versiones}
+
+async def aplicar_precios_vigentes() -> int:
+    """Copy versions that became effective into Articulo.precio."""
+    ahora = datetime.utcnow()
+    aplicados = 0
+    while True:
+        pendientes = await db.precios_articulos.find(
+            {"aplicado": False, "vigencia_desde": {"$lte": ahora}}, {"_id": 0, "id": 1, "articulo_id": 1}
+        ).limit(PRICE_UPDATE_CHUNK_SIZE).to_list(PRICE_UPDATE_CHUNK_SIZE)
+        if not pendientes:
+            return aplicados
+        vigentes = await precios_en_fecha([p["articulo_id"] for p in pendientes], ahora)
+        if vigentes:
+            await db.articulos.bulk_write([
+                UpdateOne({"id": articulo_id, "precio": {"$ne": precio}}, {
+                    "$set": {"precio": precio, "fecha_actualizacion_precio": ahora},
+                    "$inc": {"version": 1}
+                })
+                for articulo_id, precio in vigentes.items()
+            ], ordered=False)
+        await db.precios_articulos.update_many(
+            {"id": {"$in": [p["id"] for p in pendientes]}}, {"$set": {"aplicado": True}}
+        )
+        aplicados += len(pendientes)
+
+async def precios_programados_worker():
+    while True:
+        await asyncio.sleep(PRECIOS_SYNC_SECONDS)
+        try:
+            await aplicar_precios_vigentes()
+        except Exception as e:
+            logger.error(f"Applying scheduled prices failed: {e}")
+
+@api_router.get("/articulos/{articulo_id}/versiones-precio", response_model=List[VersionPrecio])
+async def get_versiones_precio(articulo_id: str):
+    versiones = await db.precios_articulos.find({"articulo_id": articulo_id}).sort("vigencia_desde", -1).to_list(1000)
+    return [VersionPrecio(**version) for version in versiones]
+
+@api_router.post("/articulos/{articulo_id}/versiones-precio", response_model=VersionPrecio)
+async def create_version_precio(articulo_id: str, version: VersionPrecioCreate):
+    if version.precio < 0:
+        raise HTTPException(status_code=400, detail="precio must not be negative")
+    if not await db.articulos.find_one({"id": articulo_id}, {"_id": 1}):
         raise HTTPException(status_code=404, detail="Articulo not found")
-    
-    new_status = not articulo.get("activo", True)
-    await db.articulos.update_one({"id": articulo_id}, {"$set": {"activo": new_status}})
-    return {"message": f"Articulo {'activated' if new_status else 'deactivated'}"}
+    vigencia_desde = version.vigencia_desde or datetime.utcnow()
+    if vigencia_desde.tzinfo is not None:
+        vigencia_desde = vigencia_desde.astimezone(timezone.utc).replace(tzinfo=None)
+    creada, = await registrar_precios({articulo_id: version.precio}, vigencia_desde, "manual", aplicado=False)
+    if vigencia_desde <= datetime.utcnow():
+        await aplicar_precios_vigentes()
+    return VersionPrecio(**await db.precios_articulos.find_one({"id": creada.id}))
+
+@api_router.get("/articulos/{articulo_id}/precio")
+async def get_precio_en_fecha(articulo_id: str, fecha: Optional[datetime] = None):
+    precios = await precios_en_fecha([articulo_id], fecha)
+    if articulo_id not in precios:
+        raise HTTPException(status_code=404, detail="No price in force for articulo at that date")
+    return {"articulo_id": articulo_id, "fecha": fecha or datetime.utcnow(), "precio": precios[articulo_id]}
+
+@api_router.post("/articulos/precios/consulta")
+async def consultar_precios(consulta: ConsultaPrecios):
+    if len(consulta.articulo_ids) > PRECIOS_CONSULTA_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {PRECIOS_CONSULTA_MAX_IDS} articulo_ids per request")
+    precios = await precios_en_fecha(consulta.articulo_ids, consulta.fecha)
+    return {
+        "fecha": consulta.fecha or datetime.utcnow(),
+        "precios": precios,
+        "sin_precio": [i for i in dict.fromkeys(consulta.articulo_ids) if i not in precios]
+    }
+
+# Propagation of cliente snapshots into denormalized documents
+CLIENTE_SNAPSHOT_FIELDS = {
+    "facturas": {
+        "cliente_nombre": "nombre",
+        "cliente_direccion": "direccion",
+        "cliente_email": "email",
+        "cliente_telefono": "telefono",
+        "cliente_cuit": "cuit_dni"
+    },
+    "pedidos": {"cliente_nombre": "nombre"},
+    "remitos": {"cliente_nombre": "nombre"},
+    "recibos": {"cliente_nombre": "nombre"},
+    "presupuestos": {"cliente_nombre": "nombre"},
+    "notas_credito": {"cliente_nombre": "nombre"},
+    "notas_debito": {"cliente_nombre": "nombre"},
+    "movimientos_cc": {"cliente_nombre": "nombre"},
+}
+PROPAGATION_BATCH_SIZE = int(os.environ.get("PROPAGATION_BATCH_SIZE", "500"))
+PROPAGATION_THROTTLE_MS = int(os.environ.get("PROPAGATION_THROTTLE_MS", "50"))
+PROPAGATION_CLAIM_TIMEOUT_SECONDS = 300
+_propagation_wakeup = asyncio.Event()
+_propagation_stats = {"documentos_actualizados": 0, "ultima_propagacion": None}
+
+async def encolar_propagacion_cliente(cliente: dict):
+    # One pending record per cliente: later edits overwrite the snapshot and
+    # move fecha_solicitud, so a run in progress is repeated with fresh data
+    snapshot = {field: cliente.get(field, "") for field in ["nombre", "direccion", "email", "telefono", "cuit_dni"]}
+    await db.propagaciones_cliente.update_one(
+        {"_id": cliente["id"]},
+        {"$set": {"snapshot": snapshot, "estado": "pendiente", "fecha_solicitud": datetime.utcnow()}},
+        upsert=True
+    )
+    _propagation_wakeup.set()
+
+async def propagar_snapshot_cliente(cliente_id: str, snapshot: dict) -> int:
+    actualizados = 0
+    for collection, fields in CLIENTE_SNAPSHOT_FIELDS.items():
+        values = {target: snapshot[source] for target, source in fields.items()}
+        stale = {"cliente_id": cliente_id, "$or": [{k: {"$ne": v}} for k, v in values.items()]}
+        while True:
+            chunk = await db[collection].find(stale, {"_id": 1}).limit(PROPAGATION_BATCH_SIZE).to_list(PROPAGATION_BATCH_SIZE)
+            if not chunk:
+                break
+            result = await db[collection].update_many(
+                {"_id": {"$in": [doc["_id"] for doc in chunk]}},
+                {"$set": values}
+            )
+            actualizados += result.modified_count
+            await asyncio.sleep(PROPAGATION_THROTTLE_MS / 1000)
+            if len(chunk) < PROPAGATION_BATCH_SIZE:
+                break
+    return actualizados
+
+async def _claim_propagacion():
+    stale_claim = datetime.utcnow() - timedelta(seconds=PROPAGATION_CLAIM_TIMEOUT_SECONDS)
+    return await db.propagaciones_cliente.find_one_and_update(
+        {"$or": [
+            {"estado": "pendiente"},
+            {"estado": "en_proceso", "fecha_claim": {"$lt": stale_claim}}
+        ]},
+        {"$set": {"estado": "en_proceso", "fecha_claim": datetime.utcnow()}},
+        sort=[("fecha_solicitud", 1)]
+    )
+
+async def propagation_worker():
+    while True:
+        try:
+            record = await _claim_propagacion()
+            if record is None:
+                _propagation_wakeup.clear()
+                try:
+                    # Also poll, to pick up changes queued by other workers
+                    await asyncio.wait_for(_propagation_wakeup.wait(), timeout=5)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+            tenant_token = current_tenant.set(record.get("tenant_id"))
+            try:
+                actualizados = await propagar_snapshot_cliente(record["_id"], record["snapshot"])
+            finally:
+                current_tenant.reset(tenant_token)
+            # Only drop the record if no newer change arrived meanwhile
+            await db.propagaciones_cliente.delete_one(
+                {"_id": record["_id"], "fecha_solicitud": record["fecha_solicitud"]}
+            )
+            _propagation_stats["documentos_actualizados"] += actualizados
+            _propagation_stats["ultima_propagacion"] = datetime.utcnow()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Cliente snapshot propagation failed: {e}")
+            await asyncio.sleep(1)
 
 # CRUD Endpoints for Clientes
+def normalizar_nombre_busqueda(nombre: str) -> str:
+    # Shared by writes, the startup backfill and the search prefix, so all three agree
+    return nombre.strip().lower()
+
 @api_router.post("/clientes", response_model=Cliente)
 async def create_cliente(cliente: ClienteCreate):
     cliente_dict = cliente.dict()
+    cliente_dict["nombre_busqueda"] = normalizar_nombre_busqueda(cliente.nombre)
     cliente_obj = Cliente(**cliente_dict)
     await db.clientes.insert_one(cliente_obj.dict())
+    await auditar("clientes", cliente_obj.id, "crear")
     return cliente_obj
 
 @api_router.get("/clientes", response_model=List[Cliente])
-async def get_clientes():
-    clientes = await db.clientes.find().to_list(1000)
-    return [Cliente(**cliente) for cliente in clientes]
+async def get_clientes(params: ListQuery = Depends()):
+    return await list_documents(
+        db.clientes, Cliente, params, "fecha_creacion", estado_field=None, cliente_field="id"
+    )
+
+@api_router.get("/clientes/propagacion")
+async def get_propagacion_clientes():
+    pendientes = await db.propagaciones_cliente.count_documents({})
+    oldest = await db.propagaciones_cliente.find_one({}, sort=[("fecha_solicitud", 1)])
+    lag = (datetime.utcnow() - oldest["fecha_solicitud"]).total_seconds() if oldest else 0.0
+    return {
+        "pendientes": pendientes,
+        "lag_segundos": lag,
+        "documentos_actualizados": _propagation_stats["documentos_actualizados"],
+        "ultima_propagacion": _propagation_stats["ultima_propagacion"]
+    }
 
 @api_router.get("/clientes/{cliente_id}", response_model=Cliente)
 async def get_cliente(cliente_id: str):
@@ -597,18 +2731,20 @@ async def get_cliente(cliente_id: str):
     return Cliente(**cliente)
 
 @api_router.put("/clientes/{cliente_id}", response_model=Cliente)
-async def update_cliente(cliente_id: str, cliente_update: ClienteUpdate):
+async def update_cliente(cliente_id: str, cliente_update: ClienteUpdate, response: Response,
+                         if_match: Optional[int] = Depends(if_match_version)):
     update_data = {k: v for k, v in cliente_update.dict().items() if v is not None}
     if not update_data:
         from fastapi import HTTPException
         raise HTTPException(status_code=400, detail="No data to update")
+    if "nombre" in update_data:
+        update_data["nombre_busqueda"] = normalizar_nombre_busqueda(update_data["nombre"])
     
-    result = await db.clientes.update_one({"id": cliente_id}, {"$set": update_data})
-    if result.matched_count == 0:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="Cliente not found")
-    
-    updated_cliente = await db.clientes.find_one({"id": cliente_id})
+    updated_cliente = await update_versioned(
+        db.clientes, cliente_id, {"$set": update_data}, "Cliente not found", if_match, response
+    )
+    if update_data.keys() & {"nombre", "direccion", "email", "telefono", "cuit_dni"}:
+        await encolar_propagacion_cliente(updated_cliente)
     return Cliente(**updated_cliente)
 
 @api_router.delete("/clientes/{cliente_id}")
@@ -617,6 +2753,7 @@ async def delete_cliente(cliente_id: str):
     if result.deleted_count == 0:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Cliente not found")
+    await auditar("clientes", cliente_id, "eliminar")
     return {"message": "Cliente deleted successfully"}
 
 # CRUD Endpoints for Pedidos
@@ -633,36 +2770,48 @@ async def create_pedido(pedido: PedidoCreate):
     pedido_dict["cliente_nombre"] = cliente_nombre
     pedido_dict["total"] = total
     pedido_obj = Pedido(**pedido_dict)
-    await db.pedidos.insert_one(pedido_obj.dict())
+    await db.pedidos.insert_one(to_storage(pedido_obj))
+    await auditar("pedidos", pedido_obj.id, "crear")
     return pedido_obj
 
 @api_router.get("/pedidos", response_model=List[Pedido])
-async def get_pedidos():
-    pedidos = await db.pedidos.find().to_list(1000)
-    return [Pedido(**pedido) for pedido in pedidos]
+async def get_pedidos(params: ListQuery = Depends()):
+    return await list_documents(db.pedidos, Pedido, params, "fecha_pedido")
 
 @api_router.get("/pedidos/{pedido_id}", response_model=Pedido)
 async def get_pedido(pedido_id: str):
-    pedido = await db.pedidos.find_one({"id": pedido_id})
+    pedido = await find_with_archive("pedidos", {"id": pedido_id})
     if not pedido:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Pedido not found")
     return Pedido(**pedido)
 
 @api_router.put("/pedidos/{pedido_id}/estado")
-async def update_pedido_estado(pedido_id: str, estado: str):
+async def update_pedido_estado(pedido_id: str, estado: str, response: Response,
+                               if_match: Optional[int] = Depends(if_match_version)):
     valid_estados = ["pendiente", "en_proceso", "completado", "cancelado"]
     if estado not in valid_estados:
         from fastapi import HTTPException
         raise HTTPException(status_code=400, detail="Invalid estado")
     
-    result = await db.pedidos.update_one({"id": pedido_id}, {"$set": {"estado": estado}})
-    if result.matched_count == 0:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="Pedido not found")
-    return {"message": f"Pedido estado updated to {estado}"}
+    pedido = await update_versioned(
+        db.pedidos, pedido_id, {"$set": {"estado": estado}}, "Pedido not found",
+        if_match, response, projection={"_id": 0, "version": 1}
+    )
+    return {"message": f"Pedido estado updated to {estado}", "version": pedido["version"]}
 
 # CRUD Endpoints for Facturas
+def movimiento_factura(factura: Factura) -> MovimientoCuentaCorriente:
+    return MovimientoCuentaCorriente(
+        cliente_id=factura.cliente_id,
+        cliente_nombre=factura.cliente_nombre,
+        tipo_movimiento="factura",
+        documento_id=factura.id,
+        numero_documento=factura.numero_factura,
+        debe=factura.total,
+        descripcion=f"Factura {factura.tipo_factura} {factura.numero_factura}"
+    )
+
 @api_router.post("/facturas", response_model=Factura)
 async def create_factura(factura: FacturaCreate):
     # Get client information
@@ -677,8 +2826,9 @@ async def create_factura(factura: FacturaCreate):
     cliente_cuit = cliente.get("cuit_dni", "")
     
     # Calculate totals
-    subtotal = sum(item.subtotal for item in factura.items)
-    total = subtotal + factura.impuestos
+    totales = calcular_totales(
+        factura.items, factura.tipo_factura, factura.condicion_iva, factura.porcentaje_iva
+    )
     
     factura_dict = factura.dict()
     factura_dict["cliente_nombre"] = cliente_nombre
@@ -686,44 +2836,319 @@ async def create_factura(factura: FacturaCreate):
     factura_dict["cliente_email"] = cliente_email
     factura_dict["cliente_telefono"] = cliente_telefono
     factura_dict["cliente_cuit"] = cliente_cuit
-    factura_dict["subtotal"] = subtotal
-    factura_dict["total"] = total
+    factura_dict.update(totales.dict())
     factura_obj = Factura(**factura_dict)
-    await db.facturas.insert_one(factura_obj.dict())
+    async def registrar(session):
+        await db.facturas.insert_one(to_storage(factura_obj), session=session)
+        await contabilizar([movimiento_factura(factura_obj)], session)
+        await acumular_facturas_ranking([factura_obj], 1, session)
+    await en_transaccion(registrar)
+    await auditar("facturas", factura_obj.id, "crear")
     return factura_obj
 
 @api_router.get("/facturas", response_model=List[Factura])
-async def get_facturas():
-    facturas = await db.facturas.find().to_list(1000)
-    return [Factura(**factura) for factura in facturas]
+async def get_facturas(params: ListQuery = Depends()):
+    return await list_documents(db.facturas, Factura, params, "fecha_emision")
 
 @api_router.get("/facturas/{factura_id}", response_model=Factura)
 async def get_factura(factura_id: str):
-    factura = await db.facturas.find_one({"id": factura_id})
+    factura = await find_with_archive("facturas", {"id": factura_id})
     if not factura:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Factura not found")
     return Factura(**factura)
 
 @api_router.put("/facturas/{factura_id}/pagar")
-async def marcar_factura_pagada(factura_id: str):
-    result = await db.facturas.update_one(
-        {"id": factura_id}, 
-        {"$set": {"estado": "pagada", "fecha_pago": datetime.utcnow()}}
+async def marcar_factura_pagada(factura_id: str, response: Response,
+                                if_match: Optional[int] = Depends(if_match_version)):
+    factura = await update_versioned(
+        db.facturas, factura_id, {"$set": {"estado": "pagada", "fecha_pago": datetime.utcnow()}},
+        "Factura not found", if_match, response, projection={"_id": 0, "version": 1}
     )
-    if result.matched_count == 0:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="Factura not found")
-    return {"message": "Factura marked as paid"}
+    return {"message": "Factura marked as paid", "version": factura["version"]}
 
 @api_router.delete("/facturas/{factura_id}")
 async def delete_factura(factura_id: str):
-    result = await db.facturas.delete_one({"id": factura_id})
-    if result.deleted_count == 0:
-        raise HTTPException(status_code=404, detail="Factura not found")
+    async def eliminar(session):
+        factura = await db.facturas.find_one_and_delete({"id": factura_id}, session=session)
+        if factura is None:
+            raise HTTPException(status_code=404, detail="Factura not found")
+        await revertir_movimiento(factura_id, "factura", "anulacion_factura", "Factura eliminada", session)
+        await acumular_facturas_ranking([Factura(**factura)], -1, session)
+    await en_transaccion(eliminar)
+    await auditar("facturas", factura_id, "eliminar")
     return {"message": "Factura deleted successfully"}
 
+# Recurring facturas: templates emit one factura per period. The scheduler
+# claims due templates in batches, emits every missed period after downtime,
+# and factura ids derive from (template, period), so a period is billed once.
+PERIODICIDADES_MESES = {"mensual": 1, "bimestral": 2, "trimestral": 3, "semestral": 6, "anual": 12}
+RECURRENTES_INTERVAL_SECONDS = float(os.environ.get("RECURRENTES_INTERVAL_SECONDS", "60"))
+RECURRENTES_BATCH_SIZE = int(os.environ.get("RECURRENTES_BATCH_SIZE", "200"))
+RECURRENTES_MAX_PERIODOS = int(os.environ.get("RECURRENTES_MAX_PERIODOS", "24"))
+RECURRENTES_CLAIM_TIMEOUT_SECONDS = 600
+
+def siguiente_periodo(fecha: datetime, periodicidad: str, dia: int) -> datetime:
+    meses = fecha.month - 1 + PERIODICIDADES_MESES[periodicidad]
+    anio, mes = fecha.year + meses // 12, meses % 12 + 1
+    return fecha.replace(year=anio, month=mes, day=min(dia, calendar.monthrange(anio, mes)[1]))
+
+def id_factura_recurrente(recurrencia_id: str, periodo: datetime) -> str:
+    return str(uuid.uuid5(uuid.NAMESPACE_URL, f"facturas-recurrentes/{recurrencia_id}/{periodo.isoformat()}"))
+
+async def _reclamar_recurrentes(ahora: datetime, claim: str) -> List[dict]:
+    """Claim a batch of due templates; each one is taken by a single worker."""
+    reclamables = {
+        "activa": True, "proxima_emision": {"$lte": ahora},
+        "$or": [{"claim": None}, {"fecha_claim": {"$lt": ahora - timedelta(seconds=RECURRENTES_CLAIM_TIMEOUT_SECONDS)}}]
+    }
+    vencidas = await db.facturas_recurrentes.find(reclamables, {"_id": 0, "id": 1}).limit(
+        RECURRENTES_BATCH_SIZE).to_list(RECURRENTES_BATCH_SIZE)
+    if not vencidas:
+        return []
+    await db.facturas_recurrentes.update_many(
+        {**reclamables, "id": {"$in": [v["id"] for v in vencidas]}},
+        {"$set": {"claim": claim, "fecha_claim": ahora}}
+    )
+    return await db.facturas_recurrentes.find({"claim": claim}, {"_id": 0}).to_list(None)
+
+async def _emitir_lote_recurrente(plantillas: List[dict], ahora: datetime) -> dict:
+    cliente_ids = list({p["cliente_id"] for p in plantillas})
+    clientes = {
+        c["id"]: c for c in await db.clientes.find(
+            {"id": {"$in": cliente_ids}}, {"_id": 0, "id": 1, **{f: 1 for f in CLIENTE_SNAPSHOT_FIELDS["facturas"].values()}}
+        ).to_list(None)
+    }
+    # A template's items repeat every period, so totals are computed once per template.
+    # One vectorized pass per IVA rate; if it fails, each template is retried alone so a
+    # bad one is parked instead of aborting the lot.
+    totales_plantilla = {}
+    errores = {}
+    con_cliente = [p for p in plantillas if p["cliente_id"] in clientes]
+    for porcentaje in {p["porcentaje_iva"] for p in con_cliente}:
+        grupo = [p for p in con_cliente if p["porcentaje_iva"] == porcentaje]
+        documentos = [
+            ([ItemPedido(**item) for item in p["items"]], p["tipo_factura"], p["condicion_iva"]) for p in grupo
+        ]
+        try:
+            calculados = calcular_totales_lote(documentos, porcentaje)
+        except HTTPException:
+            calculados = []
+            for documento in documentos:
+                try:
+                    calculados.append(calcular_totales_lote([documento], porcentaje)[0])
+                except HTTPException as e:
+                    calculados.append(e.detail)
+        for plantilla, total in zip(grupo, calculados):
+            if isinstance(total, TotalesCalculados):
+                totales_plantilla[plantilla["id"]] = total
+            else:
+                errores[plantilla["id"]] = total
+
+    pendientes = []  # (plantilla, cliente, periodo)
+    avances = []
+    for plantilla in plantillas:
+        liberar = {"id": plantilla["id"], "claim": plantilla["claim"]}
+        cliente = clientes.get(plantilla["cliente_id"])
+        error = "Cliente not found" if cliente is None else errores.get(plantilla["id"])
+        if error:
+            logger.warning(f"Recurring factura {plantilla['id']} deactivated: {error}")
+            avances.append(UpdateOne(liberar, {
+                "$set": {"activa": False, "ultimo_error": error, "claim": None}, "$inc": {"version": 1}
+            }))
+            continue
+        periodo = plantilla["proxima_emision"]
+        emitidas = 0
+        while periodo <= ahora and emitidas < RECURRENTES_MAX_PERIODOS:
+            pendientes.append((plantilla, cliente, periodo))
+            periodo = siguiente_periodo(periodo, plantilla["periodicidad"], plantilla["dia_emision"])
+            emitidas += 1
+        avances.append(UpdateOne(liberar, {
+            "$set": {"proxima_emision": periodo, "ultima_emision": ahora, "ultimo_error": "", "claim": None},
+            "$inc": {"emitidas": emitidas, "version": 1}
+        }))
+    totales = [totales_plantilla[plantilla["id"]] for plantilla, _, _ in pendientes]
+
+    facturas = []
+    for (plantilla, cliente, periodo), total in zip(pendientes, totales):
+        facturas.append(Factura(
+            id=id_factura_recurrente(plantilla["id"], periodo),
+            numero_factura=f"{plantilla['numero_prefijo']}-{periodo:%Y%m}",
+            tipo_factura=plantilla["tipo_factura"],
+            cliente_id=cliente["id"],
+            condicion_iva=plantilla["condicion_iva"],
+            items=plantilla["items"],
+            fecha_emision=periodo,
+            fecha_vencimiento=periodo + timedelta(days=plantilla["dias_vencimiento"]),
+            notas=plantilla.get("notas", ""),
+            condiciones=plantilla.get("condiciones", ""),
+            recurrencia_id=plantilla["id"],
+            periodo=periodo,
+            **{target: cliente.get(source, "") for target, source in CLIENTE_SNAPSHOT_FIELDS["facturas"].items()},
+            **total.dict()
+        ))
+
+    async def emitir(session):
+        # Periods already emitted by a run that died before advancing its template.
+        # Looked up first: inside a transaction a duplicate-key error aborts it
+        existentes = set(await db.facturas.distinct(
+            "id", {"id": {"$in": [f.id for f in facturas]}}, session=session
+        )) if facturas else set()
+        duplicadas = {i for i, f in enumerate(facturas) if f.id in existentes}
+        nuevas = [f for i, f in enumerate(facturas) if i not in duplicadas]
+        if nuevas:
+            try:
+                await db.facturas.insert_many([to_storage(f) for f in nuevas], ordered=False, session=session)
+            except BulkWriteError as e:
+                # Emitted concurrently since the lookup; en_transaccion retries inside a transaction
+                fallas = e.details.get("writeErrors", [])
+                if session is not None or any(falla["code"] != 11000 for falla in fallas):
+                    raise
+                repetidas = {nuevas[falla["index"]].id for falla in fallas}
+                duplicadas |= {i for i, f in enumerate(facturas) if f.id in repetidas}
+        if facturas:
+            # Deterministic ids make re-posting a surviving factura a no-op
+            await contabilizar([movimiento_factura(f) for f in facturas], session)
+            await acumular_facturas_ranking(
+                [f for i, f in enumerate(facturas) if i not in duplicadas], 1, session
+            )
+        if avances:
+            await db.facturas_recurrentes.bulk_write(avances, ordered=False, session=session)
+        return duplicadas
+    duplicadas = await en_transaccion(emitir)
+    for i, factura in enumerate(facturas):
+        if i not in duplicadas:
+            await auditar("facturas", factura.id, "crear")
+    return {
+        "plantillas": len(plantillas),
+        "facturas_emitidas": len(facturas) - len(duplicadas),
+        "periodos_ya_emitidos": len(duplicadas),
+        "sin_cliente": sum(1 for p in plantillas if p["cliente_id"] not in clientes),
+        "con_error": len(errores)
+    }
+
+async def emitir_facturas_recurrentes() -> dict:
+    """Emit every due period of every active template."""
+    resumen = dict.fromkeys(
+        ["plantillas", "facturas_emitidas", "periodos_ya_emitidos", "sin_cliente", "con_error"], 0
+    )
+    ahora = datetime.utcnow()
+    while True:
+        claim = f"{WORKER_ID}:{uuid.uuid4()}"
+        plantillas = await _reclamar_recurrentes(ahora, claim)
+        if not plantillas:
+            return resumen
+        por_tenant = defaultdict(list)
+        for plantilla in plantillas:
+            por_tenant[plantilla.get("tenant_id")].append(plantilla)
+        try:
+            for tenant, lote in por_tenant.items():
+                tenant_token = current_tenant.set(tenant)
+                try:
+                    for clave, valor in (await _emitir_lote_recurrente(lote, ahora)).items():
+                        resumen[clave] += valor
+                finally:
+                    current_tenant.reset(tenant_token)
+        finally:
+            # A lot that failed midway must not stay claimed until the claim times out
+            await db.facturas_recurrentes.update_many({"claim": claim}, {"$set": {"claim": None}})
+
+async def facturacion_recurrente_worker():
+    while True:
+        try:
+            await emitir_facturas_recurrentes()
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logger.error(f"Recurring factura run failed: {e}")
+        await asyncio.sleep(RECURRENTES_INTERVAL_SECONDS)
+
+@api_router.post("/facturas-recurrentes", response_model=FacturaRecurrente)
+async def create_factura_recurrente(recurrente: FacturaRecurrenteCreate):
+    if recurrente.periodicidad not in PERIODICIDADES_MESES:
+        raise HTTPException(status_code=400, detail=f"Invalid periodicidad: {recurrente.periodicidad}")
+    cliente = await db.clientes.find_one({"id": recurrente.cliente_id}, {"_id": 0, "nombre": 1})
+    if not cliente:
+        raise HTTPException(status_code=404, detail="Cliente not found")
+    # Reject bad items now rather than on every scheduler run
+    calcular_totales(recurrente.items, recurrente.tipo_factura, recurrente.condicion_iva, recurrente.porcentaje_iva)
+
+    recurrente_dict = recurrente.dict()
+    proxima_emision = recurrente.proxima_emision or datetime.utcnow()
+    if proxima_emision.tzinfo is not None:
+        proxima_emision = proxima_emision.astimezone(timezone.utc).replace(tzinfo=None)
+    recurrente_dict["proxima_emision"] = proxima_emision
+    recurrente_dict["dia_emision"] = proxima_emision.day
+    recurrente_dict["cliente_nombre"] = cliente["nombre"]
+    recurrente_obj = FacturaRecurrente(**recurrente_dict)
+    if not recurrente_obj.numero_prefijo:
+        recurrente_obj.numero_prefijo = f"FR-{recurrente_obj.id[:8].upper()}"
+    await db.facturas_recurrentes.insert_one(recurrente_obj.dict())
+    await auditar("facturas_recurrentes", recurrente_obj.id, "crear")
+    return recurrente_obj
+
+@api_router.get("/facturas-recurrentes", response_model=List[FacturaRecurrente])
+async def get_facturas_recurrentes(activas_only: bool = False, params: ListQuery = Depends()):
+    filter_query = {"activa": True} if activas_only else {}
+    return await list_documents(
+        db.facturas_recurrentes, FacturaRecurrente, params, "proxima_emision",
+        estado_field=None, base_filter=filter_query
+    )
+
+@api_router.post("/facturas-recurrentes/ejecutar")
+async def ejecutar_facturas_recurrentes():
+    return await emitir_facturas_recurrentes()
+
+@api_router.get("/facturas-recurrentes/{recurrente_id}", response_model=FacturaRecurrente)
+async def get_factura_recurrente(recurrente_id: str):
+    recurrente = await db.facturas_recurrentes.find_one({"id": recurrente_id})
+    if not recurrente:
+        raise HTTPException(status_code=404, detail="Factura recurrente not found")
+    return FacturaRecurrente(**recurrente)
+
+@api_router.put("/facturas-recurrentes/{recurrente_id}", response_model=FacturaRecurrente)
+async def update_factura_recurrente(recurrente_id: str, recurrente_update: FacturaRecurrenteUpdate,
+                                    response: Response, if_match: Optional[int] = Depends(if_match_version)):
+    update_data = {k: v for k, v in recurrente_update.dict().items() if v is not None}
+    if not update_data:
+        raise HTTPException(status_code=400, detail="No data to update")
+    if "items" in update_data or "porcentaje_iva" in update_data:
+        # Validate the template as it will be billed: new values merged over the stored ones
+        actual = await db.facturas_recurrentes.find_one(
+            {"id": recurrente_id}, {"_id": 0, "items": 1, "tipo_factura": 1, "condicion_iva": 1, "porcentaje_iva": 1}
+        )
+        if not actual:
+            raise HTTPException(status_code=404, detail="Factura recurrente not found")
+        calcular_totales(
+            recurrente_update.items or [ItemPedido(**item) for item in actual["items"]],
+            actual["tipo_factura"], actual["condicion_iva"],
+            update_data.get("porcentaje_iva", actual["porcentaje_iva"])
+        )
+    if "proxima_emision" in update_data:
+        proxima_emision = update_data["proxima_emision"]
+        if proxima_emision.tzinfo is not None:
+            proxima_emision = proxima_emision.astimezone(timezone.utc).replace(tzinfo=None)
+        update_data["proxima_emision"] = proxima_emision
+        update_data["dia_emision"] = proxima_emision.day
+    recurrente = await update_versioned(
+        db.facturas_recurrentes, recurrente_id, {"$set": update_data}, "Factura recurrente not found",
+        if_match, response
+    )
+    return FacturaRecurrente(**recurrente)
+
+@api_router.delete("/facturas-recurrentes/{recurrente_id}")
+async def delete_factura_recurrente(recurrente_id: str):
+    result = await db.facturas_recurrentes.delete_one({"id": recurrente_id})
+    if result.deleted_count == 0:
+        raise HTTPException(status_code=404, detail="Factura recurrente not found")
+    await auditar("facturas_recurrentes", recurrente_id, "eliminar")
+    return {"message": "Factura recurrente deleted successfully"}
+
 # CRUD Endpoints for Compras
+def normalizar_proveedor(proveedor: str) -> str:
+    # Also used to backfill old compras, so stored keys never depend on MongoDB's ASCII-only $toLower
+    return proveedor.strip().lower()
+
 @api_router.post("/compras", response_model=Compra)
 async def create_compra(compra: CompraCreate):
     # Calculate totals
@@ -731,16 +3156,19 @@ async def create_compra(compra: CompraCreate):
     total = subtotal + compra.impuestos
     
     compra_dict = compra.dict()
+    compra_dict["proveedor_key"] = normalizar_proveedor(compra.proveedor)
     compra_dict["subtotal"] = subtotal
     compra_dict["total"] = total
     compra_obj = Compra(**compra_dict)
     await db.compras.insert_one(compra_obj.dict())
+    await auditar("compras", compra_obj.id, "crear")
     return compra_obj
 
 @api_router.get("/compras", response_model=List[Compra])
-async def get_compras():
-    compras = await db.compras.find().to_list(1000)
-    return [Compra(**compra) for compra in compras]
+async def get_compras(params: ListQuery = Depends()):
+    return await list_documents(
+        db.compras, Compra, params, "fecha_compra", estado_field="estado_pago", cliente_field=None
+    )
 
 @api_router.get("/compras/{compra_id}", response_model=Compra)
 async def get_compra(compra_id: str):
@@ -760,57 +3188,64 @@ async def create_remito(remito: RemitoCreate):
     remito_dict = remito.dict()
     remito_dict["cliente_nombre"] = cliente_nombre
     remito_obj = Remito(**remito_dict)
-    await db.remitos.insert_one(remito_obj.dict())
+    await db.remitos.insert_one(to_storage(remito_obj))
+    await auditar("remitos", remito_obj.id, "crear")
     return remito_obj
 
 @api_router.get("/remitos", response_model=List[Remito])
-async def get_remitos():
-    remitos = await db.remitos.find().to_list(1000)
-    return [Remito(**remito) for remito in remitos]
+async def get_remitos(params: ListQuery = Depends()):
+    return await list_documents(db.remitos, Remito, params, "fecha_emision")
 
 @api_router.get("/remitos/{remito_id}", response_model=Remito)
 async def get_remito(remito_id: str):
-    remito = await db.remitos.find_one({"id": remito_id})
+    remito = await find_with_archive("remitos", {"id": remito_id})
     if not remito:
         from fastapi import HTTPException
         raise HTTPException(status_code=404, detail="Remito not found")
     return Remito(**remito)
 
 @api_router.put("/remitos/{remito_id}/estado")
-async def update_remito_estado(remito_id: str, estado: str):
+async def update_remito_estado(remito_id: str, estado: str, response: Response,
+                               if_match: Optional[int] = Depends(if_match_version)):
     valid_estados = ["pendiente", "en_transito", "entregado"]
     if estado not in valid_estados:
         from fastapi import HTTPException
         raise HTTPException(status_code=400, detail="Invalid estado")
     
-    result = await db.remitos.update_one({"id": remito_id}, {"$set": {"estado": estado}})
-    if result.matched_count == 0:
-        from fastapi import HTTPException
-        raise HTTPException(status_code=404, detail="Remito not found")
-    return {"message": f"Remito estado updated to {estado}"}
+    remito = await update_versioned(
+        db.remitos, remito_id, {"$set": {"estado": estado}}, "Remito not found",
+        if_match, response, projection={"_id": 0, "version": 1}
+    )
+    return {"message": f"Remito estado updated to {estado}", "version": remito["version"]}
 
 # Dashboard Endpoint
 @api_router.get("/dashboard", response_model=DashboardData)
-async def get_dashboard_data():
-    # Calculate total sales from paid invoices
-    facturas_pagadas = await db.facturas.find({"estado": "pagada"}).to_list(1000)
-    total_ventas = sum(factura["total"] for factura in facturas_pagadas)
-    
-    # Calculate total expenses from purchases
-    compras = await db.compras.find().to_list(1000)
-    total_gastos = sum(compra["total"] for compra in compras)
+async def get_dashboard_data(incluir_archivo: bool = True):
+    async def sum_total(collections, match):
+        pipeline = [{"$match": match}, {"$group": {"_id": None, "total": {"$sum": "$total"}}}]
+        results = await asyncio.gather(*[c.aggregate(pipeline).to_list(1) for c in collections])
+        return sum(rows[0]["total"] for rows in results if rows)
+
+    # Sales, expenses and pending/overdue counts in one concurrent batch
+    total_ventas, total_gastos, pedidos_pendientes, facturas_counts = await asyncio.gather(
+        sum_total(collections_for_report("facturas", incluir_archivo), {"estado": "pagada"}),
+        sum_total([db.compras], {}),
+        db.pedidos.count_documents({"estado": "pendiente"}),
+        db.facturas.aggregate([
+            {"$match": {"estado": "pendiente"}},
+            {"$group": {
+                "_id": None,
+                "pendientes": {"$sum": 1},
+                "vencidas": {"$sum": {"$cond": [{"$lt": ["$fecha_vencimiento", datetime.utcnow()]}, 1, 0]}}
+            }}
+        ]).to_list(1)
+    )
+    facturas_pendientes = facturas_counts[0]["pendientes"] if facturas_counts else 0
+    facturas_vencidas = facturas_counts[0]["vencidas"] if facturas_counts else 0
     
     # Calculate net profit
     ganancia_neta = total_ventas - total_gastos
     
-    # Count pending orders and invoices
-    pedidos_pendientes = await db.pedidos.count_documents({"estado": "pendiente"})
-    facturas_pendientes = await db.facturas.count_documents({"estado": "pendiente"})
-    facturas_vencidas = await db.facturas.count_documents({
-        "estado": "pendiente",
-        "fecha_vencimiento": {"$lt": datetime.utcnow()}
-    })
-    
     return DashboardData(
         total_ventas=total_ventas,
         total_gastos=total_gastos,
@@ -820,6 +3255,637 @@ async def get_dashboard_data():
         facturas_vencidas=facturas_vencidas
     )
 
+# Status counters for every document type
+CONTADORES_CACHE_SECONDS = float(os.environ.get("CONTADORES_CACHE_SECONDS", "5"))
+CONTADORES = {
+    "pedidos": ("estado", ["pendiente", "en_proceso", "completado", "cancelado"]),
+    "remitos": ("estado", ["pendiente", "en_transito", "entregado"]),
+    "presupuestos": ("estado", ["borrador", "enviado", "aceptado", "rechazado", "convertido"]),
+    "recibos": ("estado", ["activo", "anulado"]),
+    "facturas": ("estado", ["pendiente", "pagada", "cobro_parcial", "vencida"]),
+    "notas_credito": ("estado", ["pendiente", "aplicada"]),
+    "notas_debito": ("estado", ["pendiente", "aplicada"]),
+    "compras": ("estado_pago", ["pendiente", "pagado"]),
+}
+contadores_cache = TenantTTLCache(CONTADORES_CACHE_SECONDS)
+
+async def contar_por_estado(coleccion: str, totales_estimados: bool):
+    campo, estados = CONTADORES[coleccion]
+    # Sorting on the state field lets the (estado, fecha) index cover the $group
+    pipeline = [
+        {"$sort": {campo: 1}},
+        {"$project": {"_id": 0, campo: 1}},
+        {"$group": {"_id": f"${campo}", "cantidad": {"$sum": 1}}}
+    ]
+    consultas = [db[coleccion].aggregate(pipeline).to_list(None)]
+    if totales_estimados:
+        consultas.append(db[coleccion].estimated_document_count())
+    resultados = await asyncio.gather(*consultas)
+    por_estado = dict.fromkeys(estados, 0)
+    por_estado.update({row["_id"]: row["cantidad"] for row in resultados[0] if row["_id"] is not None})
+    contador = {"por_estado": por_estado, "total": sum(por_estado.values())}
+    if totales_estimados:
+        contador["total_estimado"] = resultados[1]
+    return contador
+
+@api_router.get("/contadores")
+async def get_contadores(colecciones: Optional[str] = None, totales_estimados: bool = False):
+    nombres = [c.strip() for c in colecciones.split(",") if c.strip()] if colecciones else list(CONTADORES)
+    invalidas = [c for c in nombres if c not in CONTADORES]
+    if invalidas:
+        raise HTTPException(status_code=400, detail=f"Invalid colecciones: {', '.join(invalidas)}")
+
+    cache_key = (tuple(nombres), totales_estimados)
+    cached = contadores_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    contadores = await asyncio.gather(*[contar_por_estado(c, totales_estimados) for c in nombres])
+    resultado = dict(zip(nombres, contadores))
+    contadores_cache.set(cache_key, resultado)
+    return resultado
+
+# Reportes Endpoints
+@api_router.get("/reportes/compras/proveedores")
+async def get_reporte_compras_proveedores(
+    fecha_desde: Optional[datetime] = None,
+    fecha_hasta: Optional[datetime] = None,
+    top: int = 5
+):
+    match = {}
+    if fecha_desde or fecha_hasta:
+        match["fecha_compra"] = {}
+        if fecha_desde:
+            match["fecha_compra"]["$gte"] = fecha_desde
+        if fecha_hasta:
+            match["fecha_compra"]["$lte"] = fecha_hasta
+
+    pagado = {"$cond": [{"$eq": ["$estado_pago", "pagado"]}, "$total", 0]}
+    pendiente = {"$cond": [{"$eq": ["$estado_pago", "pagado"]}, 0, "$total"]}
+    por_proveedor = [
+        {"$group": {
+            "_id": "$proveedor_key",
+            "proveedor": {"$first": "$proveedor"},
+            "total": {"$sum": "$total"},
+            "cantidad": {"$sum": 1},
+            "pagado": {"$sum": pagado},
+            "pendiente": {"$sum": pendiente}
+        }},
+        {"$sort": {"total": -1}}
+    ]
+    pipeline = [
+        {"$match": match},
+        {"$project": {
+            "_id": 0,
+            "proveedor": 1,
+            "proveedor_key": 1,
+            "categoria": 1,
+            "estado_pago": 1,
+            "total": 1,
+            "mes": {"$dateToString": {"format": "%Y-%m", "date": "$fecha_compra"}}
+        }},
+        {"$facet": {
+            "por_estado_pago": [
+                {"$group": {"_id": "$estado_pago", "total": {"$sum": "$total"}, "cantidad": {"$sum": 1}}}
+            ],
+            "por_proveedor": por_proveedor + [{"$limit": 1000}],
+            "top_proveedores": por_proveedor + [{"$limit": max(top, 1)}],
+            "por_categoria": [
+                {"$group": {"_id": "$categoria", "total": {"$sum": "$total"}, "cantidad": {"$sum": 1}}},
+                {"$sort": {"total": -1}}
+            ],
+            "por_mes": [
+                {"$group": {
+                    "_id": {"mes": "$mes", "categoria": "$categoria"},
+                    "total": {"$sum": "$total"},
+                    "cantidad": {"$sum": 1}
+                }},
+                {"$group": {
+                    "_id": "$_id.mes",
+                    "total": {"$sum": "$total"},
+                    "cantidad": {"$sum": "$cantidad"},
+                    "categorias": {"$push": {"categoria": "$_id.categoria", "total": "$total"}}
+                }},
+                {"$sort": {"_id": 1}}
+            ]
+        }}
+    ]
+    facets = (await db.compras.aggregate(pipeline).to_list(1))[0]
+
+    por_estado = {row["_id"]: row for row in facets["por_estado_pago"]}
+    pagadas = por_estado.get("pagado", {"total": 0, "cantidad": 0})
+    total_compras = sum(row["cantidad"] for row in facets["por_estado_pago"])
+    total_gastos = sum(row["total"] for row in facets["por_estado_pago"])
+
+    def proveedor_row(row):
+        return {
+            "proveedor_key": row["_id"],
+            "proveedor": row["proveedor"],
+            "total": row["total"],
+            "cantidad": row["cantidad"],
+            "pagado": row["pagado"],
+            "pendiente": row["pendiente"]
+        }
+
+    return {
+        "resumen": {
+            "total_compras": total_compras,
+            "total_gastos": total_gastos,
+            "compras_pagadas": pagadas["cantidad"],
+            "gastos_pagados": pagadas["total"],
+            "compras_pendientes": total_compras - pagadas["cantidad"],
+            "gastos_pendientes": total_gastos - pagadas["total"]
+        },
+        "por_estado_pago": [
+            {"estado_pago": row["_id"], "total": row["total"], "cantidad": row["cantidad"]}
+            for row in facets["por_estado_pago"]
+        ],
+        "por_proveedor": [proveedor_row(row) for row in facets["por_proveedor"]],
+        "top_proveedores": [proveedor_row(row) for row in facets["top_proveedores"]],
+        "por_categoria": [
+            {"categoria": row["_id"], "total": row["total"], "cantidad": row["cantidad"]}
+            for row in facets["por_categoria"]
+        ],
+        "por_mes": [
+            {"mes": row["_id"], "total": row["total"], "cantidad": row["cantidad"], "categorias": row["categorias"]}
+            for row in facets["por_mes"]
+        ]
+    }
+
+# Ranking rollups: monthly totals per cliente and per item, kept up to date by
+# the factura and recibo handlers, so a top-N query reads a few rollup rows
+# per month instead of every factura item.
+RANKING_CRITERIOS = {"clientes": ["facturado", "cobrado", "facturas"], "articulos": ["importe", "cantidad"]}
+RANKING_MAX_LIMITE = 500
+PERIODO_RANKING_PATTERN = re.compile(r"^\d{4}-(0[1-9]|1[0-2])$")
+
+def periodo_ranking(fecha: datetime) -> str:
+    return f"{fecha:%Y-%m}"
+
+def clave_item_ranking(item: ItemPedido) -> str:
+    # Free-text items without an articulo are ranked by description
+    return item.articulo_id or item.descripcion.strip().lower()
+
+async def acumular_facturas_ranking(facturas: List[Factura], signo: int = 1, session=None):
+    clientes = {}
+    items = {}
+    for factura in facturas:
+        periodo = periodo_ranking(factura.fecha_emision)
+        fila = clientes.setdefault((periodo, factura.cliente_id), {
+            "nombre": factura.cliente_nombre, "facturado": 0.0, "facturas": 0
+        })
+        fila["facturado"] += factura.total
+        fila["facturas"] += 1
+        for item in factura.items:
+            fila = items.setdefault((periodo, clave_item_ranking(item)), {
+                "articulo_id": item.articulo_id, "descripcion": item.descripcion, "cantidad": 0, "importe": 0.0
+            })
+            fila["cantidad"] += item.cantidad
+            fila["importe"] += item.subtotal
+    # Every increment bumps version, so a concurrent rebuild can tell which rows moved under it
+    if clientes:
+        await db.ranking_clientes.bulk_write([
+            UpdateOne({"periodo": periodo, "cliente_id": cliente_id}, {
+                "$inc": {"facturado": signo * fila["facturado"], "facturas": signo * fila["facturas"], "version": 1},
+                "$set": {"cliente_nombre": fila["nombre"]}
+            }, upsert=True)
+            for (periodo, cliente_id), fila in clientes.items()
+        ], ordered=False, session=session)
+    if items:
+        await db.ranking_articulos.bulk_write([
+            UpdateOne({"periodo": periodo, "clave": clave}, {
+                "$inc": {"cantidad": signo * fila["cantidad"], "importe": signo * fila["importe"], "version": 1},
+                "$set": {"articulo_id": fila["articulo_id"], "descripcion": fila["descripcion"]}
+            }, upsert=True)
+            for (periodo, clave), fila in items.items()
+        ], ordered=False, session=session)
+
+async def acumular_cobro_ranking(recibo: dict, signo: int = 1, session=None):
+    await db.ranking_clientes.update_one(
+        {"periodo": periodo_ranking(recibo["fecha_pago"]), "cliente_id": recibo["cliente_id"]},
+        {"$inc": {"cobrado": signo * recibo["monto_total"], "version": 1},
+         "$setOnInsert": {"cliente_nombre": recibo.get("cliente_nombre", "")}},
+        upsert=True, session=session
+    )
+
+def _periodo_expr(fecha_field: str):
+    return {"$dateToString": {"format": "%Y-%m", "date": f"${fecha_field}"}}
+
+def _item_expr(largo: str, corto: str, default=None):
+    # Items may be stored in the compact or the original layout
+    return {"$ifNull": [f"$items.{corto}", {"$ifNull": [f"$items.{largo}", default]}]}
+
+RANKING_RECONSTRUCCION_INTENTOS = int(os.environ.get("RANKING_RECONSTRUCCION_INTENTOS", "3"))
+RANKING_CLAVES = {"ranking_clientes": ("periodo", "cliente_id"), "ranking_articulos": ("periodo", "clave")}
+
+def _filtro_version(version: int) -> dict:
+    return {"version": version} if version else {"version": {"$exists": False}}
+
+async def _escanear_rankings(ctx: Optional[JobContext] = None) -> dict:
+    clientes = defaultdict(lambda: {"cliente_nombre": "", "facturado": 0.0, "cobrado": 0.0, "facturas": 0})
+    items = defaultdict(lambda: {"articulo_id": None, "descripcion": "", "cantidad": 0, "importe": 0.0})
+    for coleccion in ["facturas", "facturas_archive"]:
+        async for fila in db[coleccion].aggregate([
+            {"$group": {
+                "_id": {"periodo": _periodo_expr("fecha_emision"), "cliente_id": "$cliente_id"},
+                "cliente_nombre": {"$last": "$cliente_nombre"},
+                "facturado": {"$sum": "$total"},
+                "facturas": {"$sum": 1}
+            }}
+        ]):
+            destino = clientes[(fila["_id"]["periodo"], fila["_id"]["cliente_id"])]
+            destino["cliente_nombre"] = fila["cliente_nombre"] or destino["cliente_nombre"]
+            destino["facturado"] += fila["facturado"]
+            destino["facturas"] += fila["facturas"]
+        if ctx:
+            await ctx.progreso(25 if coleccion == "facturas" else 40, coleccion)
+        async for fila in db[coleccion].aggregate([
+            {"$unwind": "$items"},
+            {"$project": {
+                "periodo": _periodo_expr("fecha_emision"),
+                "articulo_id": _item_expr("articulo_id", "a"),
+                "descripcion": _item_expr("descripcion", "d", ""),
+                "cantidad": _item_expr("cantidad", "q", 0),
+                "importe": _item_expr("subtotal", "s", 0)
+            }},
+            {"$group": {
+                "_id": {"periodo": "$periodo", "clave": {"$ifNull": [
+                    "$articulo_id", {"$toLower": {"$trim": {"input": "$descripcion"}}}
+                ]}},
+                "articulo_id": {"$last": "$articulo_id"},
+                "descripcion": {"$last": "$descripcion"},
+                "cantidad": {"$sum": "$cantidad"},
+                "importe": {"$sum": "$importe"}
+            }}
+        ]):
+            destino = items[(fila["_id"]["periodo"], fila["_id"]["clave"])]
+            destino.update(articulo_id=fila["articulo_id"], descripcion=fila["descripcion"])
+            destino["cantidad"] += fila["cantidad"]
+            destino["importe"] += fila["importe"]
+        if ctx:
+            await ctx.progreso(55 if coleccion == "facturas" else 70, f"{coleccion} items")
+    async for fila in db.recibos.aggregate([
+        {"$match": {"estado": {"$ne": "anulado"}}},
+        {"$group": {
+            "_id": {"periodo": _periodo_expr("fecha_pago"), "cliente_id": "$cliente_id"},
+            "cliente_nombre": {"$last": "$cliente_nombre"},
+            "cobrado": {"$sum": "$monto_total"}
+        }}
+    ]):
+        destino = clientes[(fila["_id"]["periodo"], fila["_id"]["cliente_id"])]
+        destino["cliente_nombre"] = destino["cliente_nombre"] or fila["cliente_nombre"]
+        destino["cobrado"] += fila["cobrado"]
+
+    return {"ranking_clientes": dict(clientes), "ranking_articulos": dict(items)}
+
+async def _escribir_ranking(coleccion: str, filas: dict, versiones: dict, reconstruccion: str) -> set:
+    """Write rebuilt rows only where no increment landed since versiones was read; return the rows that moved."""
+    claves = RANKING_CLAVES[coleccion]
+    operaciones = []
+    for clave, fila in filas.items():
+        filtro = dict(zip(claves, clave))
+        if clave in versiones:
+            operaciones.append(UpdateOne({**filtro, **_filtro_version(versiones[clave])}, {
+                "$set": {**fila, "reconstruccion": reconstruccion}, "$inc": {"version": 1}
+            }))
+        else:
+            operaciones.append(UpdateOne(filtro, {
+                "$setOnInsert": {**fila, "reconstruccion": reconstruccion, "version": 1}
+            }, upsert=True))
+    # Rows that were there before the scan and no source produces any more
+    for clave in versiones.keys() - filas.keys():
+        operaciones.append(DeleteOne({**dict(zip(claves, clave)), **_filtro_version(versiones[clave])}))
+    for i in range(0, len(operaciones), LEDGER_BATCH_SIZE):
+        try:
+            await db[coleccion].bulk_write(operaciones[i:i + LEDGER_BATCH_SIZE], ordered=False)
+        except BulkWriteError as e:
+            # An increment upserted the same new row first; it is picked up as moved below
+            if any(error["code"] != 11000 for error in e.details["writeErrors"]):
+                raise
+    movidas = set()
+    async for fila in db[coleccion].find({}, {"_id": 0, "version": 1, "reconstruccion": 1, **{c: 1 for c in claves}}):
+        clave = tuple(fila[c] for c in claves)
+        if clave in filas and fila.get("reconstruccion") != reconstruccion:
+            movidas.add(clave)
+        elif clave not in filas and clave in versiones and fila.get("version", 0) != versiones[clave]:
+            movidas.add(clave)
+    return movidas
+
+async def reconstruir_rankings(ctx: Optional[JobContext] = None) -> dict:
+    """Rebuild the rollups of the current tenant from the source documents.
+
+    Live increments keep running meanwhile. Each row is written with a
+    compare-and-set on the version read before the scan, so an increment that
+    lands between scan and write is never overwritten; those rows are rescanned
+    and retried, and left to the incremental updates if they keep moving.
+    """
+    reconstruccion = uuid.uuid4().hex
+    pendientes = {coleccion: None for coleccion in RANKING_CLAVES}
+    resultado = {}
+    for intento in range(RANKING_RECONSTRUCCION_INTENTOS):
+        versiones = {}
+        for coleccion, claves in RANKING_CLAVES.items():
+            versiones[coleccion] = {
+                tuple(fila[c] for c in claves): fila.get("version", 0)
+                async for fila in db[coleccion].find({}, {"_id": 0, "version": 1, **{c: 1 for c in claves}})
+            }
+        escaneo = await _escanear_rankings(ctx if intento == 0 else None)
+        for coleccion, filas in escaneo.items():
+            if pendientes[coleccion] is not None:
+                filas = {clave: fila for clave, fila in filas.items() if clave in pendientes[coleccion]}
+                versiones[coleccion] = {
+                    clave: version for clave, version in versiones[coleccion].items() if clave in pendientes[coleccion]
+                }
+            if intento == 0:
+                resultado[coleccion] = len(filas)
+            pendientes[coleccion] = await _escribir_ranking(coleccion, filas, versiones[coleccion], reconstruccion)
+        if not any(pendientes.values()):
+            break
+    return {
+        "filas_clientes": resultado["ranking_clientes"],
+        "filas_articulos": resultado["ranking_articulos"],
+        "conflictos": sum(len(claves) for claves in pendientes.values())
+    }
+
+@job_handler("reconstruir_rankings")
+async def job_reconstruir_rankings(ctx: JobContext):
+    if not MULTI_TENANT or current_tenant.get() is not None:
+        return await reconstruir_rankings(ctx)
+    # Started without a tenant (e.g. at startup): rebuild every tenant
+    resultado = {}
+    for tenant in await db.facturas.distinct("tenant_id"):
+        tenant_token = current_tenant.set(tenant)
+        try:
+            resultado[tenant] = await reconstruir_rankings()
+        finally:
+            current_tenant.reset(tenant_token)
+    return resultado
+
+@api_router.post("/reportes/ranking/reconstruir", status_code=202)
+async def reconstruir_ranking():
+    return job_accepted(await encolar_job("reconstruir_rankings"))
+
+@api_router.get("/reportes/ranking/{dimension}")
+async def get_ranking(
+    dimension: str,
+    criterio: Optional[str] = None,
+    anio: Optional[int] = None,
+    desde: Optional[str] = None,
+    hasta: Optional[str] = None,
+    limite: int = 20
+):
+    """Top clientes or articulos for the months desde..hasta (YYYY-MM), or a whole year."""
+    if dimension not in RANKING_CRITERIOS:
+        raise HTTPException(status_code=404, detail=f"Unknown ranking: {dimension}")
+    criterio = criterio or RANKING_CRITERIOS[dimension][0]
+    if criterio not in RANKING_CRITERIOS[dimension]:
+        raise HTTPException(status_code=400, detail=f"Invalid criterio for {dimension}: {criterio}")
+    anio = anio or datetime.utcnow().year
+    desde = desde or f"{anio}-01"
+    hasta = hasta or f"{anio}-12"
+    for periodo in (desde, hasta):
+        if not PERIODO_RANKING_PATTERN.match(periodo):
+            raise HTTPException(status_code=400, detail=f"Invalid period {periodo!r}, expected YYYY-MM")
+    limite = max(1, min(limite, RANKING_MAX_LIMITE))
+
+    if dimension == "clientes":
+        coleccion = db.ranking_clientes
+        grupo = {
+            "_id": "$cliente_id",
+            "cliente_nombre": {"$first": "$cliente_nombre"},
+            **{campo: {"$sum": f"${campo}"} for campo in RANKING_CRITERIOS["clientes"]}
+        }
+    else:
+        coleccion = db.ranking_articulos
+        grupo = {
+            "_id": "$clave",
+            "articulo_id": {"$first": "$articulo_id"},
+            "descripcion": {"$first": "$descripcion"},
+            **{campo: {"$sum": f"${campo}"} for campo in RANKING_CRITERIOS["articulos"]}
+        }
+    filas = await coleccion.aggregate([
+        {"$match": {"periodo": {"$gte": desde, "$lte": hasta}}},
+        # Latest month first, so names come from the most recent document
+        {"$sort": {"periodo": -1}},
+        {"$group": grupo},
+        {"$match": {criterio: {"$gt": 0}}},
+        {"$sort": {criterio: -1, "_id": 1}},
+        {"$limit": limite}
+    ]).to_list(limite)
+
+    ranking = []
+    for posicion, fila in enumerate(filas, start=1):
+        clave = fila.pop("_id")
+        for campo in ("facturado", "cobrado", "importe"):
+            if campo in fila:
+                fila[campo] = round(float(fila[campo]), 2)
+        ranking.append({"posicion": posicion, ("cliente_id" if dimension == "clientes" else "clave"): clave, **fila})
+    return {"dimension": dimension, "criterio": criterio, "desde": desde, "hasta": hasta, "ranking": ranking}
+
+# Cash-flow projection: open facturas (inflows) and pending compras (outflows)
+# are summed per due day in the database, so only one row per day reaches the
+# app, and NumPy buckets those rows into days and weeks.
+FLUJO_CAJA_MAX_DIAS = 730
+COMPRAS_PLAZO_PAGO_DIAS = int(os.environ.get("COMPRAS_PLAZO_PAGO_DIAS", "30"))
+
+async def _pendiente_por_dia(coleccion: str, match: dict, fecha_expr, importe_expr):
+    filas = await db[coleccion].aggregate([
+        {"$match": match},
+        {"$group": {
+            "_id": {"$dateToString": {"format": "%Y-%m-%d", "date": fecha_expr}},
+            "importe": {"$sum": importe_expr},
+            "documentos": {"$sum": 1}
+        }}
+    ]).to_list(None)
+    filas = [fila for fila in filas if fila["_id"]]
+    dias = np.array([fila["_id"] for fila in filas], dtype="datetime64[D]")
+    importes = np.fromiter((fila["importe"] for fila in filas), dtype=np.float64, count=len(filas))
+    documentos = sum(fila["documentos"] for fila in filas)
+    return dias, importes, documentos
+
+def _importes_por_dia(dias, importes, inicio, horizonte: int):
+    """Daily totals over the horizon; amounts already overdue fall on day 0."""
+    offsets = (dias - inicio).astype(np.int64)
+    vencido = float(importes[offsets < 0].sum())
+    diarios = np.bincount(np.maximum(offsets, 0), weights=importes, minlength=horizonte)[:horizonte]
+    return diarios, vencido
+
+@api_router.get("/reportes/flujo-caja")
+async def get_flujo_caja(
+    horizonte_dias: int = 90,
+    saldo_inicial: float = 0.0,
+    fecha_inicio: Optional[datetime] = None
+):
+    if not 1 <= horizonte_dias <= FLUJO_CAJA_MAX_DIAS:
+        raise HTTPException(status_code=400, detail=f"horizonte_dias must be between 1 and {FLUJO_CAJA_MAX_DIAS}")
+    inicio = fecha_inicio or datetime.utcnow()
+    if inicio.tzinfo is not None:
+        inicio = inicio.astimezone(timezone.utc).replace(tzinfo=None)
+    inicio = inicio.replace(hour=0, minute=0, second=0, microsecond=0)
+    fin = inicio + timedelta(days=horizonte_dias)
+    plazo = timedelta(days=COMPRAS_PLAZO_PAGO_DIAS)
+
+    (dias_cobro, importes_cobro, facturas), (dias_pago, importes_pago, compras) = await asyncio.gather(
+        _pendiente_por_dia(
+            "facturas",
+            {"estado": {"$ne": "pagada"}, "fecha_vencimiento": {"$lt": fin}},
+            "$fecha_vencimiento",
+            {"$subtract": ["$total", {"$ifNull": ["$monto_pagado", 0]}]}
+        ),
+        _pendiente_por_dia(
+            "compras",
+            # Compras without a payment date are due COMPRAS_PLAZO_PAGO_DIAS after purchase
+            {"estado_pago": "pendiente", "$or": [
+                {"fecha_pago": {"$lt": fin}},
+                {"fecha_pago": None, "fecha_compra": {"$lt": fin - plazo}}
+            ]},
+            {"$ifNull": ["$fecha_pago", {"$add": ["$fecha_compra", int(plazo.total_seconds() * 1000)]}]},
+            "$total"
+        )
+    )
+    inicio_dia = np.datetime64(inicio.date(), "D")
+    ingresos, vencido_cobrar = _importes_por_dia(dias_cobro, importes_cobro, inicio_dia, horizonte_dias)
+    egresos, vencido_pagar = _importes_por_dia(dias_pago, importes_pago, inicio_dia, horizonte_dias)
+    neto = ingresos - egresos
+    saldo = saldo_inicial + np.cumsum(neto)
+
+    semana = np.arange(horizonte_dias) // 7
+    ingresos_semana = np.bincount(semana, weights=ingresos)
+    egresos_semana = np.bincount(semana, weights=egresos)
+    cierre_semana = np.minimum((np.arange(len(ingresos_semana)) + 1) * 7, horizonte_dias) - 1
+    fechas = inicio_dia + np.arange(horizonte_dias)
+    minimo = int(np.argmin(saldo))
+
+    def serie(valores):
+        return np.round(valores, 2).tolist()
+
+    return {
+        "fecha_inicio": inicio,
+        "horizonte_dias": horizonte_dias,
+        "saldo_inicial": saldo_inicial,
+        "documentos": {"facturas": facturas, "compras": compras},
+        "totales": {
+            "ingresos": round(float(ingresos.sum()), 2),
+            "egresos": round(float(egresos.sum()), 2),
+            "neto": round(float(neto.sum()), 2),
+            "saldo_final": round(float(saldo[-1]), 2),
+            "vencido_a_cobrar": round(vencido_cobrar, 2),
+            "vencido_a_pagar": round(vencido_pagar, 2)
+        },
+        "saldo_minimo": {"fecha": str(fechas[minimo]), "saldo": round(float(saldo[minimo]), 2)},
+        "diario": [
+            {"fecha": fecha, "ingresos": i, "egresos": e, "neto": n, "saldo": s}
+            for fecha, i, e, n, s in zip(
+                fechas.astype(str).tolist(), serie(ingresos), serie(egresos), serie(neto), serie(saldo)
+            )
+        ],
+        "semanal": [
+            {"desde": desde, "ingresos": i, "egresos": e, "neto": n, "saldo": s}
+            for desde, i, e, n, s in zip(
+                fechas[::7].astype(str).tolist(), serie(ingresos_semana), serie(egresos_semana),
+                serie(ingresos_semana - egresos_semana), serie(saldo[cierre_semana])
+            )
+        ]
+    }
+
+# Global Search Endpoint
+SEARCH_DEADLINE_MS = int(os.environ.get("SEARCH_DEADLINE_MS", "250"))
+
+def _prefix_patterns(q: str):
+    # Anchored, case-sensitive prefixes so every branch can use index bounds
+    return {"$in": [re.compile("^" + re.escape(variant)) for variant in {q, q.upper(), q.lower()}]}
+
+SEARCH_TARGETS = {
+    "clientes": lambda q: (
+        {"$or": [
+            {"nombre_busqueda": {"$regex": "^" + re.escape(normalizar_nombre_busqueda(q))}},
+            {"cuit_dni": _prefix_patterns(q)}
+        ]},
+        {"_id": 0, "id": 1, "nombre": 1, "cuit_dni": 1, "email": 1}
+    ),
+    "facturas": lambda q: (
+        {"numero_factura": _prefix_patterns(q)},
+        {"_id": 0, "id": 1, "numero_factura": 1, "cliente_nombre": 1, "total": 1, "estado": 1, "fecha_emision": 1}
+    ),
+    "pedidos": lambda q: (
+        {"numero_pedido": _prefix_patterns(q)},
+        {"_id": 0, "id": 1, "numero_pedido": 1, "cliente_nombre": 1, "total": 1, "estado": 1, "fecha_pedido": 1}
+    ),
+    "remitos": lambda q: (
+        {"numero_remito": _prefix_patterns(q)},
+        {"_id": 0, "id": 1, "numero_remito": 1, "cliente_nombre": 1, "estado": 1, "fecha_emision": 1}
+    ),
+    "recibos": lambda q: (
+        {"numero_recibo": _prefix_patterns(q)},
+        {"_id": 0, "id": 1, "numero_recibo": 1, "cliente_nombre": 1, "monto_total": 1, "estado": 1, "fecha_pago": 1}
+    ),
+    "articulos": lambda q: (
+        {"codigo": _prefix_patterns(q)},
+        {"_id": 0, "id": 1, "codigo": 1, "nombre": 1, "precio": 1, "activo": 1}
+    ),
+}
+
+@api_router.get("/search")
+async def global_search(q: str, limite: int = 10):
+    q = q.strip()
+    if len(q) < 2:
+        raise HTTPException(status_code=400, detail="Search query must have at least 2 characters")
+    limite = max(1, min(limite, 50))
+    started = time.monotonic()
+
+    async def search_collection(name):
+        filter_query, projection = SEARCH_TARGETS[name](q)
+        cursor = db[name].find(filter_query, projection, limit=limite, max_time_ms=SEARCH_DEADLINE_MS)
+        return await cursor.to_list(limite)
+
+    tasks = {name: asyncio.ensure_future(search_collection(name)) for name in SEARCH_TARGETS}
+    done, pending = await asyncio.wait(tasks.values(), timeout=SEARCH_DEADLINE_MS / 1000)
+    for task in pending:
+        task.cancel()
+
+    resultados = {}
+    incompletas = []
+    for name, task in tasks.items():
+        if task in done and task.exception() is None:
+            resultados[name] = task.result()
+        else:
+            resultados[name] = []
+            incompletas.append(name)
+            if task in done:
+                logger.warning(f"Search on {name} failed: {task.exception()}")
+
+    return {
+        "q": q,
+        "resultados": resultados,
+        "parcial": bool(incompletas),
+        "colecciones_incompletas": incompletas,
+        "tiempo_ms": round((time.monotonic() - started) * 1000, 1)
+    }
+
+# Multi-get by id for long id lists (GET list endpoints accept ?ids= too)
+MULTI_GET_TARGETS = {
+    "clientes": ("clientes", Cliente),
+    "articulos": ("articulos", Articulo),
+    "pedidos": ("pedidos", Pedido),
+    "presupuestos": ("presupuestos", Presupuesto),
+    "facturas": ("facturas", Factura),
+    "compras": ("compras", Compra),
+    "remitos": ("remitos", Remito),
+    "recibos": ("recibos", Recibo),
+    "notas-credito": ("notas_credito", NotaCredito),
+    "notas-debito": ("notas_debito", NotaDebito),
+}
+
+class MultiGetRequest(BaseModel):
+    ids: List[str]
+    fields: Optional[str] = None
+
+@api_router.post("/{recurso}/por-ids")
+async def multi_get(recurso: str, request: MultiGetRequest):
+    if recurso not in MULTI_GET_TARGETS:
+        raise HTTPException(status_code=404, detail=f"Unknown collection: {recurso}")
+    collection, model = MULTI_GET_TARGETS[recurso]
+    return await get_many(db[collection], model, request.ids, request.fields)
+
 # Legacy endpoints (keep for existing functionality)
 @api_router.get("/")
 async def root():
@@ -837,9 +3903,306 @@ async def get_status_checks():
     status_checks = await db.status_checks.find().to_list(1000)
     return [StatusCheck(**status_check) for status_check in status_checks]
 
+# Acting user recorded in the audit trail
+@app.middleware("http")
+async def audit_actor_middleware(request: Request, call_next):
+    usuario = request.headers.get(AUDIT_USER_HEADER) or (request.client.host if request.client else None)
+    token = current_actor.set(usuario)
+    try:
+        return await call_next(request)
+    finally:
+        current_actor.reset(token)
+
+# Idempotency-Key support for POST endpoints
+IDEMPOTENCY_TTL_SECONDS = int(os.environ.get("IDEMPOTENCY_TTL_SECONDS", "86400"))
+IDEMPOTENCY_WAIT_SECONDS = float(os.environ.get("IDEMPOTENCY_WAIT_SECONDS", "30"))
+_idempotency_inflight = {}
+
+def _replay_idempotent_response(record):
+    return Response(
+        content=record["body"],
+        status_code=record["status_code"],
+        media_type=record.get("media_type"),
+        headers={"Idempotent-Replayed": "true"}
+    )
+
+async def _wait_idempotent_record(scope_key, fingerprint):
+    deadline = time.monotonic() + IDEMPOTENCY_WAIT_SECONDS
+    while time.monotonic() < deadline:
+        record = await db.idempotency_keys.find_one({"_id": scope_key})
+        if record is None:
+            # The first attempt failed and released the key
+            return None
+        if record["fingerprint"] != fingerprint:
+            return JSONResponse(status_code=422, content={"detail": "Idempotency-Key reused with a different request body"})
+        if record["estado"] == "completado":
+            return _replay_idempotent_response(record)
+        event = _idempotency_inflight.get(scope_key)
+        try:
+            if event is not None:
+                await asyncio.wait_for(event.wait(), timeout=min(1.0, deadline - time.monotonic()))
+            else:
+                # In flight on another worker process: poll the shared store
+                await asyncio.sleep(0.05)
+        except asyncio.TimeoutError:
+            pass
+    return JSONResponse(status_code=409, content={"detail": "A request with this Idempotency-Key is still in progress"})
+
+@app.middleware("http")
+async def idempotency_middleware(request: Request, call_next):
+    key = request.headers.get("Idempotency-Key")
+    if request.method != "POST" or not key:
+        return await call_next(request)
+
+    scope_key = f"{current_tenant.get() or ''}:{request.method}:{request.url.path}:{key}"
+    fingerprint = hashlib.sha256(await request.body()).hexdigest()
+
+    while True:
+        try:
+            await db.idempotency_keys.insert_one({
+                "_id": scope_key,
+                "fingerprint": fingerprint,
+                "estado": "en_proceso",
+                "fecha_creacion": datetime.utcnow()
+            })
+            break
+        except DuplicateKeyError:
+            response = await _wait_idempotent_record(scope_key, fingerprint)
+            if response is not None:
+                return response
+
+    event = asyncio.Event()
+    _idempotency_inflight[scope_key] = event
+    try:
+        response = await call_next(request)
+        body = b"".join([chunk async for chunk in response.body_iterator])
+        if response.status_code >= 500:
+            # Server errors are not cached so the client can retry for real
+            await db.idempotency_keys.delete_one({"_id": scope_key})
+        else:
+            await db.idempotency_keys.update_one({"_id": scope_key}, {"$set": {
+                "estado": "completado",
+                "status_code": response.status_code,
+                "media_type": response.media_type or response.headers.get("content-type"),
+                "body": body
+            }})
+        return Response(
+            content=body,
+            status_code=response.status_code,
+            headers=dict(response.headers),
+            media_type=response.media_type
+        )
+    except BaseException:
+        await db.idempotency_keys.delete_one({"_id": scope_key})
+        raise
+    finally:
+        event.set()
+        _idempotency_inflight.pop(scope_key, None)
+
+# Admission control and load shedding per route class
+REPORT_ROUTE_PREFIXES = ("/api/dashboard", "/api/cuentas-corrientes", "/api/reportes", "/api/search")
+ADMISSION_EXEMPT_PATHS = ("/api/metrics/admision",)
+
+class AdmissionClass:
+    def __init__(self, nombre: str, limite: int, cola_max: int, espera_max: float):
+        self.nombre = nombre
+        self.limite = limite
+        self.cola_max = cola_max
+        self.espera_max = espera_max
+        self.semaphore = asyncio.Semaphore(limite)
+        self.activos = 0
+        self.en_cola = 0
+        self.admitidos = 0
+        self.rechazados = 0
+        self.timeouts = 0
+
+    async def acquire(self) -> bool:
+        if self.semaphore.locked():
+            if self.en_cola >= self.cola_max:
+                self.rechazados += 1
+                return False
+            self.en_cola += 1
+            try:
+                await asyncio.wait_for(self.semaphore.acquire(), timeout=self.espera_max)
+            except asyncio.TimeoutError:
+                self.timeouts += 1
+                return False
+            finally:
+                self.en_cola -= 1
+        else:
+            await self.semaphore.acquire()
+        self.activos += 1
+        self.admitidos += 1
+        return True
+
+    def release(self):
+        self.activos -= 1
+        self.semaphore.release()
+
+    def metrics(self):
+        return {
+            "limite": self.limite,
+            "cola_max": self.cola_max,
+            "activos": self.activos,
+            "en_cola": self.en_cola,
+            "admitidos": self.admitidos,
+            "rechazados": self.rechazados,
+            "timeouts": self.timeouts
+        }
+
+def _admission_class_from_env(nombre: str, limite: int, cola_max: int, espera_max: float):
+    prefix = f"ADMISSION_{nombre.upper()}"
+    return AdmissionClass(
+        nombre,
+        int(os.environ.get(f"{prefix}_CONCURRENCY", limite)),
+        int(os.environ.get(f"{prefix}_QUEUE", cola_max)),
+        float(os.environ.get(f"{prefix}_WAIT_SECONDS", espera_max))
+    )
+
+ADMISSION_CLASSES = {
+    "writes": _admission_class_from_env("writes", 50, 200, 5.0),
+    "reads": _admission_class_from_env("reads", 100, 400, 2.0),
+    "reports": _admission_class_from_env("reports", 4, 8, 2.0),
+}
+ADMISSION_RETRY_AFTER_SECONDS = int(os.environ.get("ADMISSION_RETRY_AFTER_SECONDS", "2"))
+
+# POST endpoints that only read (id lists too long for a query string)
+READ_ONLY_POST_SUFFIXES = ("/por-ids", "/precios/consulta")
+
+def route_class(method: str, path: str) -> Optional[str]:
+    if not path.startswith("/api") or method == "OPTIONS" or path in ADMISSION_EXEMPT_PATHS:
+        return None
+    if path.startswith(REPORT_ROUTE_PREFIXES):
+        return "reports"
+    if method in ("GET", "HEAD") or (method == "POST" and path.endswith(READ_ONLY_POST_SUFFIXES)):
+        return "reads"
+    return "writes"
+
+@app.middleware("http")
+async def admission_control_middleware(request: Request, call_next):
+    nombre = route_class(request.method, request.url.path)
+    if nombre is None:
+        return await call_next(request)
+    admission = ADMISSION_CLASSES[nombre]
+    if not await admission.acquire():
+        return JSONResponse(
+            status_code=503,
+            content={"detail": f"Server busy ({nombre}), retry later"},
+            headers={"Retry-After": str(ADMISSION_RETRY_AFTER_SECONDS)}
+        )
+    try:
+        return await call_next(request)
+    finally:
+        admission.release()
+
+@api_router.get("/metrics/admision")
+async def get_admission_metrics():
+    return {nombre: admission.metrics() for nombre, admission in ADMISSION_CLASSES.items()}
+
+# Tenant resolution, per-tenant rate limits and caches
+TENANT_HEADER = "X-Tenant-ID"
+TENANT_JWT_SECRET = os.environ.get("TENANT_JWT_SECRET")
+TENANT_RATE_LIMIT = float(os.environ.get("TENANT_RATE_LIMIT", "0"))  # requests/second, 0 disables
+TENANT_RATE_BURST = float(os.environ.get("TENANT_RATE_BURST", "50"))
+TENANT_ID_PATTERN = re.compile(r"^[A-Za-z0-9_-]{1,64}$")
+# Per-tenant counters and buckets are kept for the most recently seen tenants only
+TENANT_TRACKED_MAX = int(os.environ.get("TENANT_TRACKED_MAX", "10000"))
+
+def _registro_lru(registro: OrderedDict, tenant, crear):
+    entrada = registro.get(tenant)
+    if entrada is None:
+        entrada = registro[tenant] = crear()
+        while len(registro) > TENANT_TRACKED_MAX:
+            registro.popitem(last=False)
+    else:
+        registro.move_to_end(tenant)
+    return entrada
+
+class TenantRateLimiter:
+    def __init__(self, rate: float, burst: float):
+        self.rate = rate
+        self.burst = burst
+        self._buckets = OrderedDict()  # tenant -> [tokens, last_refill], least recently used first
+
+    def allow(self, tenant) -> bool:
+        if self.rate <= 0:
+            return True
+        now = time.monotonic()
+        bucket = _registro_lru(self._buckets, tenant, lambda: [self.burst, now])
+        bucket[0] = min(self.burst, bucket[0] + (now - bucket[1]) * self.rate)
+        bucket[1] = now
+        if bucket[0] < 1:
+            return False
+        bucket[0] -= 1
+        return True
+
+tenant_rate_limiter = TenantRateLimiter(TENANT_RATE_LIMIT, TENANT_RATE_BURST)
+_tenant_stats = OrderedDict()
+
+def resolve_tenant(request: Request) -> Optional[str]:
+    """Tenant from the signed token when TENANT_JWT_SECRET is set, else from X-Tenant-ID."""
+    if not TENANT_JWT_SECRET:
+        return request.headers.get(TENANT_HEADER)
+    authorization = request.headers.get("Authorization", "")
+    if not authorization.startswith("Bearer "):
+        raise HTTPException(status_code=401, detail="Missing tenant token", headers={"WWW-Authenticate": "Bearer"})
+    try:
+        claims = jwt.decode(authorization[7:], TENANT_JWT_SECRET, algorithms=["HS256"])
+    except jwt.PyJWTError:
+        raise HTTPException(status_code=401, detail="Invalid tenant token", headers={"WWW-Authenticate": "Bearer"})
+    tenant = claims.get("tenant_id")
+    if not isinstance(tenant, str) or not tenant:
+        raise HTTPException(status_code=401, detail="Tenant token has no tenant_id claim",
+                            headers={"WWW-Authenticate": "Bearer"})
+    return tenant
+
+@app.middleware("http")
+async def tenant_middleware(request: Request, call_next):
+    if not MULTI_TENANT or not request.url.path.startswith("/api") or request.method == "OPTIONS":
+        return await call_next(request)
+    try:
+        tenant = resolve_tenant(request)
+    except HTTPException as e:
+        return JSONResponse(status_code=e.status_code, content={"detail": e.detail}, headers=e.headers)
+    if not tenant or not TENANT_ID_PATTERN.match(tenant):
+        return JSONResponse(status_code=400, content={"detail": f"Missing or invalid {TENANT_HEADER}"})
+
+    stats = _registro_lru(_tenant_stats, tenant, lambda: {"requests": 0, "rate_limited": 0})
+    if not tenant_rate_limiter.allow(tenant):
+        stats["rate_limited"] += 1
+        return JSONResponse(status_code=429, content={"detail": "Tenant rate limit exceeded"}, headers={"Retry-After": "1"})
+    stats["requests"] += 1
+
+    token = current_tenant.set(tenant)
+    try:
+        return await call_next(request)
+    finally:
+        current_tenant.reset(token)
+
+@api_router.get("/tenants/metricas")
+async def get_tenant_metrics():
+    tenant = current_tenant.get()
+    tenants = set(_tenant_stats) | set(tenant_rate_limiter._buckets)
+    per_tenant_bytes = [
+        sys.getsizeof(_tenant_stats.get(t, {})) + sys.getsizeof(tenant_rate_limiter._buckets.get(t, []))
+        + sum(cache.footprint(t) for cache in tenant_caches)
+        for t in tenants
+    ]
+    return {
+        "multi_tenant": MULTI_TENANT,
+        "tenants_activos": len(tenants),
+        "bytes_por_tenant_aprox": (sum(per_tenant_bytes) / len(per_tenant_bytes)) if per_tenant_bytes else 0,
+        "tenant": tenant,
+        "requests": _tenant_stats.get(tenant, {}).get("requests", 0),
+        "rate_limited": _tenant_stats.get(tenant, {}).get("rate_limited", 0),
+        "cache_entries": sum(cache.entries(tenant) for cache in tenant_caches)
+    }
+
 # Include the router in the main app
 app.include_router(api_router)
 
+app.add_middleware(GZipMiddleware, minimum_size=int(os.environ.get("GZIP_MIN_SIZE", "1024")))
+
 app.add_middleware(
     CORSMiddleware,
     allow_credentials=True,
@@ -855,6 +4218,156 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
+BACKFILL_BATCH_SIZE = 1000
+
+async def rellenar_normalizado(collection, origen: str, destino: str, normalizar) -> int:
+    """Set destino = normalizar(origen) where it is missing, in batches.
+
+    Non-ASCII values are rechecked too: earlier versions backfilled with
+    $toLower/$trim, which leave accented capitals (Ñ, Ú) and Unicode spaces alone.
+    """
+    corregidos = 0
+    lote = []
+    cursor = collection.find(
+        {"$or": [{destino: {"$exists": False}}, {origen: {"$regex": "[^\\x00-\\x7F]"}}]},
+        {"_id": 1, origen: 1, destino: 1}
+    ).batch_size(BACKFILL_BATCH_SIZE)
+    async for documento in cursor:
+        valor = normalizar(documento.get(origen) or "")
+        if documento.get(destino) != valor:
+            lote.append(UpdateOne({"_id": documento["_id"]}, {"$set": {destino: valor}}))
+        if len(lote) == BACKFILL_BATCH_SIZE:
+            corregidos += (await collection.bulk_write(lote, ordered=False)).modified_count
+            lote = []
+    if lote:
+        corregidos += (await collection.bulk_write(lote, ordered=False)).modified_count
+    return corregidos
+
+@app.on_event("startup")
+async def create_indexes():
+    # Backfill the normalized supplier key on compras created before it existed
+    await rellenar_normalizado(db.compras, "proveedor", "proveedor_key", normalizar_proveedor)
+    await db.compras.create_index([("proveedor_key", 1), ("fecha_compra", 1)])
+    await db.compras.create_index([("fecha_compra", 1)])
+
+    # Global search indexes
+    await rellenar_normalizado(db.clientes, "nombre", "nombre_busqueda", normalizar_nombre_busqueda)
+    await db.clientes.create_index([("nombre_busqueda", 1)])
+    await db.clientes.create_index([("cuit_dni", 1)])
+    await db.facturas.create_index([("numero_factura", 1)])
+    await db.pedidos.create_index([("numero_pedido", 1)])
+    await db.remitos.create_index([("numero_remito", 1)])
+    await db.recibos.create_index([("numero_recibo", 1)])
+    await db.articulos.create_index([("codigo", 1)])
+
+    # List endpoint filters: estado/cliente_id equality followed by the date range
+    for collection, fecha_field in [
+        ("facturas", "fecha_emision"), ("pedidos", "fecha_pedido"), ("remitos", "fecha_emision"),
+        ("recibos", "fecha_pago"), ("presupuestos", "fecha_emision"),
+        ("notas_credito", "fecha_emision"), ("notas_debito", "fecha_emision")
+    ]:
+        await db[collection].create_index([("cliente_id", 1), (fecha_field, -1)])
+        await db[collection].create_index([("estado", 1), (fecha_field, -1)])
+    await db.compras.create_index([("estado_pago", 1), ("fecha_compra", -1)])
+    await db.compras.create_index([("estado_pago", 1), ("fecha_pago", 1)])
+    await db.facturas.create_index([("estado", 1), ("fecha_vencimiento", 1)])
+    await db.articulos.create_index([("activo", 1), ("fecha_creacion", -1)])
+    await db.articulos.create_index([("categoria", 1), ("codigo", 1)])
+    await db.historial_precios.create_index([("id", 1)], unique=True)
+    await db.historial_precios.create_index([("articulo_id", 1), ("fecha", -1)])
+    await db.precios_articulos.create_index([("articulo_id", 1), ("vigencia_desde", -1)])
+    await db.precios_articulos.create_index([("aplicado", 1), ("vigencia_desde", 1)])
+    await db.precios_articulos.create_index([("id", 1)])
+    # Articulos created before versioned prices get an initial open version.
+    # This runs without a tenant in context, so each version takes its articulo's tenant_id
+    while True:
+        sin_version = await db.articulos.find(
+            {"precio_versionado": {"$ne": True}},
+            {"_id": 0, "id": 1, "precio": 1, "fecha_creacion": 1, "tenant_id": 1}
+        ).limit(PRICE_UPDATE_CHUNK_SIZE).to_list(PRICE_UPDATE_CHUNK_SIZE)
+        if not sin_version:
+            break
+        await db.precios_articulos.insert_many([
+            {
+                **VersionPrecio(
+                    articulo_id=a["id"], precio=a["precio"],
+                    vigencia_desde=a.get("fecha_creacion") or datetime.utcnow(), origen="inicial"
+                ).dict(),
+                **({"tenant_id": a["tenant_id"]} if "tenant_id" in a else {})
+            }
+            for a in sin_version
+        ])
+        await db.articulos.update_many(
+            {"id": {"$in": [a["id"] for a in sin_version]}}, {"$set": {"precio_versionado": True}}
+        )
+
+    await db.movimientos_cc.create_index([("cliente_id", 1), ("fecha", -1)])
+    await db.movimientos_cc.create_index([("cliente_id", 1), ("documento_id", 1)])
+    # Movements posted before the posting engine get their idempotency key
+    await db.movimientos_cc.update_many(
+        {"clave": {"$exists": False}, "tipo_movimiento": {"$ne": "ajuste"}},
+        [{"$set": {"clave": {"$concat": ["$tipo_movimiento", ":", "$documento_id"]}}}]
+    )
+    await db.movimientos_cc.create_index(
+        [("clave", 1)], unique=True, partialFilterExpression={"clave": {"$type": "string"}}
+    )
+    await db.propagaciones_cliente.create_index([("estado", 1), ("fecha_solicitud", 1)])
+    await db.ranking_clientes.create_index([("periodo", 1), ("cliente_id", 1)], unique=True)
+    await db.ranking_articulos.create_index([("periodo", 1), ("clave", 1)], unique=True)
+    await db.facturas_recurrentes.create_index([("activa", 1), ("proxima_emision", 1)])
+    await db.facturas_recurrentes.create_index([("claim", 1)])
+    await db.facturas.create_index(
+        [("recurrencia_id", 1), ("periodo", 1)], unique=True,
+        partialFilterExpression={"recurrencia_id": {"$type": "string"}}
+    )
+
+    # Archive collections keep the lookup indexes of their hot counterparts
+    for collection in ARCHIVE_RULES:
+        await db[f"{collection}_archive"].create_index([("id", 1)])
+        await db[f"{collection}_archive"].create_index([("cliente_id", 1)])
+    # Detail lookups and multi-get by id
+    for collection in [
+        "facturas", "remitos", "pedidos", "clientes", "articulos", "presupuestos",
+        "compras", "recibos", "notas_credito", "notas_debito", "facturas_recurrentes"
+    ]:
+        await db[collection].create_index([("id", 1)])
+
+    for collection in COMPACT_COLLECTIONS:
+        await db[collection].create_index([("_v", 1)])
+    for collection in VERSIONED_COLLECTIONS:
+        await db[collection].update_many({"version": {"$exists": False}}, {"$set": {"version": 1}})
+    await db.audit_log.create_index([("coleccion", 1), ("documento_id", 1), ("fecha", -1)])
+    await db.audit_log.create_index([("usuario", 1), ("fecha", -1)])
+    await db.audit_log.create_index([("fecha", -1)])
+    await db.jobs.create_index([("id", 1)], unique=True)
+    await db.jobs.create_index([("estado", 1), ("ejecutar_desde", 1)])
+    await db.jobs.create_index([("fecha_creacion", -1)])
+    if not await db.ranking_clientes.count_documents({}, limit=1) and await db.facturas.count_documents({}, limit=1):
+        logger.warning("Ranking rollups are empty; POST /api/reportes/ranking/reconstruir to build them")
+
+    # Idempotency store, expired by TTL
+    await db.idempotency_keys.create_index(
+        [("fecha_creacion", 1)], expireAfterSeconds=IDEMPOTENCY_TTL_SECONDS
+    )
+
+background_tasks = []
+
+@app.on_event("startup")
+async def start_background_workers():
+    await detectar_transacciones()
+    background_tasks.append(asyncio.create_task(audit_flusher()))
+    background_tasks.append(asyncio.create_task(propagation_worker()))
+    background_tasks.append(asyncio.create_task(precios_programados_worker()))
+    background_tasks.append(asyncio.create_task(facturacion_recurrente_worker()))
+    if ARCHIVE_INTERVAL_HOURS > 0:
+        background_tasks.append(asyncio.create_task(archive_worker()))
+    for _ in range(JOB_WORKERS):
+        background_tasks.append(asyncio.create_task(job_worker()))
+
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    for task in background_tasks:
+        task.cancel()
+    await asyncio.gather(*background_tasks, return_exceptions=True)
+    await vaciar_auditoria()
     client.close()
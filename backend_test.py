@@ -2,10 +2,14 @@
 """
 Comprehensive Backend API Testing for PYME Management System
 Tests all CRUD endpoints and business workflow
+
+    python backend_test.py               # against BACKEND_URL
+    python backend_test.py --in-process  # against the app itself on the in-memory storage engine
 """
 
 import requests
 import json
+import os
 from datetime import datetime, timedelta
 import sys
 
@@ -13,8 +17,9 @@ import sys
 BACKEND_URL = "https://95892df9-8dc2-4b9b-ab78-49ab143ef1ec.preview.emergentagent.com/api"
 
 class PymeAPITester:
-    def __init__(self):
-        self.base_url = BACKEND_URL
+    def __init__(self, http=requests, base_url=BACKEND_URL):
+        self.http = http
+        self.base_url = base_url
         self.test_data = {}
         self.results = {
             "passed": 0,
@@ -36,13 +41,13 @@ class PymeAPITester:
         url = f"{self.base_url}{endpoint}"
         try:
             if method == "GET":
-                response = requests.get(url)
+                response = self.http.get(url)
             elif method == "POST":
-                response = requests.post(url, json=data)
+                response = self.http.post(url, json=data)
             elif method == "PUT":
-                response = requests.put(url, json=data)
+                response = self.http.put(url, json=data)
             elif method == "DELETE":
-                response = requests.delete(url)
+                response = self.http.delete(url)
             
             return response
         except Exception as e:
@@ -238,6 +243,19 @@ class PymeAPITester:
         else:
             self.log_result("Get specific Factura", False, f"Status: {response.status_code if response else 'No response'}")
         
+        # Test 3b: Sparse fieldset returns items with their API names
+        response = self.make_request("GET", f"/facturas?ids={self.test_data['factura_id']}&fields=id,items,notas,condiciones")
+        if response and response.status_code == 200 and response.json():
+            factura = response.json()[0]
+            item = factura["items"][0]
+            expected_keys = {"descripcion", "cantidad", "precio_unitario", "subtotal"}
+            if expected_keys <= set(item) and factura.get("notas") == factura_data["notas"] and factura.get("condiciones") == "":
+                self.log_result("Sparse fieldset with items", True)
+            else:
+                self.log_result("Sparse fieldset with items", False, f"Got {factura}")
+        else:
+            self.log_result("Sparse fieldset with items", False, f"Status: {response.status_code if response else 'No response'}")
+        
         # Test 4: Mark Factura as paid
         response = self.make_request("PUT", f"/facturas/{self.test_data['factura_id']}/pagar")
         if response and response.status_code == 200:
@@ -496,7 +514,20 @@ class PymeAPITester:
         
         return self.results["failed"] == 0
 
+def run_in_process():
+    """Run the suite against the app in this process, with no server or database"""
+    os.environ["STORAGE_ENGINE"] = "memory"
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    from fastapi.testclient import TestClient
+    import server
+
+    with TestClient(server.app) as http:
+        return PymeAPITester(http, "/api").run_all_tests()
+
 if __name__ == "__main__":
-    tester = PymeAPITester()
-    success = tester.run_all_tests()
+    if "--in-process" in sys.argv:
+        success = run_in_process()
+    else:
+        tester = PymeAPITester()
+        success = tester.run_all_tests()
     sys.exit(0 if success else 1)
\ No newline at end of file
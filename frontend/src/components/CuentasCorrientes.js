@@ -68,14 +68,20 @@ const CuentasCorrientes = ({ searchTerm }) => {
       'factura': 'destructive',
       'pago': 'outline',
       'nota_credito': 'secondary',
-      'nota_debito': 'default'
+      'nota_debito': 'default',
+      'anulacion_factura': 'secondary',
+      'anulacion_pago': 'destructive',
+      'ajuste': 'outline'
     };
     
     const labels = {
       'factura': 'Factura',
       'pago': 'Pago',
       'nota_credito': 'N. Crédito',
-      'nota_debito': 'N. Débito'
+      'nota_debito': 'N. Débito',
+      'anulacion_factura': 'Anulación Factura',
+      'anulacion_pago': 'Anulación Pago',
+      'ajuste': 'Ajuste'
     };
 
     return (
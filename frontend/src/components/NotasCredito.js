@@ -8,6 +8,7 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from ".
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from "./ui/dialog";
 import { Label } from "./ui/label";
 import { Badge } from "./ui/badge";
+import { calcularTotales } from "../lib/iva";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -26,7 +27,7 @@ const NotasCredito = ({ searchTerm }) => {
     cliente_id: "",
     motivo: "",
     items: [{ descripcion: "", cantidad: 1, precio_unitario: 0, subtotal: 0 }],
-    impuestos: 0,
+    porcentaje_iva: "21",
     notas: ""
   });
 
@@ -58,7 +59,9 @@ const NotasCredito = ({ searchTerm }) => {
 
   const fetchFacturas = async () => {
     try {
-      const response = await axios.get(`${API}/facturas`);
+      const response = await axios.get(`${API}/facturas`, {
+        params: { fields: "id,numero_factura,cliente_id,total,tipo_factura,condicion_iva" }
+      });
       setFacturas(response.data);
     } catch (error) {
       console.error("Error fetching facturas:", error);
@@ -100,7 +103,7 @@ const NotasCredito = ({ searchTerm }) => {
   const handleSubmit = async (e) => {
     e.preventDefault();
     try {
-      const notaData = { ...formData };
+      const notaData = { ...formData, porcentaje_iva: parseFloat(formData.porcentaje_iva) };
       if (!notaData.numero_nota) {
         notaData.numero_nota = `NC-${Date.now()}`;
       }
@@ -114,7 +117,7 @@ const NotasCredito = ({ searchTerm }) => {
         cliente_id: "",
         motivo: "",
         items: [{ descripcion: "", cantidad: 1, precio_unitario: 0, subtotal: 0 }],
-        impuestos: 0,
+        porcentaje_iva: "21",
         notas: ""
       });
       fetchNotasCredito();
@@ -144,8 +147,12 @@ const NotasCredito = ({ searchTerm }) => {
     nota.motivo.toLowerCase().includes(searchTerm?.toLowerCase() || "")
   );
 
-  const subtotal = formData.items.reduce((sum, item) => sum + item.subtotal, 0);
-  const total = subtotal + parseFloat(formData.impuestos || 0);
+  // The nota takes the IVA treatment of the factura it refers to
+  const facturaRelacionada = facturas.find((factura) => factura.id === formData.factura_id);
+  const { subtotal, alicuota, impuestos: impuestosCalculados, total } = calcularTotales(
+    formData.items, formData.porcentaje_iva,
+    { tipoFactura: facturaRelacionada?.tipo_factura, condicionIva: facturaRelacionada?.condicion_iva }
+  );
 
   if (loading) {
     return (
@@ -291,19 +298,25 @@ const NotasCredito = ({ searchTerm }) => {
               
               <div className="space-y-2 mt-4 p-3 bg-red-50 rounded">
                 <div>
-                  <Label htmlFor="impuestos">Impuestos/IVA</Label>
-                  <Input
-                    id="impuestos"
-                    type="number"
-                    value={formData.impuestos}
-                    onChange={(e) => setFormData({...formData, impuestos: e.target.value})}
-                    min="0"
-                    step="0.01"
-                  />
+                  <Label htmlFor="porcentaje_iva">Porcentaje de IVA</Label>
+                  <Select
+                    value={formData.porcentaje_iva}
+                    onValueChange={(value) => setFormData({...formData, porcentaje_iva: value})}
+                  >
+                    <SelectTrigger>
+                      <SelectValue />
+                    </SelectTrigger>
+                    <SelectContent>
+                      <SelectItem value="21">21% (General)</SelectItem>
+                      <SelectItem value="10.5">10.5% (Reducido)</SelectItem>
+                      <SelectItem value="27">27% (Diferencial)</SelectItem>
+                      <SelectItem value="0">0% (Exento)</SelectItem>
+                    </SelectContent>
+                  </Select>
                 </div>
                 <div className="text-right">
                   <p>Subtotal: ${subtotal.toFixed(2)}</p>
-                  <p>Impuestos: ${parseFloat(formData.impuestos || 0).toFixed(2)}</p>
+                  <p>IVA ({alicuota}%): ${impuestosCalculados.toFixed(2)}</p>
                   <p className="text-lg font-bold text-red-600">Total: ${total.toFixed(2)}</p>
                 </div>
               </div>
@@ -8,6 +8,7 @@ import { Select, SelectContent, SelectItem, SelectTrigger, SelectValue } from ".
 import { Dialog, DialogContent, DialogHeader, DialogTitle, DialogTrigger } from "./ui/dialog";
 import { Label } from "./ui/label";
 import { Badge } from "./ui/badge";
+import { calcularTotales } from "../lib/iva";
 
 const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
@@ -91,16 +92,10 @@ const Presupuestos = ({ searchTerm }) => {
     return parseFloat(cantidad) * parseFloat(precio) || 0;
   };
 
-  // Función para calcular IVA automáticamente
-  const calculateIVA = (subtotal, porcentaje) => {
-    const porcentajeDecimal = parseFloat(porcentaje) / 100;
-    return subtotal * porcentajeDecimal;
-  };
-
-  // Calcular subtotal e IVA automáticamente
-  const subtotal = formData.items.reduce((sum, item) => sum + item.subtotal, 0);
-  const impuestosCalculados = calculateIVA(subtotal, formData.porcentaje_iva);
-  const total = subtotal + impuestosCalculados;
+  // Calcular subtotal e IVA automáticamente (clientes exentos no llevan IVA)
+  const { subtotal, alicuota, impuestos: impuestosCalculados, total } = calcularTotales(
+    formData.items, formData.porcentaje_iva, { condicionIva: formData.condicion_iva }
+  );
 
   const handleItemChange = (index, field, value) => {
     const newItems = [...formData.items];
@@ -649,7 +644,7 @@ const Presupuestos = ({ searchTerm }) => {
                       <span className="font-medium">${subtotal.toFixed(2)}</span>
                     </div>
                     <div className="flex justify-between items-center text-lg">
-                      <span>IVA ({formData.porcentaje_iva}%):</span>
+                      <span>IVA ({alicuota}%):</span>
                       <span className="font-medium">${impuestosCalculados.toFixed(2)}</span>
                     </div>
                     <div className="flex justify-between items-center text-xl font-bold text-blue-700 mt-2 pt-2 border-t border-blue-200">
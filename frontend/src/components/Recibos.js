@@ -58,8 +58,10 @@ const Recibos = ({ searchTerm }) => {
 
   const fetchFacturas = async () => {
     try {
-      const response = await axios.get(`${API}/facturas`);
-      setFacturas(response.data.filter(f => f.estado === 'pendiente'));
+      const response = await axios.get(`${API}/facturas`, {
+        params: { estado: "pendiente", fields: "id,numero_factura,cliente_id,total,fecha_vencimiento" }
+      });
+      setFacturas(response.data);
     } catch (error) {
       console.error("Error fetching facturas:", error);
     }
@@ -59,7 +59,9 @@ const Remitos = () => {
 
   const fetchFacturas = async () => {
     try {
-      const response = await axios.get(`${API}/facturas`);
+      const response = await axios.get(`${API}/facturas`, {
+        params: { fields: "id,numero_factura,cliente_id" }
+      });
       setFacturas(response.data);
     } catch (error) {
       console.error("Error fetching facturas:", error);
@@ -22,7 +22,7 @@ const BACKEND_URL = process.env.REACT_APP_BACKEND_URL;
 const API = `${BACKEND_URL}/api`;
 
 const ReporteCompras = () => {
-  const [compras, setCompras] = useState([]);
+  const [reporte, setReporte] = useState(null);
   const [loading, setLoading] = useState(true);
   const [period, setPeriod] = useState("monthly");
 
@@ -32,8 +32,10 @@ const ReporteCompras = () => {
 
   const fetchComprasData = async () => {
     try {
-      const response = await axios.get(`${API}/compras`);
-      setCompras(response.data);
+      const response = await axios.get(`${API}/reportes/compras/proveedores`, {
+        params: { top: 5 }
+      });
+      setReporte(response.data);
       setLoading(false);
     } catch (error) {
       console.error("Error fetching compras data:", error);
@@ -49,54 +51,28 @@ const ReporteCompras = () => {
     );
   }
 
-  // Analytics calculations
-  const totalCompras = compras.length;
-  const comprasPagadas = compras.filter(c => c.estado_pago === 'pagado').length;
-  const comprasPendientes = compras.filter(c => c.estado_pago === 'pendiente').length;
-  const totalGastos = compras.reduce((sum, c) => sum + c.total, 0);
-  const gastosPagados = compras.filter(c => c.estado_pago === 'pagado').reduce((sum, c) => sum + c.total, 0);
+  // Analytics calculations (aggregated server-side)
+  const resumen = reporte ? reporte.resumen : {};
+  const totalCompras = resumen.total_compras || 0;
+  const comprasPagadas = resumen.compras_pagadas || 0;
+  const comprasPendientes = resumen.compras_pendientes || 0;
+  const totalGastos = resumen.total_gastos || 0;
+  const gastosPagados = resumen.gastos_pagados || 0;
 
-  // Group by category
-  const gastosPorCategoria = compras.reduce((acc, compra) => {
-    const categoria = compra.categoria || 'general';
-    if (!acc[categoria]) {
-      acc[categoria] = { total: 0, cantidad: 0 };
-    }
-    acc[categoria].total += compra.total;
-    acc[categoria].cantidad += 1;
-    return acc;
-  }, {});
-
-  const categoriaData = Object.entries(gastosPorCategoria).map(([categoria, data]) => ({
-    categoria,
-    total: data.total,
-    cantidad: data.cantidad
-  }));
+  const categoriaData = reporte ? reporte.por_categoria : [];
 
-  // Monthly data (mock - would be calculated from dates)
-  const monthlyData = [
-    { month: 'Ene', compras: 32000, general: 15000, materiales: 10000, servicios: 4000, gastos: 3000 },
-    { month: 'Feb', compras: 38000, general: 18000, materiales: 12000, servicios: 5000, gastos: 3000 },
-    { month: 'Mar', compras: 35000, general: 16000, materiales: 11000, servicios: 4500, gastos: 3500 },
-    { month: 'Abr', compras: 42000, general: 20000, materiales: 14000, servicios: 5000, gastos: 3000 },
-    { month: 'May', compras: 39000, general: 18500, materiales: 13000, servicios: 4500, gastos: 3000 },
-    { month: 'Jun', compras: 45000, general: 22000, materiales: 15000, servicios: 5000, gastos: 3000 },
-  ];
+  const monthNames = ['Ene', 'Feb', 'Mar', 'Abr', 'May', 'Jun', 'Jul', 'Ago', 'Sep', 'Oct', 'Nov', 'Dic'];
+  const monthlyData = (reporte ? reporte.por_mes : []).map((row) => {
+    const [year, month] = row.mes.split('-');
+    const data = { month: `${monthNames[parseInt(month, 10) - 1]} ${year.slice(2)}`, compras: row.total };
+    row.categorias.forEach((c) => {
+      data[c.categoria] = c.total;
+    });
+    return data;
+  });
 
   // Top suppliers
-  const proveedorGastos = compras.reduce((acc, compra) => {
-    if (!acc[compra.proveedor]) {
-      acc[compra.proveedor] = { total: 0, cantidad: 0 };
-    }
-    acc[compra.proveedor].total += compra.total;
-    acc[compra.proveedor].cantidad += 1;
-    return acc;
-  }, {});
-
-  const topProveedores = Object.entries(proveedorGastos)
-    .map(([proveedor, data]) => ({ proveedor, ...data }))
-    .sort((a, b) => b.total - a.total)
-    .slice(0, 5);
+  const topProveedores = reporte ? reporte.top_proveedores : [];
 
   const pieData = categoriaData.map((item, index) => ({
     ...item,
@@ -0,0 +1,16 @@
+// Same rules as the server's totals engine, so previews match what gets stored:
+// factura C and exempt clients carry no IVA, amounts round to cents.
+const CONDICIONES_SIN_IVA = ["Exento"];
+
+export const redondear = (valor) => Math.round(valor * 100) / 100;
+
+export function sinIVA(tipoFactura, condicionIva) {
+  return tipoFactura === "C" || CONDICIONES_SIN_IVA.includes(condicionIva);
+}
+
+export function calcularTotales(items, porcentajeIva, { tipoFactura, condicionIva } = {}) {
+  const subtotal = redondear(items.reduce((sum, item) => sum + redondear(item.subtotal || 0), 0));
+  const alicuota = sinIVA(tipoFactura, condicionIva) ? 0 : parseFloat(porcentajeIva) || 0;
+  const impuestos = redondear(subtotal * alicuota / 100);
+  return { subtotal, alicuota, impuestos, total: redondear(subtotal + impuestos) };
+}
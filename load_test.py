@@ -0,0 +1,288 @@
+#!/usr/bin/env python3
+"""
+Async load generator for the PYME Management System
+Replays the business workflow scripted in backend_test.py (clientes, pedidos,
+facturas, recibos, remitos) as weighted scenarios against a local server.
+
+Usage:
+    python load_test.py --usuarios 50 --ramp-up 10 --duracion 60
+    python load_test.py --guardar-baseline baseline.json
+    python load_test.py --baseline baseline.json --tolerancia 20
+    python load_test.py --in-process  # app in this process on the in-memory storage engine
+"""
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import sys
+import time
+import uuid
+from collections import defaultdict
+from datetime import datetime, timedelta
+
+import httpx
+
+DEFAULT_URL = "http://localhost:8001/api"
+
+ITEMS = [
+    {"descripcion": "Producto A - Calidad Premium", "cantidad": 10, "precio_unitario": 150.0, "subtotal": 1500.0},
+    {"descripcion": "Producto B - Línea Estándar", "cantidad": 5, "precio_unitario": 80.0, "subtotal": 400.0}
+]
+
+
+class StepFailed(Exception):
+    pass
+
+
+class LoadTester:
+    def __init__(self, base_url, tenant=None, transport=None):
+        self.base_url = base_url
+        self.transport = transport
+        self.headers = {"X-Tenant-ID": tenant} if tenant else {}
+        self.latencias = defaultdict(list)
+        self.errores = defaultdict(int)
+        self.conteo = defaultdict(int)
+        self.requests = 0
+        self.escenarios_completados = defaultdict(int)
+        self.clientes = []
+        self.facturas = []
+
+    async def step(self, http, nombre, method, endpoint, data=None, expected=(200,)):
+        headers = dict(self.headers)
+        if method == "POST":
+            headers["Idempotency-Key"] = str(uuid.uuid4())
+        self.requests += 1
+        self.conteo[nombre] += 1
+        inicio = time.perf_counter()
+        try:
+            response = await http.request(method, f"{self.base_url}{endpoint}", json=data, headers=headers)
+        except httpx.HTTPError:
+            self.errores[nombre] += 1
+            raise StepFailed(nombre)
+        self.latencias[nombre].append((time.perf_counter() - inicio) * 1000)
+        if response.status_code not in expected:
+            self.errores[nombre] += 1
+            raise StepFailed(nombre)
+        return response.json()
+
+    # Scenarios -----------------------------------------------------------
+
+    async def flujo_completo(self, http):
+        """Cliente -> pedido -> factura -> recibo -> remito, as in backend_test.py"""
+        sufijo = uuid.uuid4().hex[:8]
+        cliente = await self.step(http, "crear_cliente", "POST", "/clientes", {
+            "nombre": f"Distribuidora {sufijo} SRL",
+            "email": f"ventas-{sufijo}@example.com.ar",
+            "telefono": "+54 11 4567-8901",
+            "direccion": "Av. San Martin 1234, Buenos Aires",
+            "cuit_dni": f"30-{random.randint(10000000, 99999999)}-9"
+        })
+        self.clientes.append(cliente["id"])
+        pedido = await self.step(http, "crear_pedido", "POST", "/pedidos", {
+            "numero_pedido": f"PED-{sufijo}",
+            "cliente_id": cliente["id"],
+            "items": ITEMS,
+            "fecha_entrega": (datetime.now() + timedelta(days=7)).isoformat(),
+            "notas": "Entrega en horario comercial"
+        })
+        await self.step(http, "estado_pedido", "PUT", f"/pedidos/{pedido['id']}/estado?estado=en_proceso")
+        factura = await self.step(http, "crear_factura", "POST", "/facturas", {
+            "numero_factura": f"FAC-A-{sufijo}",
+            "pedido_id": pedido["id"],
+            "cliente_id": cliente["id"],
+            "items": ITEMS,
+            "fecha_vencimiento": (datetime.now() + timedelta(days=30)).isoformat(),
+            "notas": "Condiciones: 30 días fecha factura"
+        })
+        self.facturas.append(factura["id"])
+        await self.step(http, "crear_recibo", "POST", "/recibos", {
+            "numero_recibo": f"REC-{sufijo}",
+            "cliente_id": cliente["id"],
+            "facturas_aplicadas": [factura["id"]],
+            "monto_total": factura["total"]
+        })
+        remito = await self.step(http, "crear_remito", "POST", "/remitos", {
+            "numero_remito": f"REM-{sufijo}",
+            "pedido_id": pedido["id"],
+            "factura_id": factura["id"],
+            "cliente_id": cliente["id"],
+            "items": ITEMS,
+            "transportista": "Transportes del Sur"
+        })
+        await self.step(http, "estado_remito", "PUT", f"/remitos/{remito['id']}/estado?estado=en_transito")
+
+    async def consultas(self, http):
+        """Screens opening lists and detail views"""
+        await self.step(http, "listar_facturas", "GET", "/facturas?fields=id,numero_factura,cliente_id,total&limit=100")
+        await self.step(http, "listar_pedidos", "GET", "/pedidos?estado=pendiente&limit=100")
+        if self.facturas:
+            await self.step(http, "detalle_factura", "GET", f"/facturas/{random.choice(self.facturas)}")
+        if self.clientes:
+            await self.step(http, "detalle_cliente", "GET", f"/clientes/{random.choice(self.clientes)}")
+        await self.step(http, "contadores", "GET", "/contadores")
+
+    async def reportes(self, http):
+        """Heavier report screens"""
+        await self.step(http, "dashboard", "GET", "/dashboard", expected=(200, 503))
+        await self.step(http, "reporte_compras", "GET", "/reportes/compras/proveedores", expected=(200, 503))
+        await self.step(http, "busqueda", "GET", "/search?q=FAC", expected=(200, 503))
+
+    # Runner --------------------------------------------------------------
+
+    async def usuario_virtual(self, http, escenarios, pesos, fin):
+        nombres = list(escenarios)
+        while time.monotonic() < fin:
+            nombre = random.choices(nombres, weights=pesos)[0]
+            try:
+                await escenarios[nombre](http)
+                self.escenarios_completados[nombre] += 1
+            except StepFailed:
+                pass
+
+    async def run(self, usuarios, ramp_up, duracion, pesos_escenarios):
+        escenarios = {
+            "flujo_completo": self.flujo_completo,
+            "consultas": self.consultas,
+            "reportes": self.reportes
+        }
+        escenarios = {k: v for k, v in escenarios.items() if pesos_escenarios.get(k, 0) > 0}
+        pesos = [pesos_escenarios[k] for k in escenarios]
+        limits = httpx.Limits(max_connections=usuarios, max_keepalive_connections=usuarios)
+        async with httpx.AsyncClient(timeout=30, limits=limits, transport=self.transport) as http:
+            # Seed one client/factura so read scenarios have data from the start
+            try:
+                await self.flujo_completo(http)
+            except StepFailed:
+                pass
+            inicio = time.monotonic()
+            fin = inicio + ramp_up + duracion
+            tareas = []
+            for i in range(usuarios):
+                tareas.append(asyncio.create_task(self.usuario_virtual(http, escenarios, pesos, fin)))
+                if ramp_up and i < usuarios - 1:
+                    await asyncio.sleep(ramp_up / usuarios)
+            await asyncio.gather(*tareas)
+            return time.monotonic() - inicio
+
+    def resumen(self, duracion):
+        pasos = {}
+        for nombre, requests in self.conteo.items():
+            valores = sorted(self.latencias.get(nombre, []))
+            pasos[nombre] = {
+                "requests": requests,
+                "errores": self.errores.get(nombre, 0),
+                "p50_ms": percentil(valores, 50),
+                "p95_ms": percentil(valores, 95),
+                "p99_ms": percentil(valores, 99)
+            }
+        errores = sum(self.errores.values())
+        return {
+            "duracion_s": round(duracion, 1),
+            "requests": self.requests,
+            "throughput_rps": round(self.requests / duracion, 1) if duracion else 0,
+            "tasa_error": round(errores / self.requests, 4) if self.requests else 0,
+            "escenarios": dict(self.escenarios_completados),
+            "pasos": pasos
+        }
+
+
+def percentil(valores, p):
+    if not valores:
+        return None
+    indice = min(len(valores) - 1, int(round(p / 100 * (len(valores) - 1))))
+    return round(valores[indice], 2)
+
+
+def imprimir_resumen(resumen):
+    print(f"\n📊 {resumen['requests']} requests en {resumen['duracion_s']} s "
+          f"({resumen['throughput_rps']} req/s), tasa de error {resumen['tasa_error'] * 100:.2f}%")
+    print(f"Escenarios completados: {resumen['escenarios']}")
+    print(f"\n{'paso':<20}{'requests':>10}{'errores':>9}{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}")
+    for nombre, paso in sorted(resumen["pasos"].items()):
+        print(f"{nombre:<20}{paso['requests']:>10}{paso['errores']:>9}"
+              f"{paso['p50_ms'] or 0:>10.1f}{paso['p95_ms'] or 0:>10.1f}{paso['p99_ms'] or 0:>10.1f}")
+
+
+def comparar_con_baseline(resumen, baseline, tolerancia):
+    regresiones = []
+    factor = 1 + tolerancia / 100
+    for nombre, paso in resumen["pasos"].items():
+        base = baseline["pasos"].get(nombre)
+        if not base or base["p95_ms"] is None or paso["p95_ms"] is None:
+            continue
+        if paso["p95_ms"] > base["p95_ms"] * factor:
+            regresiones.append(f"{nombre}: p95 {paso['p95_ms']:.1f} ms vs baseline {base['p95_ms']:.1f} ms")
+    if resumen["tasa_error"] > baseline["tasa_error"] + 0.01:
+        regresiones.append(f"tasa de error {resumen['tasa_error']:.2%} vs baseline {baseline['tasa_error']:.2%}")
+    if resumen["throughput_rps"] < baseline["throughput_rps"] / factor:
+        regresiones.append(f"throughput {resumen['throughput_rps']} req/s vs baseline {baseline['throughput_rps']} req/s")
+    return regresiones
+
+
+async def run_in_process(tester, *args):
+    """Drive the ASGI app directly: latencies are handler CPU cost, with no network or database"""
+    os.environ["STORAGE_ENGINE"] = "memory"
+    sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "backend"))
+    import server
+
+    tester.transport = httpx.ASGITransport(app=server.app)
+    await server.app.router.startup()
+    try:
+        return await tester.run(*args)
+    finally:
+        await server.app.router.shutdown()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Async load generator for the PYME API")
+    parser.add_argument("--url", default=DEFAULT_URL)
+    parser.add_argument("--tenant", help="X-Tenant-ID to send when the server runs in multi-tenant mode")
+    parser.add_argument("--usuarios", type=int, default=20, help="virtual users")
+    parser.add_argument("--ramp-up", type=float, default=5, help="seconds to start all virtual users")
+    parser.add_argument("--duracion", type=float, default=30, help="seconds at full load")
+    parser.add_argument("--pesos", default="flujo_completo=1,consultas=6,reportes=1",
+                        help="scenario weights, e.g. flujo_completo=1,consultas=6,reportes=1")
+    parser.add_argument("--baseline", help="baseline JSON to compare against")
+    parser.add_argument("--tolerancia", type=float, default=20, help="allowed p95 regression in percent")
+    parser.add_argument("--guardar-baseline", help="write this run's summary as a baseline JSON")
+    parser.add_argument("--in-process", action="store_true",
+                        help="run the app in this process on the in-memory storage engine instead of --url")
+    args = parser.parse_args()
+
+    pesos = {}
+    for par in args.pesos.split(","):
+        nombre, _, peso = par.partition("=")
+        pesos[nombre.strip()] = float(peso)
+
+    url = "http://testserver/api" if args.in_process else args.url
+    print(f"🚀 {args.usuarios} usuarios virtuales contra {'la app en proceso' if args.in_process else url} "
+          f"(ramp-up {args.ramp_up} s, duración {args.duracion} s)")
+    tester = LoadTester(url, args.tenant)
+    if args.in_process:
+        duracion = asyncio.run(run_in_process(tester, args.usuarios, args.ramp_up, args.duracion, pesos))
+    else:
+        duracion = asyncio.run(tester.run(args.usuarios, args.ramp_up, args.duracion, pesos))
+    resumen = tester.resumen(duracion)
+    imprimir_resumen(resumen)
+
+    if args.guardar_baseline:
+        with open(args.guardar_baseline, "w") as f:
+            json.dump(resumen, f, indent=2)
+        print(f"\n💾 Baseline guardado en {args.guardar_baseline}")
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        regresiones = comparar_con_baseline(resumen, baseline, args.tolerancia)
+        if regresiones:
+            print("\n❌ Regresiones detectadas:")
+            for regresion in regresiones:
+                print(f"   - {regresion}")
+            sys.exit(1)
+        print("\n✅ Sin regresiones respecto al baseline")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,102 @@
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import pytest
+
+# The app runs on the in-memory storage engine; nothing here needs a MongoDB server
+sys.path.insert(0, str(Path(__file__).resolve().parents[1] / "backend"))
+os.environ["STORAGE_ENGINE"] = "memory"
+os.environ["DB_NAME"] = "pyme_test"
+_tmp = Path(tempfile.mkdtemp(prefix="pyme-tests-"))
+os.environ.setdefault("EXPORT_DIR", str(_tmp / "exports"))
+os.environ.setdefault("BACKUP_DIR", str(_tmp / "backups"))
+# The flusher holds a batch this long before writing it; tests read the audit log right away
+os.environ.setdefault("AUDIT_FLUSH_INTERVAL_SECONDS", "0.05")
+
+import server  # noqa: E402
+from fastapi.testclient import TestClient  # noqa: E402
+
+
+async def _vaciar():
+    # Documents only: the indexes built at startup must survive between tests
+    for nombre in await server.db.list_collection_names():
+        await server.db[nombre].delete_many({})
+
+
+@pytest.fixture(scope="session")
+def app_client():
+    # One lifespan per session: the background workers are started once per process, as in production
+    with TestClient(server.app) as c:
+        yield c
+
+
+@pytest.fixture
+def client(app_client):
+    yield app_client
+    app_client.portal.call(_vaciar)
+    for cache in server.tenant_caches:
+        cache._partitions.clear()
+
+
+class SesionFalsa:
+    """Stands in for a MongoDB session: the memory engine has no transactions."""
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc):
+        return False
+
+    def start_transaction(self):
+        return self
+
+
+@pytest.fixture
+def transacciones(monkeypatch):
+    """Make transaccion() take its transactional path, as on a replica set."""
+    async def start_session(**kwargs):
+        return SesionFalsa()
+
+    monkeypatch.setattr(server.client, "start_session", start_session)
+    monkeypatch.setitem(server.ledger_state, "transacciones", True)
+
+
+@pytest.fixture
+def run(client):
+    """Run a coroutine function on the app's event loop."""
+    return lambda fn, *args: client.portal.call(fn, *args)
+
+
+@pytest.fixture
+def cliente(client):
+    return client.post("/api/clientes", json={
+        "nombre": "Cliente Test", "email": "cliente@test.com", "telefono": "1",
+        "direccion": "Calle 1", "cuit_dni": "20-1-3"
+    }).json()
+
+
+def nueva_factura(client, cliente, total_items=10.0, **extra):
+    respuesta = client.post("/api/facturas", json={
+        "numero_factura": extra.pop("numero_factura", f"F-{os.urandom(4).hex()}"),
+        "cliente_id": cliente["id"],
+        "items": [{"descripcion": "Item", "cantidad": 1, "precio_unitario": total_items, "subtotal": total_items}],
+        "fecha_vencimiento": "2030-01-01T00:00:00",
+        **extra
+    })
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+
+def esperar_job(client, respuesta, timeout=10.0):
+    """Poll a job accepted with 202 until it finishes."""
+    assert respuesta.status_code == 202, respuesta.text
+    limite = time.monotonic() + timeout
+    while time.monotonic() < limite:
+        job = client.get(f"/api/jobs/{respuesta.json()['job_id']}").json()
+        if job["estado"] in ("completado", "fallido", "cancelado"):
+            return job
+        time.sleep(0.05)
+    raise AssertionError(f"Job did not finish: {job}")
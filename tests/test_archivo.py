@@ -0,0 +1,62 @@
+from datetime import datetime, timedelta
+
+import server
+
+from .conftest import esperar_job
+
+VIEJA = datetime.utcnow() - timedelta(days=400)
+
+
+def _factura(id, **extra):
+    return {"id": id, "numero_factura": id, "cliente_id": "c1", "items": [], "subtotal": 10.0, "impuestos": 0.0,
+            "total": 10.0, "estado": "pagada", "fecha_emision": VIEJA, "fecha_vencimiento": VIEJA, "version": 1, **extra}
+
+
+def _ids(run, coleccion):
+    return sorted(d["id"] for d in run(lambda: server.db[coleccion].find({}, {"_id": 0, "id": 1}).to_list(None)))
+
+
+def test_closed_old_documents_move_to_the_archive_and_stay_readable(client, run):
+    run(server.db.facturas.insert_many, [_factura("vieja"), _factura("abierta", estado="pendiente"),
+                                         _factura("reciente", fecha_emision=datetime.utcnow())])
+
+    job = esperar_job(client, client.post("/api/archivo/ejecutar", params={"antiguedad_dias": 365}))
+
+    assert job["resultado"]["archivados"]["facturas"] == 1
+    assert _ids(run, "facturas") == ["abierta", "reciente"]
+    assert _ids(run, "facturas_archive") == ["vieja"]
+    assert client.get("/api/facturas/vieja").json()["estado"] == "pagada"
+
+
+def test_document_changed_between_copy_and_delete_stays_live(client, run, monkeypatch):
+    run(server.db.facturas.insert_many, [_factura("f0"), _factura("reabierta"), _factura("editada")])
+    archivo = server.db["facturas_archive"]
+    bulk_write = archivo.bulk_write
+
+    async def copiar_y_editar(operaciones, **kwargs):
+        resultado = await bulk_write(operaciones, **kwargs)
+        monkeypatch.setattr(archivo, "bulk_write", bulk_write)
+        await server.db.facturas.update_one({"id": "reabierta"}, {"$set": {"estado": "pendiente"}, "$inc": {"version": 1}})
+        await server.db.facturas.update_one({"id": "editada"}, {"$set": {"notas": "nueva"}, "$inc": {"version": 1}})
+        return resultado
+
+    monkeypatch.setattr(archivo, "bulk_write", copiar_y_editar)
+    assert run(server.archivar_coleccion, "facturas", 365) == 1
+
+    assert _ids(run, "facturas") == ["editada", "reabierta"]
+    assert _ids(run, "facturas_archive") == ["f0"]
+    assert run(server.db.facturas.find_one, {"id": "editada"})["notas"] == "nueva"
+
+    # Still closed and old: the next run archives its newer state
+    assert run(server.archivar_coleccion, "facturas", 365) == 1
+    assert run(server.db.facturas_archive.find_one, {"id": "editada"})["notas"] == "nueva"
+
+
+def test_copy_left_by_an_interrupted_run_is_refreshed(client, run):
+    actual = _factura("f1", notas="actual", version=2)
+    run(server.db.facturas.insert_one, actual)
+    run(server.db.facturas_archive.insert_one, {**actual, "notas": "vieja copia", "version": 1})
+
+    assert run(server.archivar_coleccion, "facturas", 365) == 1
+    assert _ids(run, "facturas") == []
+    assert run(server.db.facturas_archive.find_one, {"id": "f1"})["notas"] == "actual"
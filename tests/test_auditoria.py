@@ -0,0 +1,41 @@
+import time
+
+import pytest
+
+import server
+
+
+def _eventos(client, coleccion, documento_id, run, esperados=1, timeout=5.0):
+    # Events may sit in the flusher's batch in hand, not only in the queue
+    limite = time.monotonic() + timeout
+    while True:
+        run(server.vaciar_auditoria)
+        eventos = client.get(f"/api/auditoria/{coleccion}/{documento_id}").json()
+        if len(eventos) >= esperados or time.monotonic() > limite:
+            return eventos
+        time.sleep(0.05)
+
+
+def test_every_update_is_audited_with_its_version(client, run, cliente):
+    client.put(f"/api/clientes/{cliente['id']}", json={"nombre": "Cambiado"})
+    eventos = _eventos(client, "clientes", cliente["id"], run, esperados=2)
+    assert sorted(e["accion"] for e in eventos) == ["actualizar", "crear"]
+
+
+def test_aborted_transaction_leaves_no_audit_event(client, run, transacciones):
+    async def abortada():
+        async with server.transaccion():
+            await server.auditar("facturas", "abortada", "actualizar")
+            raise RuntimeError("abort")
+
+    async def confirmada():
+        async with server.transaccion():
+            await server.auditar("facturas", "confirmada", "actualizar")
+
+    with pytest.raises(RuntimeError):
+        run(abortada)
+    run(confirmada)
+
+    # Once the confirmed event is visible, the aborted one would have been flushed with it
+    assert [e["accion"] for e in _eventos(client, "facturas", "confirmada", run)] == ["actualizar"]
+    assert _eventos(client, "facturas", "abortada", run, esperados=0) == []
@@ -0,0 +1,42 @@
+import pytest
+
+import server
+
+from .conftest import esperar_job
+
+
+def test_backup_and_restore_round_trip(client, run, cliente):
+    job = esperar_job(client, client.post("/api/admin/backup", params={"colecciones": "clientes"}))
+    assert job["estado"] == "completado"
+    assert job["resultado"]["colecciones"] == {"clientes": 1}
+    backup = job["resultado"]["backup"]
+    assert [b["backup"] for b in client.get("/api/admin/backups").json()] == [backup]
+
+    client.delete(f"/api/clientes/{cliente['id']}")
+    job = esperar_job(client, client.post("/api/admin/restore", json={"backup": backup, "reemplazar": True}))
+
+    assert job["estado"] == "completado", job["error"]
+    assert client.get(f"/api/clientes/{cliente['id']}").json()["nombre"] == cliente["nombre"]
+    indices = run(server.db.clientes.index_information)
+    assert any(opciones["key"] == [("nombre_busqueda", 1)] for opciones in indices.values())
+
+
+def test_backup_rejects_unknown_and_internal_collections(client, cliente):
+    for colecciones in ["../../etc/passwd", "jobs", "idempotency_keys", "clientes,no_existe"]:
+        respuesta = client.post("/api/admin/backup", params={"colecciones": colecciones})
+        assert respuesta.status_code == 400, colecciones
+
+
+def test_backup_job_refuses_paths_outside_its_directory(client, run, tmp_path, monkeypatch):
+    # Even a name that got past the list check must not escape the backup directory
+    async def respaldables():
+        return ["../fuera"]
+
+    monkeypatch.setattr(server, "colecciones_respaldables", respaldables)
+    with pytest.raises(ValueError, match="Invalid collection name"):
+        run(server.respaldar_base, tmp_path / "backup", "ndjson", ["../fuera"])
+    assert not (tmp_path / "fuera.ndjson.gz").exists()
+
+
+def test_restore_of_unknown_backup_is_404(client):
+    assert client.post("/api/admin/restore", json={"backup": "../backups"}).status_code == 404
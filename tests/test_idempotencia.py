@@ -0,0 +1,74 @@
+import asyncio
+
+import httpx
+from fastapi.testclient import TestClient
+
+import server
+
+CLIENTE = {"nombre": "Idempotente", "email": "i@test.com", "telefono": "1", "direccion": "d", "cuit_dni": "20-2-3"}
+
+
+def _clientes(run):
+    return run(server.db.clientes.count_documents, {})
+
+
+def test_retry_with_the_same_key_replays_the_first_response(client, run):
+    primera = client.post("/api/clientes", json=CLIENTE, headers={"Idempotency-Key": "k1"})
+    segunda = client.post("/api/clientes", json=CLIENTE, headers={"Idempotency-Key": "k1"})
+
+    assert primera.status_code == segunda.status_code == 200
+    assert segunda.headers["Idempotent-Replayed"] == "true"
+    assert segunda.json() == primera.json()
+    assert _clientes(run) == 1
+
+
+def test_same_key_with_another_body_is_rejected(client, run):
+    client.post("/api/clientes", json=CLIENTE, headers={"Idempotency-Key": "k1"})
+    respuesta = client.post("/api/clientes", json={**CLIENTE, "nombre": "Otro"}, headers={"Idempotency-Key": "k1"})
+
+    assert respuesta.status_code == 422
+    assert _clientes(run) == 1
+
+
+def test_keys_are_scoped_per_path(client, run, cliente):
+    client.post("/api/clientes", json=CLIENTE, headers={"Idempotency-Key": "k1"})
+    respuesta = client.post("/api/recibos", json={"numero_recibo": "R-1", "cliente_id": cliente["id"], "monto_total": 5},
+                            headers={"Idempotency-Key": "k1"})
+
+    assert respuesta.status_code == 200
+    assert "Idempotent-Replayed" not in respuesta.headers
+
+
+def test_concurrent_duplicates_run_the_handler_once(client, run):
+    async def enviar_dos():
+        transporte = httpx.ASGITransport(app=server.app)
+        async with httpx.AsyncClient(transport=transporte, base_url="http://testserver") as http:
+            return await asyncio.gather(*[
+                http.post("/api/clientes", json=CLIENTE, headers={"Idempotency-Key": "k-concurrente"}) for _ in range(2)
+            ])
+
+    respuestas = run(enviar_dos)
+
+    assert [r.status_code for r in respuestas] == [200, 200]
+    assert respuestas[0].json()["id"] == respuestas[1].json()["id"]
+    assert _clientes(run) == 1
+
+
+def test_server_errors_release_the_key(client, run, monkeypatch):
+    insert_one = server.db.clientes.insert_one
+    fallas = []
+
+    async def falla_una_vez(documento, **kwargs):
+        if not fallas:
+            fallas.append(documento)
+            raise RuntimeError("storage down")
+        return await insert_one(documento, **kwargs)
+
+    monkeypatch.setattr(server.db.clientes, "insert_one", falla_una_vez)
+    sin_excepciones = TestClient(server.app, raise_server_exceptions=False)
+    assert sin_excepciones.post("/api/clientes", json=CLIENTE, headers={"Idempotency-Key": "k1"}).status_code == 500
+    respuesta = client.post("/api/clientes", json=CLIENTE, headers={"Idempotency-Key": "k1"})
+
+    assert respuesta.status_code == 200
+    assert "Idempotent-Replayed" not in respuesta.headers
+    assert _clientes(run) == 1
@@ -0,0 +1,40 @@
+import pytest
+
+from .conftest import esperar_job
+
+
+def _exportar(client, filtro, coleccion="clientes"):
+    return client.post("/api/jobs", json={"tipo": "exportar_coleccion", "parametros": {"coleccion": coleccion, "filtro": filtro}})
+
+
+@pytest.mark.parametrize("filtro", [
+    {"$where": "sleep(1000)"},
+    {"$expr": {"$gt": ["$a", 1]}},
+    {"nombre": {"$where": "1"}},
+    {"nombre": {"$regex": ".*"}},
+    {"nombre": {"$function": {}}},
+    {"campo_inexistente": 1},
+    {"nombre": {"$in": "no-lista"}},
+    {"nombre": {"$eq": {"$ne": None}}},
+    "no-objeto",
+])
+def test_export_filter_rejects_operators_and_unknown_fields(client, filtro):
+    assert _exportar(client, filtro).status_code == 400
+
+
+def test_export_filter_accepts_equality_and_ranges(client, cliente):
+    client.post("/api/clientes", json={**{k: cliente[k] for k in ("email", "telefono", "direccion", "cuit_dni")}, "nombre": "Otro"})
+    job = esperar_job(client, _exportar(client, {
+        "nombre": {"$in": [cliente["nombre"]]}, "fecha_creacion": {"$gte": "2000-01-01T00:00:00"}
+    }))
+    assert job["estado"] == "completado", job["error"]
+    assert job["resultado"]["documentos"] == 1
+
+
+def test_internal_job_types_cannot_be_enqueued(client):
+    for tipo in ["restore", "backup", "archivar", "no_existe"]:
+        assert client.post("/api/jobs", json={"tipo": tipo, "parametros": {}}).status_code == 400
+
+
+def test_unknown_collection_is_not_exported(client):
+    assert _exportar(client, {}, coleccion="jobs").status_code == 400
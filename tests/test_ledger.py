@@ -0,0 +1,70 @@
+import pytest
+from pymongo.errors import BulkWriteError
+
+import server
+
+from .conftest import SesionFalsa, nueva_factura
+
+
+def _movimiento(**extra):
+    return server.MovimientoCuentaCorriente(**{
+        "cliente_id": "c1", "tipo_movimiento": "pago", "documento_id": "r1", "numero_documento": "R-1", "haber": 10.0,
+        **extra
+    })
+
+
+def _error_duplicado(*args, **kwargs):
+    raise BulkWriteError({"writeErrors": [{"index": 0, "code": 11000, "errmsg": "duplicate key"}], "nUpserted": 0})
+
+
+def test_posting_is_idempotent_by_clave(client, run):
+    assert run(server.contabilizar, [_movimiento()]) == 1
+    assert run(server.contabilizar, [_movimiento(haber=99.0)]) == 0
+    movimientos = run(lambda: server.db.movimientos_cc.find({}, {"_id": 0}).to_list(None))
+    assert [(m["clave"], m["haber"]) for m in movimientos] == [("pago:r1", 10.0)]
+
+
+def test_duplicate_key_is_tolerated_only_outside_a_transaction(client, run, monkeypatch):
+    monkeypatch.setattr(server.db.movimientos_cc, "bulk_write", _error_duplicado)
+    assert run(server.contabilizar, [_movimiento()]) == 0
+    with pytest.raises(BulkWriteError):
+        run(lambda: server.contabilizar([_movimiento()], session=SesionFalsa()))
+
+
+def test_transaction_aborted_by_a_concurrent_posting_is_retried(client, cliente, transacciones, monkeypatch):
+    bulk_write = server.db.movimientos_cc.bulk_write
+    intentos = []
+
+    async def primero_duplicado(operaciones, **kwargs):
+        intentos.append(len(operaciones))
+        if len(intentos) == 1:
+            _error_duplicado()
+        return await bulk_write(operaciones, **kwargs)
+
+    monkeypatch.setattr(server.db.movimientos_cc, "bulk_write", primero_duplicado)
+    respuesta = client.post("/api/recibos", json={"numero_recibo": "R-1", "cliente_id": cliente["id"], "monto_total": 10})
+
+    assert respuesta.status_code == 200
+    assert len(intentos) == 2
+    cuenta = client.get(f"/api/cuentas-corrientes/{cliente['id']}").json()
+    assert [m["tipo_movimiento"] for m in cuenta["movimientos"]] == ["pago"]
+
+
+def test_recibo_anulado_twice_reverses_once(client, cliente):
+    recibo = client.post("/api/recibos", json={"numero_recibo": "R-1", "cliente_id": cliente["id"], "monto_total": 25}).json()
+    assert client.put(f"/api/recibos/{recibo['id']}/anular").status_code == 200
+    assert client.put(f"/api/recibos/{recibo['id']}/anular").status_code == 200
+
+    cuenta = client.get(f"/api/cuentas-corrientes/{cliente['id']}").json()
+    assert sorted(m["tipo_movimiento"] for m in cuenta["movimientos"]) == ["anulacion_pago", "pago"]
+    assert cuenta["saldo_actual"] == 0
+
+
+def test_deleting_a_factura_posts_its_reversal(client, cliente):
+    factura = nueva_factura(client, cliente)
+    assert client.get(f"/api/cuentas-corrientes/{cliente['id']}").json()["saldo_actual"] == -factura["total"]
+
+    assert client.delete(f"/api/facturas/{factura['id']}").status_code == 200
+    cuenta = client.get(f"/api/cuentas-corrientes/{cliente['id']}").json()
+    assert sorted(m["tipo_movimiento"] for m in cuenta["movimientos"]) == ["anulacion_factura", "factura"]
+    assert cuenta["saldo_actual"] == 0
@@ -0,0 +1,25 @@
+import server
+
+
+def test_backfill_uses_the_python_normalizers(client, run):
+    run(server.db.compras.insert_many, [
+        {"id": "sin-clave", "proveedor": "  ÑANDÚ S.A. "},
+        # Written by the old $toLower/$trim backfill, which left Ñ and Ú alone
+        {"id": "clave-vieja", "proveedor": "ÑANDÚ S.A.", "proveedor_key": "Ñandú s.a."},
+    ])
+    run(server.db.clientes.insert_one, {"id": "c-viejo", "nombre": "ÁLVAREZ ", "cuit_dni": "1"})
+
+    run(server.create_indexes)
+
+    claves = {c["id"]: c["proveedor_key"] for c in run(lambda: server.db.compras.find({}, {"_id": 0}).to_list(None))}
+    assert claves == {"sin-clave": "ñandú s.a.", "clave-vieja": "ñandú s.a."}
+    assert run(server.db.clientes.find_one, {"id": "c-viejo"})["nombre_busqueda"] == "álvarez"
+    # A second run has nothing left to fix
+    assert run(server.rellenar_normalizado, server.db.compras, "proveedor", "proveedor_key", server.normalizar_proveedor) == 0
+
+
+def test_search_matches_accented_names_by_prefix(client):
+    client.post("/api/clientes", json={"nombre": "ÑANDÚ S.A.", "email": "n@test.com", "telefono": "1",
+                                      "direccion": "d", "cuit_dni": "30-1-2"})
+    resultados = client.get("/api/search", params={"q": "ñandú"}).json()["resultados"]["clientes"]
+    assert [c["nombre"] for c in resultados] == ["ÑANDÚ S.A."]
@@ -0,0 +1,64 @@
+from datetime import datetime, timedelta
+
+import server
+
+
+def _articulo(client, precio=100.0):
+    respuesta = client.post("/api/articulos", json={"nombre": "Tornillo", "codigo": "T-1", "precio": precio})
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json()
+
+
+def _precio(client, articulo, fecha=None):
+    params = {"fecha": fecha.isoformat()} if fecha else {}
+    return client.get(f"/api/articulos/{articulo['id']}/precio", params=params)
+
+
+def test_scheduled_version_applies_only_from_its_date(client):
+    articulo = _articulo(client)
+    desde = datetime.utcnow() + timedelta(days=30)
+    respuesta = client.post(f"/api/articulos/{articulo['id']}/versiones-precio",
+                            json={"precio": 150.0, "vigencia_desde": desde.isoformat()})
+    assert respuesta.status_code == 200
+    assert respuesta.json()["aplicado"] is False
+
+    assert _precio(client, articulo).json()["precio"] == 100.0
+    assert _precio(client, articulo, desde + timedelta(seconds=1)).json()["precio"] == 150.0
+    assert client.get(f"/api/articulos/{articulo['id']}").json()["precio"] == 100.0
+
+
+def test_version_in_the_past_closes_the_open_range(client):
+    articulo = _articulo(client)
+    client.post(f"/api/articulos/{articulo['id']}/versiones-precio", json={"precio": 120.0})
+
+    versiones = client.get(f"/api/articulos/{articulo['id']}/versiones-precio").json()
+    assert [(v["precio"], v["vigencia_hasta"] is None) for v in versiones] == [(120.0, True), (100.0, False)]
+    assert client.get(f"/api/articulos/{articulo['id']}").json()["precio"] == 120.0
+    antes = datetime.fromisoformat(versiones[0]["vigencia_desde"]) - timedelta(milliseconds=1)
+    assert _precio(client, articulo, antes).json()["precio"] == 100.0
+
+
+def test_no_price_before_the_first_version(client):
+    articulo = _articulo(client)
+    assert _precio(client, articulo, datetime(2000, 1, 1)).status_code == 404
+
+
+def test_current_price_sees_versions_written_by_another_worker(client, run):
+    articulo = _articulo(client)
+    assert _precio(client, articulo).json()["precio"] == 100.0
+
+    # Written straight to the store, as another process would
+    async def registrar_fuera():
+        await server.registrar_precios({articulo["id"]: 80.0}, datetime.utcnow(), "manual")
+    run(registrar_fuera)
+
+    assert _precio(client, articulo).json()["precio"] == 80.0
+
+
+def test_startup_backfill_keeps_the_articulo_tenant(client, run):
+    run(server.db.articulos.insert_one, {"id": "a-t1", "nombre": "x", "precio": 5.0, "tenant_id": "t1"})
+    run(server.create_indexes)
+
+    version = run(server.db.precios_articulos.find_one, {"articulo_id": "a-t1"})
+    assert version["origen"] == "inicial"
+    assert version["tenant_id"] == "t1"
@@ -0,0 +1,82 @@
+import server
+
+from .conftest import nueva_factura
+
+
+def _filas(run):
+    return run(lambda: server.db.ranking_clientes.find({}, {"_id": 0}).to_list(None))
+
+
+def test_rebuild_fixes_drifted_rows_and_drops_orphans(client, run, cliente):
+    factura = nueva_factura(client, cliente)
+    run(server.db.ranking_clientes.update_one, {"cliente_id": cliente["id"]}, {"$set": {"facturado": 999.0}})
+    run(server.db.ranking_clientes.insert_one, {"periodo": "2020-01", "cliente_id": "huerfano", "facturado": 1.0})
+
+    resultado = run(server.reconstruir_rankings)
+
+    assert resultado["conflictos"] == 0
+    filas = _filas(run)
+    assert [(f["cliente_id"], f["facturado"], f["facturas"]) for f in filas] == [
+        (cliente["id"], factura["total"], 1)
+    ]
+
+
+def test_increment_between_scan_and_write_is_not_lost(client, run, cliente, monkeypatch):
+    factura = nueva_factura(client, cliente)
+    run(server.db.ranking_clientes.update_one, {"cliente_id": cliente["id"]}, {"$set": {"facturado": 999.0}})
+    escanear = server._escanear_rankings
+    escaneos = []
+
+    async def escanear_e_intercalar(ctx=None):
+        filas = await escanear(ctx)
+        if not escaneos:
+            otra = server.Factura(**{**factura, "id": "otra", "numero_factura": "F-otra", "total": 7.0, "items": []})
+            await server.db.facturas.insert_one(server.to_storage(otra))
+            await server.acumular_facturas_ranking([otra], 1)
+        escaneos.append(filas)
+        return filas
+
+    monkeypatch.setattr(server, "_escanear_rankings", escanear_e_intercalar)
+    resultado = run(server.reconstruir_rankings)
+
+    # The moved row was rescanned instead of overwritten with the stale scan
+    assert len(escaneos) == 2
+    assert resultado["conflictos"] == 0
+    [fila] = _filas(run)
+    assert fila["facturado"] == round(factura["total"] + 7.0, 2)
+    assert fila["facturas"] == 2
+
+
+def test_row_that_keeps_moving_is_left_to_increments(client, run, cliente, monkeypatch):
+    factura = nueva_factura(client, cliente)
+    escanear = server._escanear_rankings
+
+    async def escanear_e_intercalar(ctx=None):
+        filas = await escanear(ctx)
+        await server.acumular_cobro_ranking({
+            "fecha_pago": server.Factura(**factura).fecha_emision, "cliente_id": cliente["id"], "monto_total": 1.0
+        })
+        return filas
+
+    monkeypatch.setattr(server, "_escanear_rankings", escanear_e_intercalar)
+    resultado = run(server.reconstruir_rankings)
+
+    assert resultado["conflictos"] == 1
+    [fila] = _filas(run)
+    assert fila["cobrado"] == server.RANKING_RECONSTRUCCION_INTENTOS * 1.0
+    assert fila["facturado"] == factura["total"]
+
+
+def test_anulado_recibo_undoes_its_cobro_and_is_left_out_of_rebuilds(client, run, cliente):
+    recibo = client.post("/api/recibos", json={"numero_recibo": "R-1", "cliente_id": cliente["id"], "monto_total": 40}).json()
+    client.post("/api/recibos", json={"numero_recibo": "R-2", "cliente_id": cliente["id"], "monto_total": 10})
+    client.put(f"/api/recibos/{recibo['id']}/anular")
+    anio = recibo["fecha_pago"][:4]
+
+    def cobrado():
+        ranking = client.get("/api/reportes/ranking/clientes", params={"criterio": "cobrado", "anio": anio}).json()["ranking"]
+        return [fila["cobrado"] for fila in ranking]
+
+    assert cobrado() == [10.0]
+    run(server.reconstruir_rankings)
+    assert cobrado() == [10.0]
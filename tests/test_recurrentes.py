@@ -0,0 +1,81 @@
+from datetime import datetime
+
+import pytest
+
+import server
+
+ITEMS = [{"descripcion": "Abono", "cantidad": 1, "precio_unitario": 100, "subtotal": 100}]
+
+
+def _periodos_hasta_hoy(desde):
+    periodos = []
+    periodo = desde
+    while periodo <= datetime.utcnow():
+        periodos.append(periodo)
+        periodo = server.siguiente_periodo(periodo, "mensual", desde.day)
+    return periodos
+
+
+def _plantilla(client, cliente, meses_atras=3, **extra):
+    hoy = datetime.utcnow()
+    mes = hoy.month - 1 - meses_atras
+    desde = datetime(hoy.year + mes // 12, mes % 12 + 1, 10)
+    respuesta = client.post("/api/facturas-recurrentes", json={
+        "cliente_id": cliente["id"], "items": ITEMS, "proxima_emision": desde.isoformat(), **extra
+    })
+    assert respuesta.status_code == 200, respuesta.text
+    return respuesta.json(), _periodos_hasta_hoy(desde)
+
+
+def test_missed_periods_are_caught_up_once(client, run, cliente):
+    plantilla, periodos = _plantilla(client, cliente)
+
+    resumen = client.post("/api/facturas-recurrentes/ejecutar").json()
+    assert resumen["facturas_emitidas"] == len(periodos)
+    assert client.post("/api/facturas-recurrentes/ejecutar").json()["facturas_emitidas"] == 0
+
+    facturas = run(lambda: server.db.facturas.find({"recurrencia_id": plantilla["id"]}, {"_id": 0}).to_list(None))
+    assert sorted(f["periodo"] for f in facturas) == periodos
+    assert all(f["total"] == 121.0 for f in facturas)
+    actualizada = client.get(f"/api/facturas-recurrentes/{plantilla['id']}").json()
+    assert actualizada["emitidas"] == len(periodos)
+    assert datetime.fromisoformat(actualizada["proxima_emision"]) > datetime.utcnow()
+
+
+@pytest.mark.parametrize("en_transaccion", [False, True])
+def test_run_that_died_before_advancing_does_not_bill_twice(client, run, cliente, request, en_transaccion):
+    if en_transaccion:
+        request.getfixturevalue("transacciones")
+    plantilla, periodos = _plantilla(client, cliente)
+    client.post("/api/facturas-recurrentes/ejecutar")
+    # As if the first run had crashed after inserting its facturas
+    run(server.db.facturas_recurrentes.update_one, {"id": plantilla["id"]},
+        {"$set": {"proxima_emision": periodos[0], "emitidas": 0}})
+
+    resumen = client.post("/api/facturas-recurrentes/ejecutar").json()
+
+    assert resumen["facturas_emitidas"] == 0
+    assert resumen["periodos_ya_emitidos"] == len(periodos)
+    assert run(server.db.facturas.count_documents, {"recurrencia_id": plantilla["id"]}) == len(periodos)
+    assert run(server.db.movimientos_cc.count_documents, {"tipo_movimiento": "factura"}) == len(periodos)
+
+
+def test_failing_template_is_deactivated_without_blocking_the_others(client, run, cliente):
+    rota, _ = _plantilla(client, cliente)
+    sana, periodos = _plantilla(client, cliente)
+    run(server.db.facturas_recurrentes.update_one, {"id": rota["id"]}, {"$set": {"porcentaje_iva": 5.0}})
+
+    resumen = client.post("/api/facturas-recurrentes/ejecutar").json()
+
+    assert resumen["con_error"] == 1
+    assert resumen["facturas_emitidas"] == len(periodos)
+    rota = client.get(f"/api/facturas-recurrentes/{rota['id']}").json()
+    assert rota["activa"] is False
+    assert "Invalid IVA rate" in rota["ultimo_error"]
+    assert run(server.db.facturas_recurrentes.count_documents, {"claim": {"$ne": None}}) == 0
+
+
+def test_update_validates_the_merged_template(client, cliente):
+    plantilla, _ = _plantilla(client, cliente)
+    respuesta = client.put(f"/api/facturas-recurrentes/{plantilla['id']}", json={"porcentaje_iva": 5})
+    assert respuesta.status_code == 400
@@ -0,0 +1,110 @@
+import asyncio
+from collections import OrderedDict
+
+import jwt
+import pytest
+from pymongo import InsertOne, ReplaceOne, UpdateOne, DeleteOne
+
+import server
+from memory_storage import MemoryClient
+
+
+@pytest.fixture
+def tenant_db():
+    return server.TenantDatabase(MemoryClient()["tenants"])
+
+
+def _como(tenant, corrutina):
+    async def ejecutar():
+        token = server.current_tenant.set(tenant)
+        try:
+            return await corrutina()
+        finally:
+            server.current_tenant.reset(token)
+    return asyncio.run(ejecutar())
+
+
+def _todos(tenant_db, coleccion="docs"):
+    documentos = asyncio.run(tenant_db._database[coleccion].find({}, {"_id": 0}).to_list(None))
+    return sorted((d.get("tenant_id"), d.get("k"), d.get("v")) for d in documentos)
+
+
+def test_reads_and_writes_only_see_the_current_tenant(tenant_db):
+    _como("t1", lambda: tenant_db.docs.insert_one({"k": 1, "v": "uno"}))
+    _como("t2", lambda: tenant_db.docs.insert_one({"k": 1, "v": "dos"}))
+
+    assert _como("t1", lambda: tenant_db.docs.find({"k": 1}, {"_id": 0, "v": 1}).to_list(None)) == [{"v": "uno"}]
+    _como("t2", lambda: tenant_db.docs.update_many({}, {"$set": {"v": "cambiado"}}))
+    _como("t1", lambda: tenant_db.docs.delete_many({}))
+    assert _todos(tenant_db) == [("t2", 1, "cambiado")]
+
+
+def test_bulk_write_stamps_replacements_and_upserts(tenant_db):
+    operaciones = [
+        InsertOne({"k": 1}),
+        ReplaceOne({"k": 2}, {"k": 2, "v": "reemplazo"}, upsert=True),
+        UpdateOne({"$or": [{"k": 3}]}, {"$set": {"k": 3}}, upsert=True),
+        UpdateOne({"k": 4}, [{"$set": {"v": "pipeline"}}], upsert=True),
+    ]
+    _como("t1", lambda: tenant_db.docs.bulk_write(operaciones))
+
+    assert _todos(tenant_db) == [("t1", 1, None), ("t1", 2, "reemplazo"), ("t1", 3, None), ("t1", 4, "pipeline")]
+    # The caller's operations are not modified
+    assert operaciones[1]._doc == {"k": 2, "v": "reemplazo"}
+    assert "$setOnInsert" not in operaciones[2]._doc
+
+
+def test_bulk_write_cannot_touch_another_tenant(tenant_db):
+    _como("t1", lambda: tenant_db.docs.insert_one({"k": 1, "v": "t1"}))
+    _como("t2", lambda: tenant_db.docs.bulk_write([
+        ReplaceOne({"k": 1}, {"k": 1, "v": "t2"}, upsert=True),
+        DeleteOne({"k": 1, "v": "t1"}),
+    ]))
+    assert _todos(tenant_db) == [("t1", 1, "t1"), ("t2", 1, "t2")]
+
+
+def test_aggregate_merge_stays_inside_the_tenant(tenant_db):
+    _como("t1", lambda: tenant_db.docs.insert_many([{"k": 1, "v": 2}, {"k": 1, "v": 3}]))
+    _como("t2", lambda: tenant_db.docs.insert_one({"k": 1, "v": 100}))
+    _como("t2", lambda: tenant_db.totales.insert_one({"k": 1, "v": 100}))
+
+    _como("t1", lambda: tenant_db.docs.aggregate([
+        {"$group": {"_id": "$k", "v": {"$sum": "$v"}}},
+        {"$project": {"_id": 0, "k": "$_id", "v": 1}},
+        {"$merge": {"into": "totales", "on": "k", "whenMatched": "replace"}}
+    ]).to_list(None))
+
+    assert _todos(tenant_db, "totales") == [("t1", 1, 5), ("t2", 1, 100)]
+
+
+def test_without_a_tenant_operations_pass_through(tenant_db):
+    asyncio.run(tenant_db.docs.insert_one({"k": 1}))
+    assert _todos(tenant_db) == [(None, 1, None)]
+
+
+def test_per_tenant_registries_are_bounded(monkeypatch):
+    monkeypatch.setattr(server, "TENANT_TRACKED_MAX", 2)
+    registro = OrderedDict()
+    for tenant in ["a", "b", "a", "c"]:
+        server._registro_lru(registro, tenant, dict)
+    assert list(registro) == ["a", "c"]
+
+
+@pytest.fixture
+def multi_tenant(monkeypatch):
+    monkeypatch.setattr(server, "MULTI_TENANT", True)
+    monkeypatch.setattr(server, "TENANT_JWT_SECRET", "secreto")
+
+
+def test_signed_token_is_required_when_a_secret_is_set(client, multi_tenant):
+    sin_token = client.get("/api/status", headers={"X-Tenant-ID": "t1"})
+    assert sin_token.status_code == 401
+    assert sin_token.headers["WWW-Authenticate"] == "Bearer"
+
+    invalido = jwt.encode({"tenant_id": "t1"}, "otro", algorithm="HS256")
+    assert client.get("/api/status", headers={"Authorization": f"Bearer {invalido}"}).status_code == 401
+    sin_claim = jwt.encode({"sub": "x"}, "secreto", algorithm="HS256")
+    assert client.get("/api/status", headers={"Authorization": f"Bearer {sin_claim}"}).status_code == 401
+
+    valido = jwt.encode({"tenant_id": "t1"}, "secreto", algorithm="HS256")
+    assert client.get("/api/status", headers={"Authorization": f"Bearer {valido}"}).status_code == 200
@@ -0,0 +1,39 @@
+import pytest
+from fastapi import HTTPException
+
+import server
+
+
+def _items(*lineas):
+    return [server.ItemPedido(descripcion=f"i{n}", cantidad=cantidad, precio_unitario=precio, subtotal=round(cantidad * precio, 2),
+                              alicuota_iva=alicuota)
+            for n, (cantidad, precio, alicuota) in enumerate(lineas)]
+
+
+def test_iva_is_computed_per_rate():
+    totales = server.calcular_totales(_items((1, 100, None), (2, 50, 10.5)))
+    assert (totales.subtotal, totales.impuestos, totales.total) == (200.0, 31.5, 231.5)
+    assert [(d.alicuota, d.base_imponible, d.importe) for d in totales.impuestos_detalle] == [(10.5, 100.0, 10.5), (21.0, 100.0, 21.0)]
+
+
+@pytest.mark.parametrize("tipo, condicion", [("C", "Responsable Inscripto"), ("A", "Exento")])
+def test_factura_c_and_exempt_clients_pay_no_iva(tipo, condicion):
+    totales = server.calcular_totales(_items((1, 100, 21.0)), tipo, condicion)
+    assert (totales.impuestos, totales.total) == (0.0, 100.0)
+
+
+def test_invalid_rate_and_subtotal_mismatch_are_rejected():
+    with pytest.raises(HTTPException, match="Invalid IVA rate"):
+        server.calcular_totales(_items((1, 100, 5.0)))
+    item = server.ItemPedido(descripcion="x", cantidad=2, precio_unitario=10, subtotal=25)
+    with pytest.raises(HTTPException, match="subtotal mismatch"):
+        server.calcular_totales([item])
+
+
+def test_exempt_presupuesto_is_stored_without_iva(client, cliente):
+    presupuesto = client.post("/api/presupuestos", json={
+        "numero_presupuesto": "P-1", "cliente_id": cliente["id"], "condicion_iva": "Exento",
+        "items": [{"descripcion": "x", "cantidad": 1, "precio_unitario": 100, "subtotal": 100}],
+        "fecha_vencimiento": "2030-01-01T00:00:00"
+    }).json()
+    assert (presupuesto["impuestos"], presupuesto["total"], presupuesto["condicion_iva"]) == (0.0, 100.0, "Exento")
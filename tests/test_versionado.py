@@ -0,0 +1,43 @@
+def _actualizar(client, cliente, nombre, if_match=None):
+    headers = {"If-Match": if_match} if if_match is not None else {}
+    return client.put(f"/api/clientes/{cliente['id']}", json={"nombre": nombre}, headers=headers)
+
+
+def test_update_returns_the_new_version_as_etag(client, cliente):
+    respuesta = _actualizar(client, cliente, "Nuevo", '"1"')
+
+    assert respuesta.status_code == 200
+    assert respuesta.headers["ETag"] == '"2"'
+    assert respuesta.json()["version"] == 2
+
+
+def test_stale_if_match_is_rejected_with_412(client, cliente):
+    assert _actualizar(client, cliente, "Primero", '"1"').status_code == 200
+    respuesta = _actualizar(client, cliente, "Segundo", '"1"')
+
+    assert respuesta.status_code == 412
+    assert client.get(f"/api/clientes/{cliente['id']}").json()["nombre"] == "Primero"
+
+
+def test_missing_document_is_404_even_with_if_match(client):
+    assert _actualizar(client, {"id": "no-existe"}, "X", '"1"').status_code == 404
+
+
+def test_weak_and_wildcard_etags(client, cliente):
+    assert _actualizar(client, cliente, "Debil", 'W/"1"').status_code == 200
+    assert _actualizar(client, cliente, "Cualquiera", "*").status_code == 200
+    assert _actualizar(client, cliente, "Sin condicion").status_code == 200
+    assert client.get(f"/api/clientes/{cliente['id']}").json()["version"] == 4
+
+
+def test_malformed_if_match_is_400(client, cliente):
+    assert _actualizar(client, cliente, "X", "abc").status_code == 400
+
+
+def test_if_match_guards_state_transitions_that_post_to_the_ledger(client, cliente):
+    recibo = client.post("/api/recibos", json={"numero_recibo": "R-1", "cliente_id": cliente["id"], "monto_total": 5}).json()
+    assert client.put(f"/api/recibos/{recibo['id']}/anular", headers={"If-Match": '"7"'}).status_code == 412
+
+    # The rejected anulacion posted nothing
+    cuenta = client.get(f"/api/cuentas-corrientes/{cliente['id']}").json()
+    assert [m["tipo_movimiento"] for m in cuenta["movimientos"]] == ["pago"]